@@ -1,9 +1,16 @@
 from django.contrib import admin
-from app_run.models import Run, Challenge, AthleteInfo, Position, CollectibleItem, Subscription
+from app_run.models import Run, Challenge, AthleteInfo, Position, CollectibleItem, Subscription, ImportJob, \
+    AthleteStats, CoachAnalytics, RunTrack, LeaderboardEntry, TrainingRollup
 
 admin.site.register(Run)
 admin.site.register(Challenge)
 admin.site.register(AthleteInfo)
 admin.site.register(Position)
 admin.site.register(CollectibleItem)
-admin.site.register(Subscription)
\ No newline at end of file
+admin.site.register(Subscription)
+admin.site.register(ImportJob)
+admin.site.register(AthleteStats)
+admin.site.register(CoachAnalytics)
+admin.site.register(RunTrack)
+admin.site.register(LeaderboardEntry)
+admin.site.register(TrainingRollup)
@@ -0,0 +1,48 @@
+from .models import AthleteStats, CoachAnalytics
+
+
+def _average_speed(stats):
+    return stats.speed_sum / stats.finished_runs if stats.finished_runs else 0
+
+
+def rebuild_coach_analytics(coach_id):
+    # Один запрос по счетчикам бегунов тренера и один проход по ним
+    leaders = {'longest_run_value': None, 'longest_run_user': None,
+               'total_run_value': None, 'total_run_user': None,
+               'speed_avg_value': None, 'speed_avg_user': None}
+    for stats in AthleteStats.objects.filter(user__coaches__coach_id=coach_id):
+        if leaders['longest_run_value'] is None or stats.longest_distance > leaders['longest_run_value']:
+            leaders['longest_run_value'], leaders['longest_run_user'] = stats.longest_distance, stats.user_id
+        if leaders['total_run_value'] is None or stats.total_distance > leaders['total_run_value']:
+            leaders['total_run_value'], leaders['total_run_user'] = stats.total_distance, stats.user_id
+        average_speed = _average_speed(stats)
+        if leaders['speed_avg_value'] is None or average_speed > leaders['speed_avg_value']:
+            leaders['speed_avg_value'], leaders['speed_avg_user'] = average_speed, stats.user_id
+    analytics, created = CoachAnalytics.objects.update_or_create(coach_id=coach_id, defaults=leaders)
+    return analytics
+
+
+def update_coach_analytics(stats):
+    # Вызывается после обновления AthleteStats при финише забега. Самый длинный забег и сумма
+    # дистанций у бегуна только растут, поэтому достаточно сравнить его с текущим лидером;
+    # полный пересчет нужен, только если упала средняя скорость бегуна-лидера.
+    average_speed = _average_speed(stats)
+    for analytics in CoachAnalytics.objects.select_for_update().filter(coach__athletes__athlete_id=stats.user_id):
+        if analytics.speed_avg_user == stats.user_id and average_speed < analytics.speed_avg_value:
+            rebuild_coach_analytics(analytics.coach_id)
+            continue
+        if analytics.longest_run_value is None or stats.longest_distance > analytics.longest_run_value \
+                or analytics.longest_run_user == stats.user_id:
+            analytics.longest_run_value, analytics.longest_run_user = stats.longest_distance, stats.user_id
+        if analytics.total_run_value is None or stats.total_distance > analytics.total_run_value \
+                or analytics.total_run_user == stats.user_id:
+            analytics.total_run_value, analytics.total_run_user = stats.total_distance, stats.user_id
+        if analytics.speed_avg_value is None or average_speed > analytics.speed_avg_value \
+                or analytics.speed_avg_user == stats.user_id:
+            analytics.speed_avg_value, analytics.speed_avg_user = average_speed, stats.user_id
+        analytics.save()
+
+
+def reset_coach_analytics(coach_id):
+    # При изменении состава бегунов снимок пересчитается при следующем запросе
+    CoachAnalytics.objects.filter(coach_id=coach_id).delete()
@@ -0,0 +1,200 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+
+from .caching import abump_version
+from .models import Run, Position
+from .serializers import PositionAsyncSerializer, PositionSerializer, CollectibleCheckSerializer
+from .ingest import ingest_mode, get_position_buffer, BUFFERED
+from .roster import abump_rosters
+from .services import stop_run
+from .spatial import acollect_nearby_items
+from .live import feed, publish_positions, position_event, finished_event, FINISHED_EVENT
+
+
+# Асинхронные версии частых запросов устройств для запуска под ASGI: ожидание базы
+# не занимает поток, поэтому один процесс держит тысячи одновременных соединений.
+# В async ORM нет транзакций и select_for_update, поэтому запись позиции и завершение
+# забега выполняются в потоке через sync_to_async, теми же транзакциями, что и в views
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+def _not_found():
+    return JsonResponse({'detail': 'Не найдено.'}, status=404)
+
+
+@require_POST
+async def position_create_view(request):
+    serializer = PositionAsyncSerializer(data=_request_data(request))
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    data = serializer.validated_data
+    run_id = data.pop('run')
+    if ingest_mode() == BUFFERED:
+        return await _buffer_position(run_id, data)
+
+    try:
+        position = await sync_to_async(_create_position)(run_id, data)
+    except Run.DoesNotExist:
+        return _not_found()
+    if position is None:
+        return JsonResponse({'non_field_errors': ['Забег должен быть начат и еще не закончен']}, status=400)
+    await acollect_nearby_items(position.run.athlete, [(position.latitude, position.longitude)])
+    return JsonResponse(PositionSerializer(position).data, status=201)
+
+
+def _create_position(run_id, data):
+    # Как PositionViewSet.perform_create: счетчики и вставка под блокировкой строки забега,
+    # иначе параллельные точки продлевают трек не в том порядке, в котором записаны.
+    # None, если забег не в процессе
+    with transaction.atomic():
+        run = Run.objects.select_for_update(of=('self',)).select_related('athlete').get(id=run_id)
+        if run.status != 'in_progress':
+            return None
+        position = Position(run=run, **data)
+        run.add_position(position)
+        position.save()
+        run.save(update_fields=Run.STATS_FIELDS)
+        publish_positions(run.id)
+    return position
+
+
+async def _buffer_position(run_id, data):
+    # Как PositionViewSet.create в буферизованном режиме: точка уходит в журнал процесса
+    run = await Run.objects.select_related('athlete').filter(id=run_id).afirst()
+    if run is None:
+        return _not_found()
+    if run.status != 'in_progress':
+        return JsonResponse({'non_field_errors': ['Забег должен быть начат и еще не закончен']}, status=400)
+    # Запись в журнал - блокирующий write и flush, а первое обращение к буферу еще и дописывает
+    # журналы упавших процессов в базу, поэтому все это выполняется в потоке, а не в цикле событий
+    await sync_to_async(_append_to_buffer)(run.id, data)
+    await acollect_nearby_items(run.athlete, [(data['latitude'], data['longitude'])])
+    return JsonResponse(PositionAsyncSerializer({'run': run.id, **data}).data, status=202)
+
+
+def _append_to_buffer(run_id, data):
+    get_position_buffer().append(run_id, data['latitude'], data['longitude'], data['date_time'])
+
+
+@require_POST
+async def run_start_view(request, run_id):
+    if await Run.objects.filter(id=run_id, status='init').aupdate(status='in_progress'):
+        # Сигналы на update не отправляются, версии для кеша ответов меняем сами
+        await abump_version(Run)
+        await abump_rosters(await Run.objects.filter(id=run_id).values_list('athlete_id', flat=True).aget())
+        return JsonResponse({'message': 'Все ништяк'})
+    if not await Run.objects.filter(id=run_id).aexists():
+        return _not_found()
+    return JsonResponse({'message': 'Этот забег стартовать нельзя, он уже стартовал'}, status=400)
+
+
+@require_POST
+async def run_stop_view(request, run_id):
+    # Отказ проверяется без блокировок. Само завершение - одна транзакция со счетчиками атлета,
+    # челленджами и аналитикой, которой нет в async ORM, поэтому оно выполняется в потоке
+    run_status = await Run.objects.filter(id=run_id).values_list('status', flat=True).afirst()
+    if run_status is None:
+        return _not_found()
+    if run_status == 'in_progress' and await sync_to_async(stop_run)(run_id):
+        return JsonResponse({'message': 'Все ништяк'})
+    return JsonResponse({'message': 'Этот забег финишировать нельзя, он еще не стартовал или уже завершен'},
+                        status=400)
+
+
+@require_POST
+async def collectible_check_view(request):
+    # Собирает предметы рядом с точкой без сохранения позиции
+    serializer = CollectibleCheckSerializer(data=_request_data(request))
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    data = serializer.validated_data
+    athlete = await User.objects.filter(id=data['athlete']).afirst()
+    if athlete is None:
+        return _not_found()
+    collected = await acollect_nearby_items(athlete, [(data['latitude'], data['longitude'])])
+    return JsonResponse({'collected': sorted(collected)})
+
+
+def _last_event_id(request):
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_id') or '0'
+    return int(value) if value.isdigit() else 0
+
+
+async def _missed_positions(run, last_id):
+    if run.status == 'finished':
+        # Позиции завершенного забега могли остаться только в упакованном треке
+        return [position for position in await sync_to_async(run.track_positions)() if position.id > last_id]
+    return [position async for position in Position.objects.filter(run=run, id__gt=last_id).order_by('id')]
+
+
+async def _catch_up(run_id, last_id):
+    # Все точки после last_id, свои и других процессов, и финиш. None, если забег удален
+    run = await Run.objects.filter(id=run_id).afirst()
+    if run is None:
+        return None
+    events = [position_event(position) for position in await _missed_positions(run, last_id)]
+    if run.status == 'finished':
+        events.append(finished_event(run))
+    return events
+
+
+async def _live_stream(run_id, subscriber, backlog, last_id):
+    try:
+        yield f'retry: {getattr(settings, "LIVE_FEED_RETRY_MS", 3000)}\n\n'
+        events = backlog
+        while True:
+            for event, event_id, frame in events:
+                yield frame
+                if event_id is not None:
+                    last_id = event_id
+                if event == FINISHED_EVENT:
+                    return
+            # Сигнал своего процесса или тишина: новое в обоих случаях читается из базы после last_id
+            notified = await subscriber.wait(getattr(settings, 'LIVE_FEED_HEARTBEAT', 15))
+            events = await _catch_up(run_id, last_id)
+            if events is None:
+                return
+            if not events and not notified:
+                # Комментарий SSE, чтобы прокси не закрывали простаивающее соединение
+                yield ': ping\n\n'
+    finally:
+        feed.unsubscribe(run_id, subscriber)
+
+
+async def run_live_view(request, run_id):
+    # SSE с новыми точками забега, продолжение после id из Last-Event-ID или ?last_id=.
+    # Поток держит соединение открытым: под WSGI это занятый воркер на все время просмотра
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'message': 'Живая лента доступна только при запуске под ASGI'}, status=501)
+    run = await Run.objects.filter(id=run_id).afirst()
+    if run is None:
+        return _not_found()
+    last_id = _last_event_id(request)
+    # Сначала подписка, потом чтение пропущенного из базы, чтобы не потерять точки между ними
+    subscriber = feed.subscribe(run.id)
+    try:
+        backlog = [position_event(position) for position in await _missed_positions(run, last_id)]
+        run = await Run.objects.aget(id=run.id)
+    except BaseException:
+        feed.unsubscribe(run.id, subscriber)
+        raise
+    if run.status == 'finished':
+        backlog.append(finished_event(run))
+    return StreamingHttpResponse(_live_stream(run.id, subscriber, backlog, last_id),
+                                 content_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,159 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def _version_key(name):
+    return f'app_run:version:{name}'
+
+
+def _modified_key(name):
+    return f'app_run:modified:{name}'
+
+
+def version_name(model_or_name):
+    if isinstance(model_or_name, str):
+        return model_or_name
+    return model_or_name._meta.label_lower
+
+
+def _version_timeout():
+    # None для общего кеша. С кешем в памяти процесса (LocMemCache) изменения из других процессов
+    # не видны, поэтому версии живут ограниченное время и процессы сходятся не позже, чем через него
+    return getattr(settings, 'VERSION_CACHE_TIMEOUT', None)
+
+
+def get_version(name):
+    # Версия данных хранится в кеше Django, чтобы ее видели все процессы при общем бэкенде
+    name = version_name(name)
+    version = cache.get(_version_key(name))
+    if version is None:
+        # Начальное значение от времени: после вытеснения или истечения ключа версия не повторится
+        cache.add(_version_key(name), int(time.time() * 1000), _version_timeout())
+        cache.add(_modified_key(name), time.time(), _version_timeout())
+        version = cache.get(_version_key(name))
+    return version
+
+
+def get_modified(name):
+    name = version_name(name)
+    modified = cache.get(_modified_key(name))
+    if modified is None:
+        modified = time.time()
+        cache.add(_modified_key(name), modified, _version_timeout())
+    return modified
+
+
+def bump_version(name):
+    name = version_name(name)
+    cache.set(_modified_key(name), time.time(), _version_timeout())
+    try:
+        return cache.incr(_version_key(name))
+    except ValueError:
+        return get_version(name)
+
+
+def bump_version_on_commit(name):
+    # Для изменений внутри транзакции: если сменить версию до коммита, параллельный запрос
+    # успеет закешировать старые данные уже под новой версией. Вне транзакции - сразу
+    transaction.on_commit(lambda: bump_version(name))
+
+
+async def aget_version(name):
+    # Асинхронный get_version для async-вьюх: без перехода в поток
+    name = version_name(name)
+    version = await cache.aget(_version_key(name))
+    if version is None:
+        await cache.aadd(_version_key(name), int(time.time() * 1000), _version_timeout())
+        await cache.aadd(_modified_key(name), time.time(), _version_timeout())
+        version = await cache.aget(_version_key(name))
+    return version
+
+
+async def abump_version(name):
+    name = version_name(name)
+    await cache.aset(_modified_key(name), time.time(), _version_timeout())
+    try:
+        return await cache.aincr(_version_key(name))
+    except ValueError:
+        return await aget_version(name)
+
+
+class VersionedMemo:
+    # Значение в памяти процесса, пересчитывается при смене версий зависимостей и не реже,
+    # чем раз в VERSION_CACHE_TIMEOUT, если версии процессов не общие
+    def __init__(self, dependencies, build):
+        self.dependencies = dependencies
+        self.build = build
+        self._versions = None
+        self._value = None
+        self._built_at = 0
+
+    def get(self):
+        versions = [get_version(dependency) for dependency in self.dependencies]
+        timeout = _version_timeout()
+        if versions != self._versions or (timeout is not None and time.time() - self._built_at >= timeout):
+            value = self.build()
+            self._versions, self._value, self._built_at = versions, value, time.time()
+        return self._value
+
+
+def cached_response(request, dependencies, build, timeout=None):
+    # ETag считается из адреса запроса, формата ответа и версий моделей, от которых зависит ответ.
+    # Данные ответа кешируются по ETag, на условный GET с совпавшим ETag отдается 304.
+    versions = [get_version(dependency) for dependency in dependencies]
+    renderer = getattr(request, 'accepted_renderer', None)
+    fingerprint = f'{request.get_full_path()}|{getattr(renderer, "format", "")}|{versions}'
+    etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+    last_modified = int(max([get_modified(dependency) for dependency in dependencies], default=0)) or None
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    key = f'app_run:response:{etag}'
+    data = cache.get(key)
+    if data is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+        cache.set(key, response.data,
+                  timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    else:
+        response = Response(data)
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def cache_response(*dependencies, timeout=None):
+    # Для функций под @api_view
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return cached_response(request, dependencies, lambda: view(request, *args, **kwargs), timeout)
+        return wrapper
+    return decorator
+
+
+class CachedResponseMixin:
+    # Для вьюсетов только на чтение: cache_dependencies - модели, при изменении которых меняется ответ
+    cache_dependencies = []
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, self.cache_dependencies,
+                               lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(request, self.cache_dependencies,
+                               lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
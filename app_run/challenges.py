@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+
+from .caching import VersionedMemo, bump_version_on_commit
+from .models import Challenge
+
+
+# Правила челленджей: (название, проверка(stats, run)). Проверки работают только
+# со счетчиками AthleteStats и самим забегом, без запросов к истории забегов.
+CHALLENGE_RULES = []
+
+
+def challenge_rule(full_name):
+    def decorator(check):
+        CHALLENGE_RULES.append((full_name, check))
+        return check
+    return decorator
+
+
+@challenge_rule('Сделай 10 Забегов!')
+def ten_runs(stats, run):
+    return stats.finished_runs >= 10
+
+
+@challenge_rule('Пробеги 50 километров!')
+def fifty_kilometers(stats, run):
+    return stats.total_distance >= 50
+
+
+@challenge_rule('2 километра за 10 минут!')
+def two_kilometers_in_ten_minutes(stats, run):
+    return run.distance >= 2 and run.run_time_seconds <= 600
+
+
+def award_challenges(stats, run):
+    earned = [full_name for full_name, check in CHALLENGE_RULES if check(stats, run)]
+    if not earned:
+        return []
+    existing = set(Challenge.objects.filter(athlete_id=run.athlete_id, full_name__in=earned)
+                   .values_list('full_name', flat=True))
+    new_challenges = [Challenge(full_name=full_name, athlete_id=run.athlete_id)
+                      for full_name in earned if full_name not in existing]
+    Challenge.objects.bulk_create(new_challenges)
+    if new_challenges:
+        # bulk_create не отправляет post_save. Вызывается внутри транзакции finish_run
+        bump_version_on_commit(Challenge)
+    return new_challenges
+
+
+def build_challenge_summary():
+    rows = (Challenge.objects
+            .values_list('full_name', 'athlete_id', 'athlete__first_name', 'athlete__last_name', 'athlete__username')
+            .order_by('full_name', 'athlete_id')
+            .distinct())
+    summary = {}
+    for full_name, athlete_id, first_name, last_name, username in rows:
+        summary.setdefault(full_name, []).append({'id': athlete_id, 'full_name': f'{first_name} {last_name}',
+                                                  'username': username})
+    return [{'name_to_display': full_name, 'athletes': athletes} for full_name, athletes in summary.items()]
+
+
+challenge_summary = VersionedMemo([Challenge, User], build_challenge_summary)
@@ -0,0 +1,83 @@
+import json
+from itertools import islice
+from xml.sax.saxutils import escape, quoteattr
+
+from .models import Position, RunTrack
+from .tracks import unpack_track
+
+
+# Сколько позиций читается из базы и отдается клиенту за раз: память не зависит от длины трека
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_track_points(run, chunk_size=EXPORT_CHUNK_SIZE):
+    # (latitude, longitude, date_time) по порядку: курсором по Position или из упакованного
+    # трека, который и так хранится одной строкой
+    data = RunTrack.objects.filter(run_id=run.id).values_list('data', flat=True).first()
+    if data is not None:
+        for _, latitude, longitude, date_time, _, _ in unpack_track(data):
+            yield latitude, longitude, date_time
+        return
+    yield from (Position.objects.filter(run_id=run.id).order_by('id')
+                .values_list('latitude', 'longitude', 'date_time').iterator(chunk_size=chunk_size))
+
+
+def _chunks(iterable, chunk_size=EXPORT_CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def _isoformat(date_time):
+    return date_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ') if date_time else None
+
+
+def gpx_stream(runs):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    for run in runs:
+        yield (f'<trk><name>{escape(f"Забег {run.id}")}</name>'
+               f'<desc>{escape(run.comment)}</desc><trkseg>\n')
+        for chunk in _chunks(iter_track_points(run)):
+            yield ''.join(
+                f'<trkpt lat={quoteattr(str(latitude))} lon={quoteattr(str(longitude))}>'
+                + (f'<time>{_isoformat(date_time)}</time>' if date_time else '')
+                + '</trkpt>\n'
+                for latitude, longitude, date_time in chunk)
+        yield '</trkseg></trk>\n'
+    yield '</gpx>\n'
+
+
+def _json_array_items(chunks, render):
+    for index, chunk in enumerate(chunks):
+        yield ('' if index == 0 else ', ') + ', '.join(render(point) for point in chunk)
+
+
+def geojson_stream(runs):
+    # FeatureCollection, каждый забег - LineString, время точек в properties.coordTimes.
+    # Координаты и время - два массива, поэтому трек читается дважды, а не копится в памяти
+    yield '{"type": "FeatureCollection", "features": ['
+    for index, run in enumerate(runs):
+        properties = json.dumps({
+            'run': run.id,
+            'athlete': run.athlete_id,
+            'comment': run.comment,
+            'status': run.status,
+            'distance': run.distance,
+            'run_time_seconds': run.run_time_seconds,
+            'speed': run.speed,
+        }, ensure_ascii=False)
+        yield ('' if index == 0 else ', ') + '{"type": "Feature", "geometry": {"type": "LineString", "coordinates": ['
+        yield from _json_array_items(_chunks(iter_track_points(run)),
+                                     lambda point: f'[{point[1]}, {point[0]}]')
+        yield ']}, "properties": ' + properties[:-1] + ', "coordTimes": ['
+        yield from _json_array_items(_chunks(iter_track_points(run)),
+                                     lambda point: json.dumps(_isoformat(point[2])))
+        yield ']}}'
+    yield ']}\n'
+
+
+EXPORT_FORMATS = {
+    'gpx': (gpx_stream, 'application/gpx+xml'),
+    'geojson': (geojson_stream, 'application/geo+json'),
+}
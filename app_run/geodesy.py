@@ -0,0 +1,90 @@
+import numpy as np
+from django.conf import settings
+
+
+# WGS-84, как в geopy.distance.geodesic
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+EARTH_MEAN_RADIUS = 6371008.8
+
+HAVERSINE = 'haversine'
+VINCENTY = 'vincenty'
+
+
+def _as_radians(*values):
+    return [np.radians(np.asarray(value, dtype=float)) for value in values]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Сфера: быстрее, погрешность относительно эллипсоида до ~0.5%
+    lat1, lon1, lat2, lon2 = _as_radians(lat1, lon1, lat2, lon2)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_MEAN_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, max_iterations=200, tolerance=1e-12):
+    # Обратная задача Винсенти на эллипсоиде, итерации идут сразу по всему массиву.
+    # Для почти антиподальных точек, где метод не сходится, берется haversine.
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*_as_radians(lat1, lon1, lat2, lon2))
+    f = WGS84_F
+    big_l = np.remainder(lon2 - lon1 + np.pi, 2 * np.pi) - np.pi
+    u1 = np.arctan((1 - f) * np.tan(lat1))
+    u2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = big_l.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+            lam_next = big_l + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam_next - lam) < tolerance
+            lam = np.where(converged, lam, lam_next)
+            if converged.all():
+                break
+
+        u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        meters = WGS84_B * big_a * (sigma - delta_sigma)
+
+    meters = np.where(sin_sigma == 0, 0.0, meters)
+    if not converged.all():
+        meters = np.where(converged, meters, haversine(*np.degrees([lat1, lon1, lat2, lon2])))
+    return meters
+
+
+def distance(lat1, lon1, lat2, lon2, mode=None):
+    # Расстояние в метрах между массивами точек (или скалярами), режим по умолчанию из GEODESY_MODE
+    mode = mode or getattr(settings, 'GEODESY_MODE', VINCENTY)
+    if mode == HAVERSINE:
+        return haversine(lat1, lon1, lat2, lon2)
+    if mode == VINCENTY:
+        return vincenty(lat1, lon1, lat2, lon2)
+    raise ValueError(f'Неизвестный режим расчета расстояния: {mode}')
+
+
+def track_distances(latitudes, longitudes, mode=None):
+    # Длины отрезков трека: результат на один элемент короче входа
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    if len(latitudes) < 2:
+        return np.zeros(0)
+    return distance(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:], mode)
+
+
+def distances_from(latitude, longitude, latitudes, longitudes, mode=None):
+    return distance(float(latitude), float(longitude), latitudes, longitudes, mode)
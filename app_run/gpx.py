@@ -0,0 +1,76 @@
+from datetime import timezone
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from django.utils.dateparse import parse_datetime
+
+from .geodesy import track_distances
+
+
+# Модуль не обращается к базе и моделям: функции выполняются в дочерних процессах пула
+# (jobs.import_gpx_files), обратно возвращаются только готовые списки значений
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_gpx_tracks(file):
+    # (название, [(latitude, longitude, date_time)]) для каждого <trk>, сегменты склеиваются.
+    # iterparse с очисткой разобранных элементов держит в памяти только текущий трек
+    name, points, time = '', [], None
+    for event, element in ET.iterparse(file, events=('end',)):
+        tag = _local_name(element.tag)
+        if tag == 'time':
+            time = element.text
+        elif tag == 'name' and not points:
+            name = (element.text or '').strip()
+        elif tag == 'trkpt':
+            date_time = parse_datetime(time.strip()) if time else None
+            if date_time is not None and date_time.tzinfo is None:
+                date_time = date_time.replace(tzinfo=timezone.utc)
+            points.append((float(element.get('lat')), float(element.get('lon')), date_time))
+            time = None
+            element.clear()
+        elif tag == 'trk':
+            if points:
+                yield name, points
+            name, points = '', []
+            element.clear()
+        elif tag in ('metadata', 'wpt', 'rte'):
+            name, time = '', None
+            element.clear()
+
+
+def compute_track(name, points, mode=None):
+    # Позиции и итоги забега за один векторный проход, с теми же правилами,
+    # что Run.add_positions и Run.finish для точек, присланных по одной
+    latitudes = np.round(np.array([point[0] for point in points]), 6)
+    longitudes = np.round(np.array([point[1] for point in points]), 6)
+    date_times = [point[2] for point in points]
+
+    meters = track_distances(latitudes, longitudes, mode=mode)
+    seconds = np.array([(current - previous).total_seconds() if current and previous else 0
+                        for previous, current in zip(date_times, date_times[1:])], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = np.concatenate(([0], np.round(np.where(seconds > 0, meters / seconds, 0), 2)))
+    cumulative = np.concatenate(([0], np.cumsum(meters))) / 1000
+    first_time = next((date_time for date_time in date_times if date_time), None)
+
+    return {
+        'name': name,
+        'latitudes': latitudes.tolist(),
+        'longitudes': longitudes.tolist(),
+        'date_times': date_times,
+        'speeds': speeds.tolist(),
+        'distances': np.round(cumulative, 2).tolist(),
+        'distance': float(cumulative[-1]),
+        'speed_sum': float(speeds.sum()),
+        'positions_count': len(points),
+        'first_position_time': first_time,
+        'last_position_time': date_times[-1],
+    }
+
+
+def read_gpx(path, mode=None):
+    return [compute_track(name, points, mode) for name, points in iter_gpx_tracks(path)]
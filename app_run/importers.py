@@ -0,0 +1,53 @@
+from itertools import islice
+
+import openpyxl as op
+
+from .caching import bump_version
+from .models import CollectibleItem
+from .serializers import CollectibleItemSerializer
+from .spatial import invalidate_collectible_index
+
+
+IMPORT_CHUNK_SIZE = 1000
+ITEM_COLUMNS = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+
+
+def iter_item_rows(file):
+    # read_only режим не держит всю книгу в памяти, строки читаются по мере итерации
+    wb = op.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            yield (tuple(row) + (None,) * len(ITEM_COLUMNS))[:len(ITEM_COLUMNS)]
+    finally:
+        wb.close()
+
+
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def import_collectible_items(file, chunk_size=IMPORT_CHUNK_SIZE, progress=None, rejected=None):
+    # Отклоненные строки в порядке колонок файла добавляются в rejected: список или лист openpyxl
+    # в режиме write_only, который пишет строки на диск, а не держит их в памяти. Возвращает
+    # число отклоненных строк. progress(rows_processed, rows_rejected) вызывается после каждой пачки
+    rows_processed = rows_rejected = 0
+    for chunk in iter_chunks(iter_item_rows(file), chunk_size):
+        items = []
+        for row in chunk:
+            serializer = CollectibleItemSerializer(data=dict(zip(ITEM_COLUMNS, row)))
+            if serializer.is_valid():
+                items.append(CollectibleItem(**serializer.validated_data))
+            else:
+                rows_rejected += 1
+                if rejected is not None:
+                    rejected.append(list(row))
+        CollectibleItem.objects.bulk_create(items)
+        rows_processed += len(chunk)
+        if progress:
+            progress(rows_processed, rows_rejected)
+    # bulk_create не отправляет post_save, поэтому индекс и версию сбрасываем сами
+    invalidate_collectible_index()
+    bump_version(CollectibleItem)
+    return rows_rejected
@@ -0,0 +1,233 @@
+import atexit
+import copy
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from .caching import bump_version_on_commit
+from .live import publish_positions
+from .models import Position, Run, RunTrack
+
+
+# Буферизованная запись позиций (POSITION_INGEST_MODE = 'buffered'). Запрос подтверждается после
+# записи точки в локальный журнал и очередь процесса, фоновый поток раз в интервал пишет
+# накопленное одной транзакцией: bulk_create позиций по порядку и итоги каждого забега.
+#
+# Журнал - сегменты positions-<pid>-<номер>.log, по строке JSON на точку. Процесс держит flock
+# на своих сегментах, поэтому сегмент без блокировки остался от упавшего процесса и при старте
+# буфера дописывается в базу. Каждая запись в базу забирает текущий сегмент целиком и открывает
+# новый, записанный сегмент удаляется после коммита
+
+logger = logging.getLogger(__name__)
+
+DIRECT = 'direct'
+BUFFERED = 'buffered'
+
+
+def ingest_mode():
+    return getattr(settings, 'POSITION_INGEST_MODE', DIRECT)
+
+
+def log_dir():
+    return str(getattr(settings, 'POSITION_INGEST_LOG_DIR', settings.BASE_DIR / 'var' / 'ingest'))
+
+
+def _entry(run_id, latitude, longitude, date_time):
+    # В очереди точка хранится так же, как в журнале
+    return {'run': run_id, 'latitude': str(latitude), 'longitude': str(longitude),
+            'date_time': date_time.isoformat() if date_time else None}
+
+
+def _position(entry):
+    date_time = entry['date_time']
+    return Position(run_id=entry['run'], latitude=Decimal(entry['latitude']), longitude=Decimal(entry['longitude']),
+                    date_time=parse_datetime(date_time) if date_time else None)
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.entries = []
+
+    def append(self, entry):
+        # Строка доходит до ОС до ответа клиенту: переживает падение процесса, но не машины
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        self.entries.append(entry)
+
+    def discard(self):
+        os.remove(self.path)
+        self.file.close()
+
+
+class PositionBuffer:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # Запись в базу идет из фонового потока и из stop_run, по одной за раз
+        self._flush_lock = threading.Lock()
+        self._numbers = itertools.count()
+        self._wakeup = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        replay_logs(directory)
+        self._segment = self._open_segment()
+        # Сегменты, которые забрали на запись, но еще не записали (ошибка базы), в порядке поступления
+        self._unflushed = []
+
+    def _open_segment(self):
+        return Segment(os.path.join(self.directory, f'positions-{os.getpid()}-{next(self._numbers):06d}.log'))
+
+    def append(self, run_id, latitude, longitude, date_time):
+        with self._lock:
+            self._segment.append(_entry(run_id, latitude, longitude, date_time))
+            pending = len(self._segment.entries)
+        if pending >= getattr(settings, 'POSITION_INGEST_BATCH_SIZE', 1000):
+            self._wakeup.set()
+
+    def start(self):
+        interval = getattr(settings, 'POSITION_INGEST_FLUSH_INTERVAL', 0.5)
+        if self._thread is None and interval:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='position-ingest', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self, interval):
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Запись буфера позиций не выполнена, повтор через %s с', interval)
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        # Пишет в базу все принятые до вызова точки. Возвращает число записанных позиций
+        with self._flush_lock:
+            with self._lock:
+                if self._segment.entries:
+                    self._unflushed.append(self._segment)
+                    self._segment = self._open_segment()
+            written = 0
+            while self._unflushed:
+                segment = self._unflushed[0]
+                written += write_entries(segment.entries)
+                segment.discard()
+                self._unflushed.pop(0)
+            return written
+
+
+def _existing_keys(entries):
+    # Сегмент мог упасть между коммитом и удалением файла, такие точки уже в базе
+    positions = Position.objects.filter(run_id__in={entry['run'] for entry in entries},
+                                        date_time__in={_position(entry).date_time for entry in entries}
+                                        ).values_list('run_id', 'date_time', 'latitude', 'longitude')
+    return {(run_id, date_time, latitude, longitude) for run_id, date_time, latitude, longitude in positions}
+
+
+def write_entries(entries, skip_existing=False):
+    # Одна транзакция на пачку: забеги блокируются по порядку id, позиции вставляются одним
+    # bulk_create в порядке поступления
+    if not entries:
+        return 0
+    with transaction.atomic():
+        positions = [_position(entry) for entry in entries]
+        if skip_existing:
+            existing = _existing_keys(entries)
+            positions = [position for position in positions if (position.run_id, position.date_time,
+                                                                position.latitude, position.longitude) not in existing]
+        runs = Run.objects.select_for_update().order_by('id').in_bulk({position.run_id for position in positions})
+        by_run = {}
+        for position in positions:
+            by_run.setdefault(position.run_id, []).append(position)
+
+        updated = []
+        finished = []
+        for run_id, run_positions in by_run.items():
+            run = runs.get(run_id)
+            if run is None:
+                # Забег удален раньше, чем точки дошли до базы, писать их некуда
+                logger.warning('Забег %s удален, позиций отброшено: %s', run_id, len(run_positions))
+                continue
+            if run.status == 'finished':
+                # Завершен раньше, чем точки дошли до базы: stop_run сбрасывает только буфер своего
+                # процесса. Подтвержденные точки дописываются, итоги забега пересчитываются
+                finished.append((run, copy.copy(run)))
+                run.unpack_track()
+                # Трек завершенного забега меняется, даже если еще не упакован: упрощенный трек
+                # кешируется по версии до перепаковки
+                bump_version_on_commit(RunTrack.version_name(run.id))
+            run.add_positions(run_positions)
+            updated.append(run)
+        updated_ids = {run.id for run in updated}
+        accepted = [position for position in positions if position.run_id in updated_ids]
+        Position.objects.bulk_create(accepted)
+        Run.objects.bulk_update(updated, Run.STATS_FIELDS)
+        if finished:
+            # services импортирует этот модуль
+            from .services import finish_run
+            for run, previous in finished:
+                logger.warning('Забег %s уже завершен, дописано поздних позиций: %s', run.id, len(by_run[run.id]))
+                finish_run(run, previous)
+        for run in updated:
+            publish_positions(run.id)
+    return len(accepted)
+
+
+def replay_logs(directory):
+    # Сегменты упавших процессов в порядке создания. Свои живые сегменты и сегменты
+    # работающих процессов заблокированы и пропускаются
+    paths = sorted(glob.glob(os.path.join(directory, 'positions-*.log')), key=os.path.getmtime)
+    replayed = 0
+    for path in paths:
+        with open(path, encoding='utf-8') as file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            # Последняя строка могла оборваться при падении, ее клиенту не подтверждали
+            entries = []
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+            batch_size = getattr(settings, 'POSITION_INGEST_BATCH_SIZE', 1000)
+            for start in range(0, len(entries), batch_size):
+                replayed += write_entries(entries[start:start + batch_size], skip_existing=True)
+            os.remove(path)
+    if replayed:
+        logger.warning('Дописано позиций из журнала: %s', replayed)
+    return replayed
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_position_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = PositionBuffer(log_dir())
+            _buffer.start()
+        return _buffer
+
+
+def flush_positions():
+    # Для stop_run: точки, принятые этим процессом, попадают в забег до его завершения
+    if _buffer is not None:
+        _buffer.flush()
@@ -0,0 +1,125 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import openpyxl as op
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .geodesy import VINCENTY
+from .gpx import read_gpx
+from .importers import ITEM_COLUMNS, import_collectible_items
+from .models import ImportJob
+from .services import import_track
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_process_pool = None
+
+
+def get_executor():
+    # Пул потоков внутри процесса, внешний брокер не нужен
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'UPLOAD_JOB_WORKERS', 2),
+                                           thread_name_prefix='upload-job')
+        return _executor
+
+
+def get_process_pool():
+    # Разбор GPX и расчет треков упираются в CPU, поэтому идут в отдельных процессах.
+    # spawn вместо fork: веб-процесс многопоточный и держит открытые соединения с БД
+    global _process_pool
+    with _executor_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=getattr(settings, 'GPX_IMPORT_WORKERS', None),
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def import_gpx_files(athlete, paths):
+    # Файлы разбираются параллельно в пуле процессов, забеги сохраняются здесь по мере готовности.
+    # Возвращает {путь: {'runs': [id], 'error': текст или None}}
+    mode = getattr(settings, 'GEODESY_MODE', VINCENTY)
+    futures = {get_process_pool().submit(read_gpx, path, mode): path for path in paths}
+    results = {}
+    for future in as_completed(futures):
+        path = futures[future]
+        try:
+            # Файл импортируется целиком или не импортируется
+            with transaction.atomic():
+                runs = [import_track(athlete, track) for track in future.result()]
+            results[path] = {'runs': [run.id for run in runs], 'error': None}
+        except Exception as exc:
+            logger.warning('Импорт GPX %s не выполнен: %s', path, exc)
+            results[path] = {'runs': [], 'error': str(exc)}
+    return results
+
+
+def save_uploaded_file(uploaded_file, suffix):
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        for chunk in uploaded_file.chunks():
+            tmp.write(chunk)
+    return tmp.name
+
+
+def import_uploaded_gpx(athlete, uploaded_files):
+    # Дочерние процессы читают файлы с диска, загруженные файлы сохраняются во временные
+    paths = {}
+    try:
+        for uploaded_file in uploaded_files:
+            paths[save_uploaded_file(uploaded_file, '.gpx')] = uploaded_file.name
+        results = import_gpx_files(athlete, list(paths))
+    finally:
+        for path in paths:
+            os.remove(path)
+    return [{'file': name, **results[path]} for path, name in paths.items()]
+
+
+def submit_import_job(uploaded_file):
+    # Файл из запроса сохраняется во временный, т.к. запрос завершится раньше загрузки
+    job = ImportJob.objects.create(file_path=save_uploaded_file(uploaded_file, '.xlsx'))
+    transaction.on_commit(lambda: get_executor().submit(run_import_job, job.id))
+    return job
+
+
+def run_import_job(job_id):
+    job = ImportJob.objects.get(id=job_id)
+    ImportJob.objects.filter(id=job_id).update(status='running')
+
+    def progress(rows_processed, rows_rejected):
+        ImportJob.objects.filter(id=job_id).update(rows_processed=rows_processed, rows_rejected=rows_rejected)
+
+    # Отклоненные строки сразу пишутся в файл, в памяти их нет даже для больших каталогов
+    workbook = op.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(ITEM_COLUMNS)
+    try:
+        rows_rejected = import_collectible_items(job.file_path, progress=progress, rejected=sheet)
+        if rows_rejected:
+            with tempfile.TemporaryFile(suffix='.xlsx') as tmp:
+                workbook.save(tmp)
+                tmp.seek(0)
+                job.rejected_file.save(f'rejected_rows_{job.id}.xlsx', File(tmp), save=False)
+        ImportJob.objects.filter(id=job_id).update(status='finished', rejected_file=job.rejected_file.name,
+                                                   rows_rejected=rows_rejected, finished_at=timezone.now())
+    except Exception as exc:
+        logger.exception('Загрузка %s завершилась ошибкой', job_id)
+        ImportJob.objects.filter(id=job_id).update(status='failed', error=str(exc), finished_at=timezone.now())
+    finally:
+        if not sheet.closed:
+            # Книга без отклоненных строк не нужна, но ее временный файл закрывается только при сохранении
+            workbook.save(os.devnull)
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        # У каждого потока пула свое соединение с БД
+        connection.close()
@@ -0,0 +1,159 @@
+import datetime
+import threading
+from bisect import bisect_left, insort
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .caching import bump_version, get_version
+from .models import LeaderboardEntry, Run
+
+
+# Лидерборды по сумме дистанций, самому длинному забегу и средней скорости за все время,
+# текущий месяц и текущую неделю. Итоги хранятся в LeaderboardEntry, в памяти процесса
+# для каждого лидерборда держится отсортированный список, поэтому top N и место атлета
+# считаются бинарным поиском без запросов к базе.
+#
+# Список перестраивается из базы при смене версии периода в кеше Django: с общим кешем сразу
+# после финиша в любом процессе, с кешем в памяти процесса - когда версия истечет
+# (VERSION_CACHE_TIMEOUT). Вставка при финише - insort, O(n) из-за сдвига списка, но это
+# один memmove: на сотне тысяч атлетов это десятки микросекунд, меньше запроса к базе,
+# поэтому дерево с логарифмической вставкой не окупает лишнюю зависимость
+BOARDS = {
+    'distance': 'total_distance',
+    'longest': 'longest_distance',
+    'speed': 'average_speed',
+}
+PERIODS = ['all', 'month', 'week']
+
+
+def period_start(period, day):
+    if period == 'day':
+        return day
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return LeaderboardEntry.ALL_TIME_START
+
+
+def version_name(period, start):
+    # Версия итогов периода для всех трех лидербордов, меняется при каждом финише
+    return f'app_run.leaderboard:{period}:{start.isoformat()}'
+
+
+class Leaderboard:
+    # Ключи (-значение, id атлета) по возрастанию: первые ключи - лидеры. Одинаковые значения
+    # делят место, следующее место пропускается
+    def __init__(self, start, version, rows):
+        self.start = start
+        self.version = version
+        self._values = dict(rows)
+        self._keys = sorted((-value, user_id) for user_id, value in self._values.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _rank(self, value):
+        return bisect_left(self._keys, (-value,)) + 1
+
+    def update(self, user_id, value):
+        old = self._values.get(user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, user_id))]
+        insort(self._keys, (-value, user_id))
+        self._values[user_id] = value
+
+    def top(self, limit):
+        return [(self._rank(-key), user_id, -key) for key, user_id in self._keys[:limit]]
+
+    def rank(self, user_id):
+        # (место, значение) или None, если у атлета нет забегов за период
+        value = self._values.get(user_id)
+        if value is None:
+            return None
+        return self._rank(value), value
+
+
+_boards = {}
+_boards_lock = threading.Lock()
+
+
+def get_leaderboard(board, period, day=None):
+    # Лидерборд текущего периода. Строится заново из LeaderboardEntry, только если итоги
+    # периода менял другой процесс или начался новый период
+    start = period_start(period, day or timezone.localdate())
+    version = get_version(version_name(period, start))
+    leaderboard = _boards.get((board, period))
+    if leaderboard is not None and leaderboard.start == start and leaderboard.version == version:
+        return leaderboard
+    with _boards_lock:
+        rows = LeaderboardEntry.objects.filter(period=period, period_start=start).values_list('user_id', BOARDS[board])
+        leaderboard = _boards[(board, period)] = Leaderboard(start, version, rows)
+    return leaderboard
+
+
+def _apply(entries):
+    # После коммита: лидерборды этого процесса обновляются на месте. Если версию между
+    # построением и этим финишем менял кто-то еще, лидерборд перестроится при следующем запросе
+    for entry in entries:
+        version = bump_version(version_name(entry.period, entry.period_start))
+        with _boards_lock:
+            for board, field in BOARDS.items():
+                leaderboard = _boards.get((board, entry.period))
+                if leaderboard is not None and leaderboard.start == entry.period_start \
+                        and leaderboard.version == version - 1:
+                    leaderboard.update(entry.user_id, getattr(entry, field))
+                    leaderboard.version = version
+
+
+def update_leaderboards(run, previous=None):
+    # Вызывается из services.finish_run после AthleteStats.record_finished_run: строка счетчиков
+    # атлета уже заблокирована, поэтому его итоги по периодам параллельно никто не меняет
+    day = timezone.localdate(run.created_at)
+    starts = {period: period_start(period, day) for period in PERIODS}
+    entries = {entry.period: entry for entry in LeaderboardEntry.objects.select_for_update().filter(
+        Q(*[Q(period=period, period_start=start) for period, start in starts.items()], _connector=Q.OR),
+        user_id=run.athlete_id)}
+    created = [LeaderboardEntry(user_id=run.athlete_id, period=period, period_start=start)
+               for period, start in starts.items() if period not in entries]
+    for entry in [*entries.values(), *created]:
+        entry.add_run(run, previous)
+    if entries:
+        LeaderboardEntry.objects.bulk_update(entries.values(), ['finished_runs', 'total_distance', 'longest_distance',
+                                                                'speed_sum', 'average_speed'])
+    LeaderboardEntry.objects.bulk_create(created)
+    updated = [*entries.values(), *created]
+    transaction.on_commit(lambda: _apply(updated))
+    return updated
+
+
+def rebuild_leaderboards():
+    # Полный пересчет по завершенным забегам, для старых данных и bulk-загрузок
+    finished = Run.objects.filter(status='finished')
+    periods = {'all': None, 'month': TruncMonth('created_at'), 'week': TruncWeek('created_at')}
+    entries = []
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        for period, trunc in periods.items():
+            rows = finished.annotate(start=trunc) if trunc else finished
+            rows = rows.values('athlete', *(['start'] if trunc else [])).annotate(
+                finished_runs=Count('id'), total_distance=Sum('distance'), longest_distance=Max('distance'),
+                speed_sum=Sum('speed')).order_by()
+            for row in rows:
+                start = row.pop('start', None)
+                start = start.date() if isinstance(start, datetime.datetime) else start
+                entries.append(LeaderboardEntry(
+                    user_id=row.pop('athlete'), period=period, period_start=start or LeaderboardEntry.ALL_TIME_START,
+                    average_speed=row['speed_sum'] / row['finished_runs'], **row))
+        LeaderboardEntry.objects.bulk_create(entries, batch_size=5000)
+    today = timezone.localdate()
+    for period in PERIODS:
+        bump_version(version_name(period, period_start(period, today)))
+    return len(entries)
+
+
+def reset_leaderboards():
+    _boards.clear()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .serializers import PositionSerializer
+
+
+# Живая лента забега для SSE (async_views.run_live_view). Подписчики ждут сигнала в процессе,
+# брокер не нужен: после коммита точек или финиша процесс будит зрителей забега, и каждый
+# дочитывает из базы все, что новее его последнего id, поэтому видит и точки других процессов.
+# Точки забега пишутся под блокировкой его строки и коммитятся по порядку id, так что точка
+# с меньшим id не появится в базе после уже показанной. Без сигналов база перечитывается
+# на каждом пульсе тишины
+
+POSITION_EVENT = 'position'
+FINISHED_EVENT = 'finished'
+
+
+def sse_frame(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+
+    def notify(self):
+        # Выполняется в цикле событий зрителя
+        self.wakeup.set()
+
+    async def wait(self, timeout):
+        # True - был сигнал, False - тишина
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        # Сигналы до этой точки относятся к уже закоммиченному, его прочитает следующий запрос к базе
+        self.wakeup.clear()
+        return True
+
+
+class LiveFeed:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, run_id):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[run_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, run_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(run_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[run_id]
+
+    def has_subscribers(self, run_id):
+        return bool(self._subscribers.get(run_id))
+
+    def publish(self, run_id):
+        # Будит зрителей забега. Можно вызывать из любого потока
+        with self._lock:
+            subscribers = list(self._subscribers.get(run_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.notify)
+            except RuntimeError:
+                # Цикл событий зрителя уже закрыт
+                self.unsubscribe(run_id, subscriber)
+
+
+feed = LiveFeed()
+
+
+def position_event(position):
+    return POSITION_EVENT, position.id, sse_frame(POSITION_EVENT, PositionSerializer(position).data, position.id)
+
+
+def finished_event(run):
+    return FINISHED_EVENT, None, sse_frame(FINISHED_EVENT, {'run': run.id, 'distance': run.distance,
+                                                            'run_time_seconds': run.run_time_seconds,
+                                                            'speed': run.speed})
+
+
+def publish_positions(run_id):
+    # После коммита: зрители не должны увидеть точки откатившейся транзакции
+    transaction.on_commit(lambda: feed.publish(run_id))
+
+
+def publish_run_finished(run):
+    transaction.on_commit(lambda: feed.publish(run.id))
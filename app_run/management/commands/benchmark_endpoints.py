@@ -0,0 +1,230 @@
+import io
+import json
+import subprocess
+import time
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, resolve, URLPattern
+from django.utils import timezone
+from openpyxl import Workbook
+
+from app_run.importers import ITEM_COLUMNS
+from app_run.models import Run, Challenge, CollectibleItem, ImportJob
+
+
+def _routes(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLPattern):
+            yield prefix + str(pattern.pattern)
+        else:
+            yield from _routes(pattern.url_patterns, prefix + str(pattern.pattern))
+
+
+def _upload_file():
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append([column.capitalize() for column in ITEM_COLUMNS])
+    for i in range(100):
+        sheet.append([f'Бенчмарк {i}', f'bench-{i}', i, 55.75, 37.62, 'https://example.com/item.png'])
+    content = io.BytesIO()
+    workbook.save(content)
+    content.seek(0)
+    content.name = 'items.xlsx'
+    return content
+
+
+def _gpx_file():
+    points = ''.join(f'<trkpt lat="{55.75 + i * 0.0001:.6f}" lon="37.620000"><time>2025-01-01T10:{i // 60:02d}:'
+                     f'{i % 60:02d}Z</time></trkpt>' for i in range(600))
+    content = io.BytesIO(f'<gpx version="1.1"><trk><name>Бенчмарк</name><trkseg>{points}</trkseg></trk></gpx>'.encode())
+    content.name = 'track.gpx'
+    return content
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа и количество SQL-запросов всех эндпоинтов на текущей базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения p95')
+
+    def handle(self, *args, **options):
+        # Все замеры в транзакции, которая откатывается: после прогона база та же, что до него.
+        # Поэтому не выполняется то, что ждет коммита: фоновые загрузки, сброс версий кеша
+        with transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options):
+        athlete = (User.objects.filter(is_staff=False, is_superuser=True, run__status='finished',
+                                       run__positions_count__gt=0).order_by('-id').first())
+        coach = User.objects.filter(is_staff=True, is_superuser=True, athletes__isnull=False).order_by('-id').first()
+        if athlete is None or coach is None:
+            raise CommandError('В базе нет данных, сначала выполните generate_dataset')
+        self.athlete, self.coach = athlete, coach
+        self.finished_run = Run.objects.filter(athlete=athlete, status='finished',
+                                               positions_count__gt=0).order_by('-id').first()
+        self.live_run = Run.objects.create(athlete=athlete, comment='benchmark', status='in_progress')
+        self.challenge = Challenge.objects.order_by('id').first() or Challenge.objects.create(
+            full_name='Бенчмарк', athlete=athlete)
+        self.item = CollectibleItem.objects.order_by('id').first()
+        self.job = ImportJob.objects.filter(status='finished').order_by('-id').first() or ImportJob.objects.create(
+            status='finished', finished_at=timezone.now())
+        self.position_time = timezone.now()
+
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {settings.METRICS_TOKEN}' if settings.METRICS_TOKEN else '')
+        results = []
+        covered = set()
+        for name, method, url, data in self.scenarios():
+            results.append(self.measure(client, name, method, url, data, options['repeat']))
+            covered.add(results[-1]['route'])
+
+        for route in sorted(set(_routes(get_resolver().url_patterns)) - covered):
+            if not route.startswith('admin/') and '<drf_format_suffix' not in route and route.startswith('api/'):
+                self.stderr.write(f'Маршрут не замерялся: {route}')
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'commit': self.commit(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        self.print_report(results, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+    def scenarios(self):
+        # (название, метод, адрес, данные). Адрес и данные могут быть функциями,
+        # если для каждого повтора нужен свежий объект
+        athlete, coach, run = self.athlete, self.coach, self.finished_run
+
+        def new_run(status):
+            return Run.objects.create(athlete=athlete, comment='benchmark', status=status).id
+
+        def next_position():
+            self.position_time += timezone.timedelta(seconds=5)
+            return {'run': self.live_run.id, 'latitude': 55.75, 'longitude': 37.62,
+                    'date_time': self.position_time.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+
+        def next_batch():
+            positions = []
+            for _ in range(100):
+                position = next_position()
+                positions.append({'latitude': position['latitude'], 'longitude': position['longitude'],
+                                  'date_time': position['date_time']})
+            return {'run': self.live_run.id, 'positions': positions}
+
+        return [
+            ('company_details', 'get', '/api/company_details/', None),
+            ('runs_list', 'get', '/api/runs/', None),
+            ('runs_page', 'get', '/api/runs/?size=50', None),
+            ('runs_athlete', 'get', f'/api/runs/?athlete={athlete.id}&status=finished', None),
+            ('run_detail', 'get', f'/api/runs/{run.id}/', None),
+            ('run_track', 'get', f'/api/runs/{run.id}/track/?zoom=14', None),
+            ('run_export_gpx', 'get', f'/api/runs/{run.id}/export/gpx/', None),
+            ('athlete_export_geojson', 'get', f'/api/users/{athlete.id}/export/geojson/', None),
+            ('athlete_import_gpx', 'post', f'/api/users/{athlete.id}/import/gpx/', lambda: {'file': _gpx_file()}),
+            ('run_create', 'post', '/api/runs/', {'athlete': athlete.id, 'comment': 'benchmark'}),
+            ('run_start', 'post', lambda: f'/api/runs/{new_run("init")}/start/', None),
+            ('run_stop', 'post', lambda: f'/api/runs/{new_run("in_progress")}/stop/', None),
+            ('users_list', 'get', '/api/users/?type=athlete&size=50', None),
+            ('user_athlete', 'get', f'/api/users/{athlete.id}/', None),
+            ('user_coach', 'get', f'/api/users/{coach.id}/', None),
+            ('athlete_info', 'get', f'/api/athlete_info/{athlete.id}/', None),
+            ('athlete_info_update', 'put', f'/api/athlete_info/{athlete.id}/', {'weight': 70, 'goals': 'бег'}),
+            ('positions_list', 'get', f'/api/positions/?run={run.id}', None),
+            ('positions_page', 'get', f'/api/positions/?run={run.id}&size=100', None),
+            ('position_detail', 'get', f'/api/positions/{run.position_set.values_list("id", flat=True)[0]}/', None),
+            ('position_create', 'post', '/api/positions/', next_position),
+            ('positions_batch', 'post', '/api/positions/batch/', next_batch),
+            ('async_position_create', 'post', '/api/async/positions/', next_position),
+            ('async_run_start', 'post', lambda: f'/api/async/runs/{new_run("init")}/start/', None),
+            ('async_run_stop', 'post', lambda: f'/api/async/runs/{new_run("in_progress")}/stop/', None),
+            ('async_collectible_check', 'post', '/api/async/collectible_check/',
+             {'athlete': athlete.id, 'latitude': 55.75, 'longitude': 37.62}),
+            ('challenges_list', 'get', f'/api/challenges/?athlete={athlete.id}', None),
+            ('challenge_detail', 'get', f'/api/challenges/{self.challenge.id}/', None),
+            ('challenges_summary', 'get', '/api/challenges_summary/', None),
+            ('items_list', 'get', '/api/collectible_item/', None),
+            ('item_detail', 'get', f'/api/collectible_item/{self.item.id}/', None),
+            ('subscribe', 'post', f'/api/subscribe_to_coach/{coach.id}/', {'athlete': athlete.id}),
+            ('rate_coach', 'post', f'/api/rate_coach/{coach.id}/', {'athlete': athlete.id, 'rating': 5}),
+            ('coach_analytics', 'get', f'/api/analytics_for_coach/{coach.id}/', None),
+            ('coach_roster', 'get', f'/api/roster_for_coach/{coach.id}/?size=100', None),
+            ('leaderboard_all', 'get', f'/api/leaderboards/distance/?athlete={athlete.id}', None),
+            ('leaderboard_week', 'get', '/api/leaderboards/speed/?period=week&limit=100', None),
+            ('training_volume', 'get', f'/api/training_volume/?athletes={athlete.id},{coach.id}&period=week'
+                                       f'&from={timezone.localdate() - timezone.timedelta(days=365)}', None),
+            ('upload', 'post', '/api/upload_file/', lambda: {'file': _upload_file()}),
+            ('upload_status', 'get', f'/api/upload_file/{self.job.id}/', None),
+            ('upload_rejected', 'get', f'/api/upload_file/{self.job.id}/rejected/', None),
+            ('metrics', 'get', '/api/internal/metrics/', None),
+            ('api_root', 'get', '/', None),
+        ]
+
+    def measure(self, client, name, method, url, data, repeat):
+        durations, queries, statuses = [], [], set()
+        for _ in range(repeat):
+            request_url = url() if callable(url) else url
+            request_data = data() if callable(data) else data
+            if request_data is None:
+                kwargs = {}
+            elif 'file' in request_data:
+                kwargs = {'data': request_data}
+            else:
+                kwargs = {'data': json.dumps(request_data), 'content_type': 'application/json'}
+            # Запись каждого повтора откатывается к точке сохранения, чтобы сценарии не влияли
+            # друг на друга. Сама точка сохранения в замер не попадает
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(request_url, **kwargs)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    durations.append((time.perf_counter() - started) * 1000)
+                transaction.set_rollback(True)
+            queries.append(len(context.captured_queries))
+            statuses.add(response.status_code)
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        return {
+            'name': name,
+            'method': method.upper(),
+            'route': resolve(request_url.split('?')[0]).route,
+            'url': request_url,
+            'statuses': sorted(statuses),
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2),
+            'queries': max(queries),
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+
+    def print_report(self, results, compare):
+        previous = {}
+        if compare:
+            with open(compare) as file:
+                previous = {result['name']: result for result in json.load(file)['results']}
+        self.stdout.write(f'{"эндпоинт":<22}{"p50":>9}{"p95":>9}{"p99":>9}{"SQL":>6}  статусы')
+        for result in results:
+            line = (f'{result["name"]:<22}{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}'
+                    f'{result["p99_ms"]:>9.1f}{result["queries"]:>6}  {result["statuses"]}')
+            before = previous.get(result['name'])
+            if before and before['p95_ms']:
+                line += f'  p95 {(result["p95_ms"] / before["p95_ms"] - 1) * 100:+.0f}%'
+                line += f', SQL {result["queries"] - before["queries"]:+d}'
+            self.stdout.write(line)
@@ -0,0 +1,151 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from app_run.caching import bump_version
+from app_run.geodesy import track_distances
+from app_run.models import Run, Position, CollectibleItem, Subscription, AthleteStats
+from app_run.leaderboards import rebuild_leaderboards
+from app_run.rollups import rebuild_training_rollups
+from app_run.spatial import invalidate_collectible_index
+
+
+# Центр, вокруг которого раскладываются забеги и предметы
+CENTER_LATITUDE = 55.75
+CENTER_LONGITUDE = 37.62
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--coaches', type=int, default=500)
+        parser.add_argument('--subscriptions', type=int, default=20000)
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--runs', type=int, default=20000)
+        parser.add_argument('--positions', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+
+        coaches, athletes = self.create_users(options['users'], options['coaches'])
+        self.create_subscriptions(coaches, athletes, options['subscriptions'])
+        self.create_items(options['items'])
+        self.create_runs(athletes, options['runs'], options['positions'])
+        self.rebuild_athlete_stats(athletes)
+        rebuild_leaderboards()
+        rebuild_training_rollups(athletes.tolist())
+
+        # bulk_create не отправляет сигналы, поэтому кеши сбрасываем сами
+        invalidate_collectible_index()
+        for model in (User, Subscription, CollectibleItem, Run):
+            bump_version(model)
+
+        self.stdout.write(f'Готово за {time.perf_counter() - started:.1f} с')
+
+    def create_users(self, count, coaches_count):
+        prefix = f'synthetic{int(time.time())}_'
+        # UserViewSet отдает только is_superuser=True
+        users = [User(username=f'{prefix}{i}', first_name=f'Имя{i}', last_name=f'Фамилия{i}',
+                      password='!', is_staff=i < coaches_count, is_superuser=True)
+                 for i in range(count)]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        ids = list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', 'is_staff'))
+        coaches = np.array([user_id for user_id, is_staff in ids if is_staff], dtype=np.int64)
+        athletes = np.array([user_id for user_id, is_staff in ids if not is_staff], dtype=np.int64)
+        self.stdout.write(f'Пользователей: {len(ids)} (тренеров {len(coaches)})')
+        return coaches, athletes
+
+    def create_subscriptions(self, coaches, athletes, count):
+        if not len(coaches) or not len(athletes):
+            return
+        count = min(count, len(athletes))
+        subscribed = self.rng.choice(athletes, size=count, replace=False)
+        coach_ids = self.rng.choice(coaches, size=count)
+        ratings = self.rng.integers(1, 6, size=count)
+        Subscription.objects.bulk_create(
+            [Subscription(coach_id=int(coach_id), athlete_id=int(athlete_id), rating=int(rating))
+             for coach_id, athlete_id, rating in zip(coach_ids, subscribed, ratings)],
+            batch_size=self.batch_size, ignore_conflicts=True)
+        self.stdout.write(f'Подписок: {count}')
+
+    def create_items(self, count):
+        latitudes = np.round(CENTER_LATITUDE + self.rng.uniform(-0.3, 0.3, size=count), 4)
+        longitudes = np.round(CENTER_LONGITUDE + self.rng.uniform(-0.5, 0.5, size=count), 4)
+        for start in range(0, count, self.batch_size):
+            CollectibleItem.objects.bulk_create([
+                CollectibleItem(name=f'Предмет {i}', uid=f'synthetic-{i}', latitude=float(latitudes[i]),
+                                longitude=float(longitudes[i]), picture='https://example.com/item.png',
+                                value=int(i % 100))
+                for i in range(start, min(start + self.batch_size, count))])
+        self.stdout.write(f'Предметов: {count}')
+
+    def create_runs(self, athletes, runs_count, positions_count):
+        if not len(athletes) or not runs_count:
+            return
+        points_per_run = max(positions_count // runs_count, 2)
+        runs_per_batch = max(self.batch_size // points_per_run, 1)
+        step = timedelta(seconds=5)
+        created_positions = 0
+
+        for start in range(0, runs_count, runs_per_batch):
+            batch_size = min(runs_per_batch, runs_count - start)
+            # Случайное блуждание: ~3 м/с при шаге 5 с
+            starts_latitude = CENTER_LATITUDE + self.rng.uniform(-0.2, 0.2, size=(batch_size, 1))
+            starts_longitude = CENTER_LONGITUDE + self.rng.uniform(-0.3, 0.3, size=(batch_size, 1))
+            latitudes = np.round(starts_latitude + np.cumsum(
+                self.rng.normal(0, 0.0001, size=(batch_size, points_per_run)), axis=1), 6)
+            longitudes = np.round(starts_longitude + np.cumsum(
+                self.rng.normal(0, 0.0002, size=(batch_size, points_per_run)), axis=1), 6)
+            started_at = timezone.now() - timedelta(days=int(self.rng.integers(0, 365)))
+
+            runs = []
+            segments = []
+            for i in range(batch_size):
+                meters = track_distances(latitudes[i], longitudes[i])
+                speeds = np.round(np.concatenate(([0], meters / step.total_seconds())), 2)
+                segments.append((meters, speeds))
+                runs.append(Run(
+                    athlete_id=int(self.rng.choice(athletes)), comment='synthetic', status='finished',
+                    distance=float(meters.sum() / 1000), run_time_seconds=int(step.total_seconds() * (points_per_run - 1)),
+                    speed=round(float(speeds.mean()), 2), positions_count=points_per_run,
+                    speed_sum=float(speeds.sum()), first_position_time=started_at,
+                    last_position_time=started_at + step * (points_per_run - 1),
+                    last_latitude=float(latitudes[i, -1]), last_longitude=float(longitudes[i, -1])))
+            Run.objects.bulk_create(runs)
+
+            positions = []
+            for i, run in enumerate(runs):
+                meters, speeds = segments[i]
+                distances = np.round(np.concatenate(([0], np.cumsum(meters))) / 1000, 2)
+                positions.extend(
+                    Position(run_id=run.id, latitude=float(latitudes[i, j]), longitude=float(longitudes[i, j]),
+                             date_time=started_at + step * j, speed=float(speeds[j]), distance=float(distances[j]))
+                    for j in range(points_per_run))
+            Position.objects.bulk_create(positions, batch_size=self.batch_size)
+            created_positions += len(positions)
+        self.stdout.write(f'Забегов: {runs_count}, позиций: {created_positions}')
+
+    def rebuild_athlete_stats(self, athletes):
+        AthleteStats.objects.filter(user_id__in=athletes.tolist()).delete()
+        rows = Run.objects.filter(status='finished', athlete_id__in=athletes.tolist()).values('athlete').annotate(
+            finished_runs=Count('id'),
+            total_distance=Sum('distance'),
+            total_run_time_seconds=Sum('run_time_seconds'),
+            speed_sum=Sum('speed'),
+            longest_distance=Max('distance'),
+            best_speed=Max('speed'),
+        ).order_by()
+        AthleteStats.objects.bulk_create([AthleteStats(user_id=row.pop('athlete'), **row) for row in rows],
+                                         batch_size=self.batch_size)
+        self.stdout.write('Счетчики атлетов пересчитаны')
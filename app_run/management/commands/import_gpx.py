@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.jobs import import_gpx_files
+
+
+class Command(BaseCommand):
+    help = 'Импортирует исторические забеги атлета из GPX-файлов или каталогов с ними'
+
+    def add_arguments(self, parser):
+        parser.add_argument('athlete_id', type=int)
+        parser.add_argument('paths', nargs='+')
+
+    def handle(self, *args, **options):
+        try:
+            athlete = User.objects.get(id=options['athlete_id'])
+        except User.DoesNotExist:
+            raise CommandError('Такого User не существует')
+
+        paths = []
+        for path in map(Path, options['paths']):
+            paths.extend(sorted(path.rglob('*.gpx')) if path.is_dir() else [path])
+
+        runs = errors = 0
+        for path, result in import_gpx_files(athlete, [str(path) for path in paths]).items():
+            if result['error']:
+                errors += 1
+                self.stderr.write(f'{path}: {result["error"]}')
+            runs += len(result['runs'])
+        self.stdout.write(f'Файлов: {len(paths)}, забегов: {runs}, ошибок: {errors}')
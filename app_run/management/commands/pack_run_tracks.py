@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from app_run.models import Position, Run
+
+
+class Command(BaseCommand):
+    # Запускается по расписанию: при финише забега трек не упаковывается
+    help = 'Упаковывает позиции завершенных забегов в RunTrack'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int)
+        parser.add_argument('--prune', action='store_true', default=getattr(settings, 'PRUNE_PACKED_POSITIONS', False),
+                            help='Удалить строки Position упакованных забегов')
+        parser.add_argument('--repack', action='store_true', help='Перепаковать уже упакованные забеги')
+
+    def handle(self, *args, **options):
+        # По строкам Position, а не positions_count: у забегов до накопительной статистики он 0
+        runs = Run.objects.filter(status='finished').filter(Exists(Position.objects.filter(run=OuterRef('pk'))))
+        if options['run_ids']:
+            runs = runs.filter(id__in=options['run_ids'])
+        if not options['repack']:
+            runs = runs.filter(track__isnull=True)
+
+        packed = points = size = 0
+        for run_id in runs.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                run = Run.objects.select_for_update().get(id=run_id)
+                track = run.pack_track(prune=options['prune'])
+            if track:
+                packed += 1
+                points += track.points_count
+                size += len(track.data)
+        self.stdout.write(f'Упаковано забегов: {packed}, позиций: {points}, байт: {size}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from app_run.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги лидербордов по завершенным забегам'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Строк лидербордов: {rebuild_leaderboards()}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from app_run.rollups import rebuild_training_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневной и недельный объем тренировок по завершенным забегам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('athlete_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Строк объема тренировок: {rebuild_training_rollups(options["athlete_ids"])}')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику забегов по сохраненным позициям и показывает расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='*', type=int)
+        parser.add_argument('--fix', action='store_true', help='Сохранить пересчитанные значения')
+
+    def handle(self, *args, **options):
+        runs = Run.objects.all()
+        if options['run_ids']:
+            runs = runs.filter(id__in=options['run_ids'])
+
+        mismatches = 0
+        for run in runs.iterator():
+            stored = (run.distance, run.run_time_seconds, run.speed)
+            run.recompute_stats()
+            if run.status == 'finished':
+                run.finish()
+            recomputed = (run.distance, run.run_time_seconds, run.speed)
+            if abs(stored[0] - recomputed[0]) > 0.001 or stored[1:] != recomputed[1:]:
+                mismatches += 1
+                self.stdout.write(f'Забег {run.id}: сохранено {stored}, пересчитано {recomputed}')
+            if options['fix']:
+                run.save(update_fields=Run.STATS_FIELDS + ['run_time_seconds', 'speed'])
+
+        self.stdout.write(f'Расхождений: {mismatches}')
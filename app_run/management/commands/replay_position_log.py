@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.ingest import log_dir, replay_logs
+
+
+class Command(BaseCommand):
+    help = 'Дописывает в базу позиции из журналов буферизованной записи, оставшихся от остановленных процессов'
+
+    def handle(self, *args, **options):
+        replayed = replay_logs(log_dir())
+        self.stdout.write(f'Дописано позиций: {replayed}')
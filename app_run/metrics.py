@@ -0,0 +1,169 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    # Гистограммы по (метрика, маршрут, метод) в памяти процесса
+    metrics = {
+        'app_run_request_duration_seconds': ('Время обработки запроса', LATENCY_BUCKETS),
+        'app_run_request_queries': ('Количество SQL-запросов на запрос', QUERY_BUCKETS),
+        'app_run_request_sql_duration_seconds': ('Суммарное время SQL на запрос', LATENCY_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, route, method, duration, queries, sql_duration):
+        values = zip(self.metrics, (duration, queries, sql_duration))
+        with self.lock:
+            for name, value in values:
+                key = (name, route, method)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.metrics[name][1])
+                self.histograms[key].observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def render(self):
+        # Текстовый формат Prometheus
+        lines = []
+        with self.lock:
+            for name, (description, buckets) in self.metrics.items():
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, route, method), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    labels = f'route="{_escape(route)}",method="{method}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class QueryCounter:
+    # Считает запросы и время в них для текущего запроса
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+# Счетчик запроса, который сейчас обрабатывается. Соединения с БД у каждого потока свои, а под ASGI
+# синхронные вьюхи и sync_to_async работают в других потоках, чем middleware. Контекст asgiref
+# переносит в эти потоки, поэтому счетчик ищется в контексте, а не вешается на соединение
+_request_counter = ContextVar('request_counter', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = _request_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install_query_counter(connection):
+    # Из signals.connection_created, для каждого нового соединения любого потока. В начало списка:
+    # connection.execute_wrapper() при выходе снимает последний элемент
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+class RequestMetricsMiddleware:
+    # Работает и под WSGI, и под ASGI: с async-вьюхами запрос не уходит в поток, запросы к БД
+    # из потоков sync_to_async попадают в счетчик через контекст
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        token = _request_counter.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_counter.reset(token)
+        self.observe(request, start, counter)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        token = _request_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_counter.reset(token)
+        self.observe(request, start, counter)
+        return response
+
+    def observe(self, request, start, counter):
+        match = request.resolver_match
+        route = match.route if match else 'unresolved'
+        registry.observe(route, request.method, time.perf_counter() - start, counter.count, counter.duration)
+
+
+def metrics_view(request):
+    # Гистограммы только того процесса, который ответил: у каждого воркера (gunicorn, uvicorn,
+    # контейнер Lambda) свой registry. При нескольких воркерах опрашивать нужно каждый процесс,
+    # а суммировать уже в Prometheus, иначе значения прыгают между ответами разных воркеров
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        allowed = request.headers.get('Authorization') == f'Bearer {token}'
+    else:
+        # Без токена - только сотрудникам, вошедшим через админку
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0015_alter_run_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='first_position_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_latitude',
+            field=models.DecimalField(decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_longitude',
+            field=models.DecimalField(decimal_places=6, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_position_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='positions_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='speed_sum',
+            field=models.FloatField(default=0),
+        ),
+    ]
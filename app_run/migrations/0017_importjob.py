@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 19:34
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0016_run_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('finished', 'Завершена'), ('failed', 'Ошибка')], default='pending', max_length=30)),
+                ('file_path', models.CharField(default='', max_length=500)),
+                ('rows_processed', models.IntegerField(default=0)),
+                ('rows_rejected', models.IntegerField(default=0)),
+                ('rejected_rows', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
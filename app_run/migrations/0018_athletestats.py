@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 19:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def fill_athlete_stats(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    AthleteStats = apps.get_model('app_run', 'AthleteStats')
+    rows = Run.objects.filter(status='finished').values('athlete').annotate(
+        finished_runs=Count('id'),
+        total_distance=Sum('distance'),
+        total_run_time_seconds=Sum('run_time_seconds'),
+        speed_sum=Sum('speed'),
+        longest_distance=Max('distance'),
+        best_speed=Max('speed'),
+    ).order_by()
+    AthleteStats.objects.bulk_create([AthleteStats(user_id=row.pop('athlete'), **row) for row in rows],
+                                     batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0017_importjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AthleteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finished_runs', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+                ('total_run_time_seconds', models.IntegerField(default=0)),
+                ('speed_sum', models.FloatField(default=0)),
+                ('longest_distance', models.FloatField(default=0)),
+                ('best_speed', models.FloatField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_athlete_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 19:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0018_athletestats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoachAnalytics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('longest_run_value', models.FloatField(null=True)),
+                ('longest_run_user', models.IntegerField(null=True)),
+                ('total_run_value', models.FloatField(null=True)),
+                ('total_run_user', models.IntegerField(null=True)),
+                ('speed_avg_value', models.FloatField(null=True)),
+                ('speed_avg_user', models.IntegerField(null=True)),
+                ('coach', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analytics', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
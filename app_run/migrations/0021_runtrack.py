@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 19:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0020_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunTrack',
+            fields=[
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='track', serialize=False, to='app_run.run')),
+                ('points_count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 20:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0021_runtrack'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=5)),
+                ('period_start', models.DateField()),
+                ('finished_runs', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0)),
+                ('longest_distance', models.FloatField(default=0)),
+                ('speed_sum', models.FloatField(default=0)),
+                ('average_speed', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'period', 'period_start'], name='leaderboard_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'period_start', 'user'), name='leaderboard_entry_unique')],
+            },
+        ),
+    ]
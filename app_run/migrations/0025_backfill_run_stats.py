@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+from app_run.geodesy import track_distances
+
+
+def backfill_run_stats(apps, schema_editor):
+    # Забеги в процессе, начатые до накопительной статистики: без итогов по уже сохраненным
+    # позициям следующая точка считалась бы первой, а дистанция - с нуля
+    Run = apps.get_model('app_run', 'Run')
+    Position = apps.get_model('app_run', 'Position')
+    runs = Run.objects.filter(status='in_progress', positions_count=0).filter(
+        Exists(Position.objects.filter(run=OuterRef('pk'))))
+    for run in runs.iterator():
+        latitudes, longitudes, date_times, speeds = zip(*Position.objects.filter(run=run).order_by('id').values_list(
+            'latitude', 'longitude', 'date_time', 'speed'))
+        run.distance = float(track_distances(latitudes, longitudes).sum()) / 1000
+        run.positions_count = len(latitudes)
+        run.speed_sum = sum(speeds)
+        run.first_position_time = next((date_time for date_time in date_times if date_time), None)
+        run.last_position_time = date_times[-1]
+        run.last_latitude = latitudes[-1]
+        run.last_longitude = longitudes[-1]
+        run.save(update_fields=['distance', 'positions_count', 'speed_sum', 'first_position_time',
+                                'last_position_time', 'last_latitude', 'last_longitude'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0024_run_athlete_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_run_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0025_backfill_run_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='rejected_file',
+            field=models.FileField(blank=True, upload_to='import_jobs/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0026_importjob_rejected_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='position',
+            name='run',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='app_run.run'),
+        ),
+    ]
@@ -1,6 +1,13 @@
+import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
 
+from .caching import bump_version_on_commit
+from .geodesy import track_distances
+from .tracks import pack_track, unpack_track
+
 
 STATUS_CHOICES = [
     ('init', 'Инициализация забега'),
@@ -8,19 +15,141 @@ STATUS_CHOICES = [
     ('finished', 'Забег окончен'),
 ]
 
+JOB_STATUS_CHOICES = [
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('finished', 'Завершена'),
+    ('failed', 'Ошибка'),
+]
+
 
 class Run(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     comment = models.TextField()
-    athlete = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Отдельный индекс по athlete не нужен: составные индексы (athlete, ...) начинаются с этого поля
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     status = models.CharField(max_length=30, choices=STATUS_CHOICES, default='init')
     distance = models.FloatField(default=0)
     run_time_seconds = models.IntegerField(default=0)
     speed = models.FloatField(default=0)
+    # Накопительная статистика, обновляется при добавлении каждой позиции
+    positions_count = models.IntegerField(default=0)
+    speed_sum = models.FloatField(default=0)
+    first_position_time = models.DateTimeField(null=True)
+    last_position_time = models.DateTimeField(null=True)
+    last_latitude = models.DecimalField(decimal_places=6, max_digits=9, null=True)
+    last_longitude = models.DecimalField(decimal_places=6, max_digits=10, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['athlete', 'status'], name='run_athlete_status_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='run_status_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='run_created_idx'),
+            models.Index(fields=['athlete', 'created_at', 'id'], name='run_athlete_created_idx'),
+        ]
+
+    STATS_FIELDS = ['distance', 'positions_count', 'speed_sum', 'first_position_time', 'last_position_time',
+                    'last_latitude', 'last_longitude']
+    TRACK_FIELDS = ['id', 'latitude', 'longitude', 'date_time', 'speed', 'distance']
 
     def __str__(self):
         return f'{self.athlete} - {self.status}'
 
+    def _accumulate(self, latitudes, longitudes, date_times):
+        # Продлевает трек забега точками в порядке поступления. Для каждой точки возвращает
+        # (метры от предыдущей или None для первой точки забега, секунды, накопленная дистанция в км)
+        if not latitudes:
+            return []
+        if self.positions_count:
+            segments = track_distances([self.last_latitude, *latitudes], [self.last_longitude, *longitudes]).tolist()
+        else:
+            segments = [None] + track_distances(latitudes, longitudes).tolist()
+
+        steps = []
+        for meters, date_time in zip(segments, date_times):
+            seconds = 0
+            if meters is not None:
+                self.distance += meters / 1000
+                if date_time and self.last_position_time:
+                    seconds = (date_time - self.last_position_time).total_seconds()
+            if self.first_position_time is None:
+                self.first_position_time = date_time
+            self.last_position_time = date_time
+            self.positions_count += 1
+            steps.append((meters, seconds, self.distance))
+        self.last_latitude = latitudes[-1]
+        self.last_longitude = longitudes[-1]
+        return steps
+
+    def add_positions(self, positions):
+        # Заполняет speed/distance новых позиций и обновляет итоги забега, сохранение на вызывающем
+        if not self.positions_count and self.pk and Position.objects.filter(run=self).exists():
+            # Забег начат до накопительной статистики: итоги по уже сохраненным позициям
+            self.recompute_stats()
+        steps = self._accumulate([position.latitude for position in positions],
+                                 [position.longitude for position in positions],
+                                 [position.date_time for position in positions])
+        for position, (meters, seconds, distance) in zip(positions, steps):
+            if meters is not None:
+                position.speed = round(meters / seconds, 2) if seconds > 0 else 0
+                position.distance = round(distance, 2)
+            self.speed_sum += position.speed
+
+    def add_position(self, position):
+        self.add_positions([position])
+
+    def recompute_stats(self):
+        # Полный пересчет по сохраненным позициям, для аудита и старых забегов
+        self.distance = 0
+        self.positions_count = 0
+        self.speed_sum = 0
+        self.first_position_time = self.last_position_time = None
+        self.last_latitude = self.last_longitude = None
+        positions = self.track_positions()
+        if positions:
+            self._accumulate([position.latitude for position in positions],
+                             [position.longitude for position in positions],
+                             [position.date_time for position in positions])
+            self.speed_sum = sum(position.speed for position in positions)
+
+    def track_positions(self):
+        # Позиции в порядке поступления. У упакованного забега читаются из трека одной строкой,
+        # даже если строки Position уже удалены
+        try:
+            return RunTrack.objects.get(run=self).positions()
+        except RunTrack.DoesNotExist:
+            return list(Position.objects.filter(run=self).order_by('id'))
+
+    def pack_track(self, prune=False):
+        # Упаковывает позиции завершенного забега в RunTrack, prune удаляет строки Position
+        points = list(Position.objects.filter(run=self).order_by('id').values_list(*self.TRACK_FIELDS))
+        if not points:
+            return None
+        # Ключ - id забега, поэтому save() обновит уже упакованный трек или вставит новый
+        track = RunTrack(run=self, points_count=len(points), data=pack_track(points))
+        track.save()
+        bump_version_on_commit(RunTrack.version_name(self.id))
+        if prune:
+            Position.objects.filter(run=self).delete()
+        return track
+
+    def unpack_track(self):
+        # Обратно к строкам Position, чтобы дописать в завершенный забег поздние точки
+        try:
+            track = RunTrack.objects.get(run=self)
+        except RunTrack.DoesNotExist:
+            return
+        if not Position.objects.filter(run=self).exists():
+            Position.objects.bulk_create(track.positions())
+        track.delete()
+
+    def finish(self):
+        self.status = 'finished'
+        if self.positions_count:
+            if self.first_position_time and self.last_position_time:
+                self.run_time_seconds = int((self.last_position_time - self.first_position_time).total_seconds())
+            self.speed = round(self.speed_sum / self.positions_count, 2)
+
 
 class AthleteInfo(models.Model):
     weight = models.IntegerField(null=True)
@@ -31,9 +160,147 @@ class AthleteInfo(models.Model):
         return f'{self.user} - {self.weight}'
 
 
+class AthleteStats(models.Model):
+    # Итоги по завершенным забегам атлета, обновляются при финише забега
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    finished_runs = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0)
+    total_run_time_seconds = models.IntegerField(default=0)
+    speed_sum = models.FloatField(default=0)
+    longest_distance = models.FloatField(default=0)
+    best_speed = models.FloatField(default=0)
+
+    def __str__(self):
+        return f'{self.user} - {self.finished_runs} - {self.total_distance}'
+
+    @classmethod
+    def record_finished_run(cls, run, previous=None):
+        # previous - итоги того же забега, учтенные при первом завершении (поздние точки).
+        # Дистанция забега от них только растет, а best_speed может остаться от прежней скорости
+        stats, created = cls.objects.select_for_update().get_or_create(user_id=run.athlete_id)
+        if previous is None:
+            stats.finished_runs += 1
+        else:
+            stats.total_distance -= previous.distance
+            stats.total_run_time_seconds -= previous.run_time_seconds
+            stats.speed_sum -= previous.speed
+        stats.total_distance += run.distance
+        stats.total_run_time_seconds += run.run_time_seconds
+        stats.speed_sum += run.speed
+        stats.longest_distance = max(stats.longest_distance, run.distance)
+        stats.best_speed = max(stats.best_speed, run.speed)
+        stats.save()
+        return stats
+
+
+class CoachAnalytics(models.Model):
+    # Лидеры среди бегунов тренера, обновляются при финише забега (app_run/analytics.py)
+    coach = models.OneToOneField(User, on_delete=models.CASCADE, related_name='analytics')
+    longest_run_value = models.FloatField(null=True)
+    longest_run_user = models.IntegerField(null=True)
+    total_run_value = models.FloatField(null=True)
+    total_run_user = models.IntegerField(null=True)
+    speed_avg_value = models.FloatField(null=True)
+    speed_avg_user = models.IntegerField(null=True)
+
+    def __str__(self):
+        return f'{self.coach} - {self.longest_run_user} - {self.total_run_user} - {self.speed_avg_user}'
+
+
+class LeaderboardEntry(models.Model):
+    # Итоги атлета за период для лидербордов (app_run/leaderboards.py), обновляются при финише забега.
+    # period_start - первый день месяца или понедельник недели, для 'all' - ALL_TIME_START
+    ALL_TIME_START = datetime.date(1970, 1, 1)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    period = models.CharField(max_length=5)
+    period_start = models.DateField()
+    finished_runs = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0)
+    longest_distance = models.FloatField(default=0)
+    speed_sum = models.FloatField(default=0)
+    average_speed = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'user'], name='leaderboard_entry_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'period', 'period_start'], name='leaderboard_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.period} {self.period_start} - {self.total_distance}'
+
+    def add_run(self, run, previous=None):
+        if previous is None:
+            self.finished_runs += 1
+        else:
+            self.total_distance -= previous.distance
+            self.speed_sum -= previous.speed
+        self.total_distance += run.distance
+        self.longest_distance = max(self.longest_distance, run.distance)
+        self.speed_sum += run.speed
+        self.average_speed = self.speed_sum / self.finished_runs
+
+
+class TrainingRollup(models.Model):
+    # Объем тренировок атлета за день или неделю (app_run/rollups.py), обновляется при финише забега.
+    # period_start - сам день или понедельник недели
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='training_rollups')
+    period = models.CharField(max_length=4)
+    period_start = models.DateField()
+    runs = models.IntegerField(default=0)
+    distance = models.FloatField(default=0)
+    run_time_seconds = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period', 'period_start'], name='training_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.period} {self.period_start} - {self.distance}'
+
+    def add_run(self, run, previous=None):
+        if previous is None:
+            self.runs += 1
+        else:
+            self.distance -= previous.distance
+            self.run_time_seconds -= previous.run_time_seconds
+        self.distance += run.distance
+        self.run_time_seconds += run.run_time_seconds
+
+
+class RunTrack(models.Model):
+    # Упакованные позиции завершенного забега, формат в tracks.py
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, primary_key=True, related_name='track')
+    points_count = models.IntegerField(default=0)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f'{self.run_id} - {self.points_count}'
+
+    @staticmethod
+    def version_name(run_id):
+        # Версия трека одного забега для кеша ответов (caching.py), меняется при каждой упаковке
+        return f'app_run.runtrack:{run_id}'
+
+    def positions(self):
+        # Несохраненные Position с теми же значениями, что были в таблице
+        return [Position(run_id=self.run_id, **dict(zip(Run.TRACK_FIELDS, point))) for point in unpack_track(self.data)]
+
+
 class Challenge(models.Model):
     full_name = models.CharField(max_length=100, default='')
-    athlete = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Отдельный индекс по athlete не нужен: его покрывает (athlete, full_name)
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['full_name', 'athlete'], name='challenge_name_athlete_idx'),
+            models.Index(fields=['athlete', 'full_name'], name='challenge_athlete_name_idx'),
+        ]
 
     def __str__(self):
         return f'{self.athlete} - {self.full_name}'
@@ -42,11 +309,18 @@ class Challenge(models.Model):
 class Position(models.Model):
     latitude = models.DecimalField(decimal_places=6, max_digits=9)
     longitude = models.DecimalField(decimal_places=6, max_digits=10)
-    run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    # Отдельный индекс по run не нужен: (run, date_time, id) и (run, id) начинаются с этого поля
+    run = models.ForeignKey(Run, on_delete=models.CASCADE, db_index=False)
     date_time = models.DateTimeField(null=True)
     speed = models.FloatField(default=0)
     distance = models.FloatField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'date_time', 'id'], name='position_run_time_idx'),
+            models.Index(fields=['run', 'id'], name='position_run_id_idx'),
+        ]
+
     def __str__(self):
         return f'{self.run} - {self.latitude} - {self.longitude} - id:{self.id}'
 
@@ -65,12 +339,34 @@ class CollectibleItem(models.Model):
 
 
 class Subscription(models.Model):
-    coach = models.ForeignKey(User, on_delete=models.CASCADE, related_name='athletes')
-    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coaches')
+    # Отдельные индексы по coach и athlete не нужны: их покрывают unique_together (coach, athlete)
+    # и индекс (athlete, id), по которому берется первый тренер атлета
+    coach = models.ForeignKey(User, on_delete=models.CASCADE, related_name='athletes', db_index=False)
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coaches', db_index=False)
     rating = models.IntegerField(null=True)
 
     class Meta:
         unique_together = ['coach', 'athlete']  # Уникальность подписки между двумя пользователями.
+        indexes = [
+            models.Index(fields=['athlete', 'id'], name='subscription_athlete_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.athlete} подписан на {self.coach}"
+
+
+class ImportJob(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+    status = models.CharField(max_length=30, choices=JOB_STATUS_CHOICES, default='pending')
+    file_path = models.CharField(max_length=500, default='')
+    rows_processed = models.IntegerField(default=0)
+    rows_rejected = models.IntegerField(default=0)
+    # Отклоненные строки - файлом xlsx в хранилище; rejected_rows остался от загрузок, которые
+    # держали их в базе одним JSON
+    rejected_file = models.FileField(upload_to='import_jobs/', blank=True)
+    rejected_rows = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True, default='')
 
     def __str__(self):
-        return f"{self.athlete} подписан на {self.coach}"
\ No newline at end of file
+        return f'Загрузка {self.id} - {self.status}'
@@ -0,0 +1,164 @@
+import base64
+import json
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class MyPagination(PageNumberPagination):
+    page_size_query_param = 'size'
+
+
+class RosterPagination(MyPagination):
+    page_size = 50
+    max_page_size = 500
+
+
+class KeysetPagination(BasePagination):
+    # Постраничный вывод по ключу (ordering_field, id) вместо OFFSET: каждая страница -
+    # это WHERE по значениям последней строки предыдущей, поэтому глубокие страницы
+    # стоят столько же, сколько первая. Как и MyPagination, включается параметром size.
+    ordering_field = None
+    page_size_query_param = 'size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return None
+        if page_size <= 0:
+            return None
+        return min(page_size, self.max_page_size)
+
+    def is_descending(self, request):
+        return request.query_params.get(OrderingFilter.ordering_param) == f'-{self.ordering_field}'
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            value = model._meta.get_field(self.ordering_field).to_python(value)
+            return value, int(pk), bool(reverse)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        value = getattr(row, self.ordering_field)
+        value = value.isoformat() if hasattr(value, 'isoformat') else value
+        encoded = base64.urlsafe_b64encode(json.dumps([value, row.pk, int(reverse)]).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        # Кроме QuerySet принимает уже загруженный список объектов, например позиции из RunTrack
+        model = queryset.model if hasattr(queryset, 'model') else view.get_queryset().model
+        cursor = self.decode_cursor(request, model)
+        reverse = cursor is not None and cursor[2]
+        # Назад листаем запросом в обратном порядке и разворачиваем страницу
+        ascending = self.is_descending(request) == reverse
+        if isinstance(queryset, list):
+            rows = self.slice_list(queryset, cursor, ascending)
+        else:
+            rows = self.slice_queryset(queryset, cursor, ascending)
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.rows = rows
+        return rows
+
+    def slice_queryset(self, queryset, cursor, ascending):
+        # NULL считается меньше любого значения, как в slice_list и в SQLite. В Postgres по
+        # умолчанию наоборот, поэтому для поля с null порядок NULL задается явно
+        field = self.ordering_field
+        lookup = 'gt' if ascending else 'lt'
+        if queryset.model._meta.get_field(field).null:
+            order = F(field).asc(nulls_first=True) if ascending else F(field).desc(nulls_last=True)
+        else:
+            order = field if ascending else f'-{field}'
+        queryset = queryset.order_by(order, 'id' if ascending else '-id')
+        if cursor:
+            value, pk = cursor[0], cursor[1]
+            if value is None:
+                # Сравнение с NULL в SQL всегда ложно: соседние строки ищутся через isnull
+                after = Q(**{f'{field}__isnull': True, f'id__{lookup}': pk})
+                if ascending:
+                    after |= Q(**{f'{field}__isnull': False})
+            else:
+                after = Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': pk})
+                if not ascending:
+                    after |= Q(**{f'{field}__isnull': True})
+            queryset = queryset.filter(after)
+        return list(queryset[:self.page_size + 1])
+
+    def slice_list(self, rows, cursor, ascending):
+        # Тот же порядок, что у slice_queryset: NULL раньше остальных значений
+        def key(value, pk):
+            return value is not None, value, pk
+
+        keyed = sorted(((key(getattr(row, self.ordering_field), row.pk), row) for row in rows),
+                       key=lambda item: item[0], reverse=not ascending)
+        if cursor:
+            boundary = key(cursor[0], cursor[1])
+            keyed = [(row_key, row) for row_key, row in keyed
+                     if (row_key > boundary if ascending else row_key < boundary)]
+        return [row for _, row in keyed[:self.page_size + 1]]
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            # Первая страница: пустой cursor, чтобы RunPagination осталась постраничной по ключу
+            return replace_query_param(self.base_url, self.cursor_query_param, '')
+        return self.encode_cursor(self.rows[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RunPagination(KeysetPagination):
+    # Список забегов по умолчанию постраничный, как раньше (count, ?page=). По ключу - только
+    # если в запросе есть cursor, для первой страницы пустой: ?size=50&cursor=
+    ordering_field = 'created_at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.fallback = None
+            return super().paginate_queryset(queryset, request, view)
+        self.fallback = MyPagination()
+        return self.fallback.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class PositionPagination(KeysetPagination):
+    ordering_field = 'date_time'
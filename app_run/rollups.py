@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate, TruncWeek
+from django.utils import timezone
+
+from .leaderboards import period_start
+from .models import Run, TrainingRollup
+
+
+# Объем тренировок по дням и неделям для графиков тренера: строка TrainingRollup на атлета
+# и период вместо агрегации всех его забегов на каждый запрос
+PERIODS = ['day', 'week']
+# Ограничения запроса: атлетов и точек графика на атлета
+MAX_ATHLETES = 50
+MAX_POINTS = 366
+
+
+def update_training_rollups(run, previous=None):
+    # Вызывается из services.finish_run, строка счетчиков атлета уже заблокирована
+    day = timezone.localdate(run.created_at)
+    starts = {period: period_start(period, day) for period in PERIODS}
+    rollups = {rollup.period: rollup for rollup in TrainingRollup.objects.select_for_update().filter(
+        Q(*[Q(period=period, period_start=start) for period, start in starts.items()], _connector=Q.OR),
+        user_id=run.athlete_id)}
+    created = [TrainingRollup(user_id=run.athlete_id, period=period, period_start=start)
+               for period, start in starts.items() if period not in rollups]
+    for rollup in [*rollups.values(), *created]:
+        rollup.add_run(run, previous)
+    if rollups:
+        TrainingRollup.objects.bulk_update(rollups.values(), ['runs', 'distance', 'run_time_seconds'])
+    TrainingRollup.objects.bulk_create(created)
+
+
+def rebuild_training_rollups(athlete_ids=None):
+    # Полный пересчет по завершенным забегам, для старых данных и bulk-загрузок
+    finished = Run.objects.filter(status='finished')
+    rollups = TrainingRollup.objects.all()
+    if athlete_ids:
+        finished = finished.filter(athlete_id__in=athlete_ids)
+        rollups = rollups.filter(user_id__in=athlete_ids)
+    created = []
+    with transaction.atomic():
+        rollups.delete()
+        for period, trunc in (('day', TruncDate('created_at')), ('week', TruncWeek('created_at'))):
+            rows = finished.annotate(start=trunc).values('athlete', 'start').annotate(
+                runs=Count('id'), distance=Sum('distance'), run_time_seconds=Sum('run_time_seconds')).order_by()
+            for row in rows:
+                start = row.pop('start')
+                created.append(TrainingRollup(user_id=row.pop('athlete'), period=period,
+                                              period_start=start.date() if period == 'week' else start, **row))
+        TrainingRollup.objects.bulk_create(created, batch_size=5000)
+    return len(created)
+
+
+def training_volume(athlete_ids, period, date_from, date_to):
+    # {id атлета: [точки графика]} одним запросом по индексу (user, period, period_start)
+    volume = {athlete_id: [] for athlete_id in athlete_ids}
+    rows = TrainingRollup.objects.filter(
+        user_id__in=athlete_ids, period=period, period_start__range=(period_start(period, date_from), date_to)
+    ).order_by('user_id', 'period_start').values_list('user_id', 'period_start', 'runs', 'distance', 'run_time_seconds')
+    for athlete_id, start, runs, distance, run_time_seconds in rows:
+        volume[athlete_id].append({
+            'start': start,
+            'runs': runs,
+            'distance': round(distance, 3),
+            'run_time_seconds': run_time_seconds,
+            # Темп в секундах на километр
+            'pace': round(run_time_seconds / distance) if distance else None,
+        })
+    return volume
@@ -0,0 +1,23 @@
+from .caching import abump_version, bump_version_on_commit
+from .models import Subscription
+
+
+# Ростер тренера (/api/roster_for_coach/<id>/) кешируется отдельно для каждого тренера.
+# Версия ростера меняется при изменении подписок тренера, профилей и забегов его бегунов. Сохранения
+# только накопительной статистики забега (каждая точка) версию не меняют: иначе кеш ростера
+# сбрасывался бы на каждой точке, а итоги забега в процессе отстают не дольше RESPONSE_CACHE_TIMEOUT
+
+
+def version_name(coach_id):
+    return f'app_run.roster:{coach_id}'
+
+
+def bump_rosters(athlete_id):
+    # Из сигналов, обычно внутри транзакции: версии меняются после коммита
+    for coach_id in Subscription.objects.filter(athlete_id=athlete_id).values_list('coach_id', flat=True):
+        bump_version_on_commit(version_name(coach_id))
+
+
+async def abump_rosters(athlete_id):
+    async for coach_id in Subscription.objects.filter(athlete_id=athlete_id).values_list('coach_id', flat=True):
+        await abump_version(version_name(coach_id))
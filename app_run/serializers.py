@@ -1,9 +1,12 @@
-from geopy.distance import geodesic
 from rest_framework import serializers
-from .models import Run, Challenge, Position, CollectibleItem, Subscription
+from .models import Run, Challenge, Position, CollectibleItem, ImportJob, AthleteStats
+from .spatial import collect_nearby_items
 from django.contrib.auth.models import User
 
 
+POSITION_BATCH_MAX_SIZE = 5000
+
+
 class SmallUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -16,6 +19,9 @@ class RunSerializer(serializers.ModelSerializer):
     class Meta:
         model = Run
         fields = '__all__'
+        # Накопительную статистику и итоги забега ведет сервер по позициям
+        read_only_fields = ['distance', 'run_time_seconds', 'speed', 'positions_count', 'speed_sum',
+                            'first_position_time', 'last_position_time', 'last_latitude', 'last_longitude']
 
 
 class CollectibleItemSerializer(serializers.ModelSerializer):
@@ -34,6 +40,12 @@ class CollectibleItemSerializer(serializers.ModelSerializer):
         return value
 
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'status', 'rows_processed', 'rows_rejected', 'created_at', 'finished_at', 'error']
+
+
 class UserSerializer(serializers.ModelSerializer):
     type = serializers.SerializerMethodField()
     runs_finished = serializers.IntegerField()
@@ -67,15 +79,7 @@ class PositionSerializer(serializers.ModelSerializer):
         if run.status != 'in_progress':
             raise serializers.ValidationError('Забег должен быть начат и еще не закончен')
 
-        current_latitude = data.get('latitude')
-        current_longitude = data.get('longitude')
-
-        collectible_items = CollectibleItem.objects.all()
-
-        for item in collectible_items:
-            distance = geodesic((current_latitude,current_longitude), (item.latitude, item.longitude)).meters
-            if distance <= 100:
-                item.users.add(run.athlete)
+        collect_nearby_items(run.athlete, [(data.get('latitude'), data.get('longitude'))])
 
         return data
 
@@ -90,6 +94,40 @@ class PositionSerializer(serializers.ModelSerializer):
         return value
 
 
+class PositionBatchItemSerializer(PositionSerializer):
+    class Meta(PositionSerializer.Meta):
+        fields = ['latitude', 'longitude', 'date_time']
+
+    def validate(self, data):
+        # Забег и предметы проверяются один раз на весь пакет в PositionBatchSerializer
+        return data
+
+
+class PositionAsyncSerializer(PositionBatchItemSerializer):
+    # Для async_views: проверяет только поля, забег читается асинхронным ORM во вьюхе
+    run = serializers.IntegerField()
+
+    class Meta(PositionBatchItemSerializer.Meta):
+        fields = ['run', 'latitude', 'longitude', 'date_time']
+
+
+class CollectibleCheckSerializer(PositionBatchItemSerializer):
+    athlete = serializers.IntegerField()
+
+    class Meta(PositionBatchItemSerializer.Meta):
+        fields = ['athlete', 'latitude', 'longitude']
+
+
+class PositionBatchSerializer(serializers.Serializer):
+    run = serializers.PrimaryKeyRelatedField(queryset=Run.objects.all())
+    positions = PositionBatchItemSerializer(many=True, allow_empty=False, max_length=POSITION_BATCH_MAX_SIZE)
+
+    def validate_run(self, value):
+        if value.status != 'in_progress':
+            raise serializers.ValidationError('Забег должен быть начат и еще не закончен')
+        return value
+
+
 # class UserDetailSerializer(UserSerializer):
 #     items = CollectibleItemSerializer(source='collectibleitems', many=True, read_only=True)
 #
@@ -106,10 +144,8 @@ class AthleteSerializer(UserSerializer):
         fields = UserSerializer.Meta.fields + ['coach', 'items']
 
     def get_coach(self, obj):
-        if Subscription.objects.filter(athlete=obj.id).exists():
-            subscription = Subscription.objects.get(athlete=obj.id)
-            return subscription.coach.id
-        return ''
+        # coach_id добавляется подзапросом в UserViewSet
+        return obj.coach_id or ''
 
 
 class CoachSerializer(UserSerializer):
@@ -121,5 +157,38 @@ class CoachSerializer(UserSerializer):
 
     def get_athletes(self, obj):
         #Возвращает пустой список, если ничего не найдено удовлетворяющее фильтру
-        athletes_list = Subscription.objects.filter(coach=obj.id).values_list('athlete__id', flat=True)
-        return athletes_list
\ No newline at end of file
+        return [subscription.athlete_id for subscription in obj.athletes.all()]
+
+
+class RosterRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Run
+        fields = ['id', 'status', 'created_at', 'distance', 'run_time_seconds', 'speed']
+
+
+class RosterAthleteSerializer(serializers.ModelSerializer):
+    # Бегун в ростере тренера. rating и latest_run проставляет CoachRosterView,
+    # счетчики берутся из AthleteStats, загруженной тем же запросом
+    rating = serializers.IntegerField(allow_null=True)
+    runs_finished = serializers.SerializerMethodField()
+    total_distance = serializers.SerializerMethodField()
+    latest_run = RosterRunSerializer(allow_null=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'date_joined', 'rating', 'runs_finished',
+                  'total_distance', 'latest_run']
+
+    def _stats(self, obj):
+        try:
+            return obj.stats
+        except AthleteStats.DoesNotExist:
+            return None
+
+    def get_runs_finished(self, obj):
+        stats = self._stats(obj)
+        return stats.finished_runs if stats else 0
+
+    def get_total_distance(self, obj):
+        stats = self._stats(obj)
+        return stats.total_distance if stats else 0
@@ -0,0 +1,62 @@
+from django.db import transaction
+
+from .analytics import update_coach_analytics
+from .challenges import award_challenges
+from .ingest import flush_positions
+from .leaderboards import update_leaderboards
+from .rollups import update_training_rollups
+from .live import publish_run_finished
+from .models import AthleteStats, Run, Position
+
+
+def finish_run(run, previous=None):
+    # Завершение забега: итоги забега, счетчики атлета, лидерборды, челленджи и аналитика тренеров.
+    # Вызывается внутри транзакции с заблокированной строкой забега. previous - копия уже завершенного
+    # забега до поздних точек (ingest.write_entries): счетчики исправляются на разницу.
+    # Трек упаковывается позже командой pack_run_tracks, чтобы не читать все позиции при финише
+    run.finish()
+    run.save()
+    stats = AthleteStats.record_finished_run(run, previous)
+    update_leaderboards(run, previous)
+    update_training_rollups(run, previous)
+    award_challenges(stats, run)
+    update_coach_analytics(stats)
+    return stats
+
+
+def stop_run(run_id):
+    # Завершение забега по запросу клиента. False, если забег не в процессе,
+    # Run.DoesNotExist, если забега нет
+    flush_positions()
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(id=run_id)
+        if run.status != 'in_progress':
+            return False
+        if not run.positions_count:
+            # Забеги, начатые до появления накопительной статистики
+            run.recompute_stats()
+        finish_run(run)
+        publish_run_finished(run)
+    return True
+
+
+def import_track(athlete, track, batch_size=5000):
+    # Завершенный забег из трека, посчитанного gpx.compute_track: позиции пишутся пачками,
+    # предметы рядом с давно пройденным маршрутом не собираются
+    with transaction.atomic():
+        run = Run.objects.create(
+            athlete=athlete, comment=track['name'] or 'Импорт GPX', status='in_progress',
+            distance=track['distance'], positions_count=track['positions_count'], speed_sum=track['speed_sum'],
+            first_position_time=track['first_position_time'], last_position_time=track['last_position_time'],
+            last_latitude=track['latitudes'][-1], last_longitude=track['longitudes'][-1])
+        Position.objects.bulk_create(
+            [Position(run=run, latitude=latitude, longitude=longitude, date_time=date_time, speed=speed,
+                      distance=distance)
+             for latitude, longitude, date_time, speed, distance in zip(
+                track['latitudes'], track['longitudes'], track['date_times'], track['speeds'], track['distances'])],
+            batch_size=batch_size)
+        # Исторический забег датируется началом трека, а не моментом загрузки
+        if track['first_position_time']:
+            run.created_at = track['first_position_time']
+        finish_run(run)
+    return run
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .analytics import reset_coach_analytics
+from .caching import bump_version_on_commit
+from .metrics import install_query_counter
+from .models import CollectibleItem, Challenge, Subscription, Run
+from .roster import bump_rosters, version_name as roster_version_name
+from .spatial import invalidate_collectible_index
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_counter(connection)
+
+
+@receiver([post_save, post_delete], sender=CollectibleItem)
+def collectible_item_changed(sender, **kwargs):
+    invalidate_collectible_index()
+
+
+@receiver([post_save, post_delete], sender=CollectibleItem)
+@receiver([post_save, post_delete], sender=Challenge)
+@receiver([post_save, post_delete], sender=Subscription)
+@receiver([post_save, post_delete], sender=User)
+def model_changed(sender, **kwargs):
+    bump_version_on_commit(sender)
+
+
+@receiver([post_save, post_delete], sender=Run)
+def run_changed(sender, instance, update_fields=None, **kwargs):
+    # Позиции сохраняют только накопительную статистику забега, такие сохранения
+    # не влияют на закешированные ответы и версию не меняют
+    if update_fields is None or 'status' in update_fields:
+        bump_version_on_commit(sender)
+        bump_rosters(instance.athlete_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # Профиль бегуна показывается в ростерах его тренеров
+    bump_rosters(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    bump_version_on_commit(roster_version_name(instance.coach_id))
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_saved(sender, instance, created, **kwargs):
+    if created:
+        reset_coach_analytics(instance.coach_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(sender, instance, **kwargs):
+    reset_coach_analytics(instance.coach_id)
@@ -0,0 +1,73 @@
+import numpy as np
+
+from .geodesy import EARTH_MEAN_RADIUS
+
+
+# Ширина тайла веб-меркатора в метрах на экваторе на пиксель при zoom=0 (тайл 256 px)
+METERS_PER_PIXEL_ZOOM_0 = 2 * np.pi * 6378137.0 / 256
+MAX_ZOOM = 22
+
+
+def zoom_tolerance(zoom, latitude):
+    # Допуск в метрах, равный одному пикселю карты на этом zoom и широте
+    return METERS_PER_PIXEL_ZOOM_0 * np.cos(np.radians(latitude)) / 2 ** zoom
+
+
+def _project(latitudes, longitudes):
+    # Равнопромежуточная проекция вокруг средней широты трека: для трека забега
+    # искажения пренебрежимы, а расстояния получаются в метрах
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.unwrap(np.asarray(longitudes, dtype=float), period=360))
+    x = EARTH_MEAN_RADIUS * longitudes * np.cos(latitudes.mean())
+    y = EARTH_MEAN_RADIUS * latitudes
+    return x, y
+
+
+def _segment_distances(x, y, start, end):
+    # Расстояния от точек start+1..end-1 до отрезка start-end
+    px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    length = dx * dx + dy * dy
+    if length == 0:
+        return np.hypot(px, py)
+    t = np.clip((px * dx + py * dy) / length, 0, 1)
+    return np.hypot(px - t * dx, py - t * dy)
+
+
+def douglas_peucker(latitudes, longitudes, tolerance):
+    # Индексы точек, оставшихся после упрощения трека алгоритмом Дугласа-Пекера с допуском
+    # в метрах. Первая и последняя точки сохраняются всегда
+    count = len(latitudes)
+    if count < 3:
+        return np.arange(count)
+    x, y = _project(latitudes, longitudes)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Стек вместо рекурсии: у длинных треков глубина рекурсии доходит до числа точек
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(x, y, start, end)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return np.flatnonzero(keep)
+
+
+def simplify_track(positions, tolerance=None, zoom=None):
+    # positions - позиции забега по порядку, нужен либо tolerance в метрах, либо zoom
+    latitudes = [float(position.latitude) for position in positions]
+    longitudes = [float(position.longitude) for position in positions]
+    if zoom is not None:
+        tolerance = float(zoom_tolerance(zoom, np.mean(latitudes) if latitudes else 0))
+    indexes = douglas_peucker(latitudes, longitudes, tolerance)
+    return {
+        'tolerance': round(tolerance, 3),
+        'points_count': len(positions),
+        'points': [[latitudes[i], longitudes[i]] for i in indexes],
+    }
@@ -0,0 +1,122 @@
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .geodesy import distances_from
+from .models import CollectibleItem
+
+
+# Самый короткий градус широты (на экваторе). Градус параллели не короче этого значения, умноженного
+# на косинус широты, поэтому bounding box по нему не меньше круга радиуса поиска
+METERS_PER_DEGREE = 110574
+COLLECT_RADIUS_METERS = 100
+
+
+class CollectibleItemIndex:
+    # Сетка ячеек cell_size x cell_size градусов: позиция проверяется только
+    # против предметов из ячеек, которые попали в bounding box радиуса поиска.
+    def __init__(self, items, cell_size=0.01):
+        self.cell_size = cell_size
+        self.lon_cells = round(360 / cell_size)
+        self.cells = {}
+        self.size = 0
+        self.built_at = time.monotonic()
+        for item_id, latitude, longitude in items:
+            latitude, longitude = float(latitude), float(longitude)
+            self.cells.setdefault(self._cell(latitude, longitude), []).append((item_id, latitude, longitude))
+            self.size += 1
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size) % self.lon_cells
+
+    def candidates(self, latitude, longitude, radius):
+        lat_delta = radius / METERS_PER_DEGREE
+        cos_lat = math.cos(math.radians(latitude))
+        lon_delta = 180 if cos_lat < 1e-9 else min(radius / (METERS_PER_DEGREE * cos_lat), 180)
+
+        min_row, max_row = (math.floor((latitude - lat_delta) / self.cell_size),
+                            math.floor((latitude + lat_delta) / self.cell_size))
+        min_col, max_col = (math.floor((longitude - lon_delta) / self.cell_size),
+                            math.floor((longitude + lon_delta) / self.cell_size))
+
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells):
+            # Около полюсов bbox покрывает больше ячеек, чем есть в индексе
+            buckets = [items for (row, col), items in self.cells.items() if min_row <= row <= max_row]
+        else:
+            buckets = []
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    bucket = self.cells.get((row, col % self.lon_cells))
+                    if bucket:
+                        buckets.append(bucket)
+
+        for bucket in buckets:
+            for item_id, item_latitude, item_longitude in bucket:
+                if abs(item_latitude - latitude) > lat_delta:
+                    continue
+                lon_diff = abs(item_longitude - longitude)
+                if min(lon_diff, 360 - lon_diff) > lon_delta:
+                    continue
+                yield item_id, item_latitude, item_longitude
+
+    def nearby(self, latitude, longitude, radius=COLLECT_RADIUS_METERS):
+        latitude, longitude = float(latitude), float(longitude)
+        candidates = list(self.candidates(latitude, longitude, radius))
+        if not candidates:
+            return []
+        item_ids, latitudes, longitudes = zip(*candidates)
+        meters = distances_from(latitude, longitude, latitudes, longitudes)
+        return [item_id for item_id, item_meters in zip(item_ids, meters) if item_meters <= radius]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _is_fresh(index):
+    ttl = getattr(settings, 'COLLECTIBLE_INDEX_TTL', 300)
+    return index is not None and time.monotonic() - index.built_at < ttl
+
+
+def get_collectible_index():
+    global _index
+    index = _index
+    if _is_fresh(index):
+        return index
+    with _index_lock:
+        if not _is_fresh(_index):
+            _index = CollectibleItemIndex(CollectibleItem.objects.values_list('id', 'latitude', 'longitude'))
+        return _index
+
+
+def invalidate_collectible_index():
+    # Вызывается при изменении предметов (админка, загрузка файла), индекс
+    # перестроится при следующей проверке позиции
+    global _index
+    _index = None
+
+
+def collect_nearby_items(athlete, coordinates):
+    # coordinates - список пар (latitude, longitude), предметы добавляются одним запросом
+    index = get_collectible_index()
+    item_ids = set()
+    for latitude, longitude in coordinates:
+        item_ids.update(index.nearby(latitude, longitude))
+    if item_ids:
+        athlete.collectibleitems.add(*item_ids)
+    return item_ids
+
+
+async def acollect_nearby_items(athlete, coordinates):
+    # Асинхронный вариант collect_nearby_items. Индекс перестраивается в потоке
+    # только когда устарел, обычно проверка обходится без обращений к базе
+    index = _index if _is_fresh(_index) else await sync_to_async(get_collectible_index)()
+    item_ids = set()
+    for latitude, longitude in coordinates:
+        item_ids.update(index.nearby(latitude, longitude))
+    if item_ids:
+        await athlete.collectibleitems.aadd(*item_ids)
+    return item_ids
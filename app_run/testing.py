@@ -0,0 +1,100 @@
+import json
+import re
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+# Таблицы, которые растут с количеством пользователей и забегов: по ним запросы
+# эндпоинтов не должны читать всю таблицу или сортировать ее целиком
+LARGE_TABLES = ['app_run_position', 'app_run_run', 'app_run_challenge', 'app_run_subscription']
+
+
+def _sqlite_violations(sql, large_tables):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        details = [row[-1] for row in cursor.fetchall()]
+    # Подзапросы Django ссылаются на таблицы через псевдонимы U0, U1...
+    aliases = {alias: table for table, alias in re.findall(r'"(\w+)" (U\d+)', sql)}
+    violations = []
+    for detail in details:
+        match = re.match(r'SCAN (\w+)', detail)
+        if match and aliases.get(match.group(1), match.group(1)) in large_tables and 'USING' not in detail:
+            violations.append(detail)
+        if 'USE TEMP B-TREE FOR ORDER BY' in detail:
+            violations.append(detail)
+    return violations
+
+
+def _postgresql_violations(sql, large_tables):
+    with connection.cursor() as cursor:
+        # На пустой тестовой базе планировщик выбирает Seq Scan по стоимости, поэтому
+        # запрещаем его: если индекса нет, Seq Scan все равно останется в плане. SET LOCAL
+        # действует до конца транзакции теста, поэтому после EXPLAIN настройка сбрасывается
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+        plan = cursor.fetchone()[0]
+        cursor.execute('RESET enable_seqscan')
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+
+    violations = []
+
+    def walk(node):
+        relations = set()
+        for child in node.get('Plans', []):
+            relations |= walk(child)
+        relation = node.get('Relation Name')
+        if relation:
+            relations.add(relation)
+        if node['Node Type'] == 'Seq Scan' and relation in large_tables:
+            violations.append(f'Seq Scan on {relation}')
+        if node['Node Type'] in ('Sort', 'Incremental Sort') and relations & set(large_tables):
+            violations.append(f'Sort over {", ".join(sorted(relations))}')
+        return relations
+
+    walk(plan[0]['Plan'])
+    return violations
+
+
+def query_plan_violations(sql, large_tables=LARGE_TABLES):
+    # Полные просмотры и сортировки без индекса по большим таблицам в плане запроса
+    if connection.vendor == 'sqlite':
+        return _sqlite_violations(sql, large_tables)
+    if connection.vendor == 'postgresql':
+        return _postgresql_violations(sql, large_tables)
+    return []
+
+
+def endpoint_plan_violations(request, large_tables=LARGE_TABLES):
+    # request - функция без аргументов, выполняющая запрос к эндпоинту тестовым клиентом.
+    # Возвращает {sql: [нарушения]} для SELECT-запросов, затронувших большие таблицы
+    with CaptureQueriesContext(connection) as context:
+        request()
+    violations = {}
+    for query in context.captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith('SELECT') or not any(table in sql for table in large_tables):
+            continue
+        problems = query_plan_violations(sql.replace(' FOR UPDATE', ''), large_tables)
+        if problems:
+            violations[sql] = problems
+    return violations
+
+
+class QueryBudgetMixin:
+    # Бюджеты SQL-запросов по эндпоинтам для TestCase. query_budgets - список
+    # (метод, адрес, максимум запросов[, данные]). В адресе и строковых значениях данных
+    # можно ссылаться на атрибуты теста: '/api/users/{self.athlete.id}/'.
+    query_budgets = []
+
+    def test_query_budgets(self):
+        for method, url, budget, *data in self.query_budgets:
+            url = url.format(self=self)
+            data = {key: value.format(self=self) if isinstance(value, str) else value
+                    for key, value in (data[0] if data else {}).items()}
+            with self.subTest(method=method, url=url):
+                with CaptureQueriesContext(connection) as context:
+                    response = getattr(self.client, method.lower())(url, data=data)
+                self.assertLess(response.status_code, 400, response.content)
+                self.assertLessEqual(len(context.captured_queries), budget,
+                                     '\n'.join(query['sql'] for query in context.captured_queries))
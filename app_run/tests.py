@@ -1,3 +1,1592 @@
-from django.test import TestCase
+import asyncio
+import copy
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from geopy.distance import geodesic
+from openpyxl import Workbook, load_workbook
+
+from . import challenges, geodesy, ingest, leaderboards, simplify, spatial
+from .analytics import rebuild_coach_analytics
+from .caching import abump_version, aget_version
+from .models import AthleteStats, Challenge, CollectibleItem, ImportJob, LeaderboardEntry, Position, Run, RunTrack, \
+    Subscription
+from .importers import import_collectible_items
+from .live import feed
+from .metrics import registry
+from .serializers import CollectibleItemSerializer
+from .services import finish_run
+from .testing import QueryBudgetMixin, endpoint_plan_violations
+
+
+class GeodesyTestCase(SimpleTestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        # Короткие отрезки, как между соседними точками трека, и длинные, как между городами
+        self.pairs = []
+        for _ in range(200):
+            lat, lon = rnd.uniform(-80, 80), rnd.uniform(-180, 180)
+            self.pairs.append((lat, lon, lat + rnd.uniform(-0.001, 0.001), lon + rnd.uniform(-0.001, 0.001)))
+        for _ in range(200):
+            self.pairs.append((rnd.uniform(-80, 80), rnd.uniform(-180, 180),
+                               rnd.uniform(-80, 80), rnd.uniform(-180, 180)))
+        self.expected = [geodesic((lat1, lon1), (lat2, lon2)).meters for lat1, lon1, lat2, lon2 in self.pairs]
+
+    def _distances(self, mode):
+        lat1, lon1, lat2, lon2 = zip(*self.pairs)
+        return geodesy.distance(lat1, lon1, lat2, lon2, mode=mode)
+
+    def test_vincenty_matches_geopy(self):
+        for meters, expected in zip(self._distances(geodesy.VINCENTY), self.expected):
+            self.assertAlmostEqual(meters, expected, delta=max(expected * 1e-6, 0.001))
+
+    def test_haversine_error_is_bounded(self):
+        for meters, expected in zip(self._distances(geodesy.HAVERSINE), self.expected):
+            self.assertAlmostEqual(meters, expected, delta=expected * 0.006)
+
+    def test_track_distances(self):
+        latitudes = [55.75, 55.751, 55.753, 55.753]
+        longitudes = [37.60, 37.601, 37.603, 37.603]
+        segments = geodesy.track_distances(latitudes, longitudes)
+        self.assertEqual(len(segments), 3)
+        for i, meters in enumerate(segments):
+            expected = geodesic((latitudes[i], longitudes[i]), (latitudes[i + 1], longitudes[i + 1])).meters
+            self.assertAlmostEqual(meters, expected, delta=0.001)
+        self.assertEqual(len(geodesy.track_distances([55.75], [37.6])), 0)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            geodesy.distance(0, 0, 1, 1, mode='flat')
+
+
+def point_at(latitude, longitude, meters, bearing):
+    point = geodesic(meters=meters).destination((latitude, longitude), bearing)
+    return point.latitude, point.longitude
+
+
+@override_settings(COLLECTIBLE_INDEX_TTL=3600)
+class CollectibleItemIndexTestCase(TestCase):
+    def setUp(self):
+        spatial.invalidate_collectible_index()
+        self.addCleanup(spatial.invalidate_collectible_index)
+
+    def test_radius_boundary(self):
+        for latitude, longitude in ((55.75, 37.6), (0, 0), (-33.9, 151.2), (78.2, 15.6)):
+            for bearing in (0, 45, 90, 180, 270):
+                with self.subTest(latitude=latitude, longitude=longitude, bearing=bearing):
+                    index = spatial.CollectibleItemIndex([
+                        (1, *point_at(latitude, longitude, 99.5, bearing)),
+                        (2, *point_at(latitude, longitude, 100.5, bearing)),
+                    ])
+                    self.assertEqual(index.nearby(latitude, longitude), [1])
+
+    def test_cell_edges(self):
+        # Позиция и предмет по разные стороны границы ячейки, в том числе через антимеридиан и полюс
+        for latitude, longitude, item_latitude, item_longitude in (
+                (55.7499, 37.6, 55.7501, 37.6),
+                (55.75, 37.5999, 55.75, 37.6001),
+                (55.7499, 37.5999, 55.7501, 37.6001),
+                (-0.0001, -0.0001, 0.0001, 0.0001),
+                (10, 179.9996, 10, -179.9996),
+                (89.9999, 0, 89.9999, 180),
+        ):
+            with self.subTest(latitude=latitude, longitude=longitude):
+                index = spatial.CollectibleItemIndex([(1, item_latitude, item_longitude)])
+                self.assertEqual(index.nearby(latitude, longitude), [1])
+                self.assertEqual(index.nearby(item_latitude, item_longitude), [1])
+
+    def test_matches_full_scan(self):
+        rnd = random.Random(7)
+        # Точки у углов ячеек 0.01 градуса, чтобы круг радиуса задевал соседние ячейки
+        items = [(i, 55.75 + rnd.uniform(-0.005, 0.005), 37.6 + rnd.uniform(-0.005, 0.005)) for i in range(500)]
+        index = spatial.CollectibleItemIndex(items)
+        _, latitudes, longitudes = zip(*items)
+        for _ in range(50):
+            latitude, longitude = 55.75 + rnd.uniform(-0.004, 0.004), 37.6 + rnd.uniform(-0.004, 0.004)
+            meters = geodesy.distances_from(latitude, longitude, latitudes, longitudes)
+            expected = [item_id for (item_id, _, _), item_meters in zip(items, meters) if item_meters <= 100]
+            self.assertEqual(sorted(index.nearby(latitude, longitude)), expected)
+
+    def create_item(self, latitude=55.75, longitude=37.6, uid='a1'):
+        return CollectibleItem.objects.create(name='Флаг', uid=uid, latitude=latitude, longitude=longitude,
+                                              picture='https://example.com/flag.png', value=1)
+
+    def test_rebuilt_after_item_changes(self):
+        item = self.create_item()
+        self.assertEqual(spatial.get_collectible_index().nearby(55.75, 37.6), [item.id])
+        item.latitude, item.longitude = 55.8, 37.7
+        item.save()
+        self.assertEqual(spatial.get_collectible_index().nearby(55.75, 37.6), [])
+        self.assertEqual(spatial.get_collectible_index().nearby(55.8, 37.7), [item.id])
+        item.delete()
+        self.assertEqual(spatial.get_collectible_index().size, 0)
+
+    def test_rebuilt_after_admin_edit(self):
+        item = self.create_item()
+        self.client.force_login(User.objects.create_superuser('admin', password='admin'))
+        index = spatial.get_collectible_index()
+        response = self.client.post(f'/admin/app_run/collectibleitem/{item.id}/change/', {
+            'name': 'Флаг', 'uid': 'a1', 'latitude': '55.8', 'longitude': '37.7',
+            'picture': 'https://example.com/flag.png', 'value': '1',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNot(spatial.get_collectible_index(), index)
+        self.assertEqual(spatial.get_collectible_index().nearby(55.8, 37.7), [item.id])
+        self.client.post(f'/admin/app_run/collectibleitem/{item.id}/delete/', {'post': 'yes'})
+        self.assertEqual(spatial.get_collectible_index().nearby(55.8, 37.7), [])
+
+    def test_rebuilt_after_upload(self):
+        self.assertEqual(spatial.get_collectible_index().size, 0)
+        import_collectible_items(items_workbook([['Флаг', 'a1', 10, 55.75, 37.6, 'https://example.com/flag.png']]))
+        self.assertEqual(spatial.get_collectible_index().nearby(55.75, 37.6),
+                         [CollectibleItem.objects.get(uid='a1').id])
+
+    def test_rebuilt_after_ttl(self):
+        index = spatial.get_collectible_index()
+        # Изменение, о котором индекс не знает: bulk_create без сигналов в другом процессе
+        CollectibleItem.objects.bulk_create([CollectibleItem(name='Флаг', uid='a1', latitude=55.75, longitude=37.6,
+                                                             picture='https://example.com/flag.png')])
+        self.assertIs(spatial.get_collectible_index(), index)
+        with mock.patch('time.monotonic', return_value=index.built_at + 3601):
+            self.assertEqual(spatial.get_collectible_index().size, 1)
+
+
+class RunStatsTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        self.points = [(round(55.75 + i * 0.002, 6), round(37.6 + (i % 3) * 0.001, 6), f'2025-01-01T10:{i:02d}:00')
+                       for i in range(8)]
+
+    def post_point(self, latitude, longitude, date_time):
+        return self.client.post('/api/positions/', {'run': self.run.id, 'latitude': latitude, 'longitude': longitude,
+                                                    'date_time': date_time})
+
+    def assertStatsMatchRecompute(self):
+        self.run.refresh_from_db()
+        recomputed = Run.objects.get(id=self.run.id)
+        recomputed.recompute_stats()
+        self.assertAlmostEqual(self.run.distance, recomputed.distance)
+        self.assertAlmostEqual(self.run.speed_sum, recomputed.speed_sum)
+        for field in ['positions_count', 'first_position_time', 'last_position_time', 'last_latitude',
+                      'last_longitude']:
+            self.assertEqual(getattr(self.run, field), getattr(recomputed, field), field)
+
+    def test_incremental_matches_recompute(self):
+        for point in self.points[:3]:
+            self.assertEqual(self.post_point(*point).status_code, 201)
+        self.client.post('/api/positions/batch/', {'run': self.run.id, 'positions': [
+            {'latitude': latitude, 'longitude': longitude, 'date_time': date_time}
+            for latitude, longitude, date_time in self.points[3:]]}, content_type='application/json')
+        self.assertStatsMatchRecompute()
+        self.assertEqual(self.run.positions_count, 8)
+
+    def test_legacy_run(self):
+        # Позиции, сохраненные до накопительной статистики: итогов у забега нет
+        for latitude, longitude, date_time in self.points[:4]:
+            Position.objects.create(run=self.run, latitude=latitude, longitude=longitude,
+                                    date_time=timezone.make_aware(timezone.datetime.fromisoformat(date_time)))
+        self.post_point(*self.points[4])
+        self.assertStatsMatchRecompute()
+        self.assertEqual(self.run.positions_count, 5)
+        self.assertGreater(self.run.distance, 0.8)
+
+    def test_backfill_migration(self):
+        for latitude, longitude, date_time in self.points:
+            Position.objects.create(run=self.run, latitude=latitude, longitude=longitude,
+                                    date_time=timezone.make_aware(timezone.datetime.fromisoformat(date_time)))
+        import_module('app_run.migrations.0025_backfill_run_stats').backfill_run_stats(django_apps, None)
+        self.assertStatsMatchRecompute()
+        self.assertEqual(self.run.positions_count, 8)
+
+    def test_recompute_command(self):
+        for point in self.points:
+            self.post_point(*point)
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        Run.objects.filter(id=self.run.id).update(distance=100)
+
+        out = StringIO()
+        call_command('recompute_run_stats', self.run.id, stdout=out)
+        self.assertIn('Расхождений: 1', out.getvalue())
+        self.assertEqual(Run.objects.get(id=self.run.id).distance, 100)
+
+        call_command('recompute_run_stats', self.run.id, '--fix', stdout=StringIO())
+        out = StringIO()
+        call_command('recompute_run_stats', self.run.id, stdout=out)
+        self.assertIn('Расхождений: 0', out.getvalue())
+
+    def test_stats_read_only(self):
+        self.post_point(*self.points[0])
+        self.post_point(*self.points[1])
+        self.run.refresh_from_db()
+        distance = self.run.distance
+        response = self.client.patch(f'/api/runs/{self.run.id}/', {'positions_count': 100, 'speed_sum': 5,
+                                                                   'distance': 42, 'run_time_seconds': 60,
+                                                                   'speed': 9, 'comment': 'утро'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.run.refresh_from_db()
+        self.assertEqual((self.run.comment, self.run.positions_count, self.run.distance, self.run.run_time_seconds,
+                          self.run.speed), ('утро', 2, distance, 0, 0))
+        # Следующая точка продолжает настоящую дистанцию
+        self.post_point(*self.points[2])
+        self.assertStatsMatchRecompute()
+
+
+class PositionBatchTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        self.points = [{'latitude': round(55.75 + i * 0.002, 6), 'longitude': round(37.6 + (i % 3) * 0.001, 6),
+                        'date_time': f'2025-01-01T10:{i:02d}:00'} for i in range(8)]
+
+    def post_batch(self, positions, run=None):
+        return self.client.post('/api/positions/batch/', {'run': (run or self.run).id, 'positions': positions},
+                                content_type='application/json')
+
+    def test_order_kept(self):
+        # Точки пишутся в порядке пакета, даже если время в нем идет не по порядку
+        points = [self.points[2], self.points[0], self.points[1]]
+        self.assertEqual(self.post_batch(points).status_code, 201)
+        stored = Position.objects.filter(run=self.run).order_by('id').values_list('latitude', flat=True)
+        self.assertEqual([float(latitude) for latitude in stored], [point['latitude'] for point in points])
+        listed = self.client.get(f'/api/positions/?run={self.run.id}').json()
+        self.assertEqual([float(position['latitude']) for position in listed], [point['latitude'] for point in points])
+
+    def test_distance_continues_across_batches(self):
+        for start, end in ((0, 3), (3, 4), (4, 8)):
+            response = self.post_batch(self.points[start:end])
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['created'], end - start)
+        one_batch = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        self.post_batch(self.points, run=one_batch)
+
+        def distances(run):
+            return list(Position.objects.filter(run=run).order_by('id').values_list('distance', flat=True))
+
+        self.assertEqual(distances(self.run), distances(one_batch))
+        self.run.refresh_from_db()
+        expected = sum(geodesic((a['latitude'], a['longitude']), (b['latitude'], b['longitude'])).km
+                       for a, b in zip(self.points, self.points[1:]))
+        self.assertAlmostEqual(self.run.distance, expected, places=5)
+        self.assertAlmostEqual(distances(self.run)[-1], expected, places=2)
+        self.assertEqual(self.run.positions_count, 8)
+
+    def test_batch_size_limit(self):
+        points = [{**self.points[0], 'date_time': f'2025-01-01T10:00:{i % 60:02d}'} for i in range(5001)]
+        response = self.post_batch(points)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('positions', response.json())
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(self.post_batch(points[:5000]).status_code, 201)
+        self.assertEqual(Position.objects.count(), 5000)
+
+    def test_empty_batch(self):
+        for data in ({'run': self.run.id, 'positions': []}, {'run': self.run.id}):
+            with self.subTest(data=data):
+                response = self.client.post('/api/positions/batch/', data, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('positions', response.json())
+
+    def test_stopped_run(self):
+        self.run.status = 'finished'
+        self.run.save()
+        response = self.post_batch(self.points)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('run', response.json())
+        self.assertFalse(Position.objects.exists())
+
+    def test_run_stopped_before_lock(self):
+        # Забег завершили между проверкой сериализатора и блокировкой строки
+        Run.objects.filter(id=self.run.id).update(status='finished')
+        with mock.patch('app_run.serializers.PositionBatchSerializer.validate_run', lambda serializer, run: run):
+            response = self.post_batch(self.points)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('run', response.json())
+        with mock.patch('app_run.serializers.PositionSerializer.validate', lambda serializer, data: data):
+            response = self.client.post('/api/positions/', {'run': self.run.id, **self.points[0]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+        self.assertFalse(Position.objects.exists())
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.positions_count, 0)
+
+
+class UserDetailQueriesTestCase(TestCase):
+    def setUp(self):
+        # UserViewSet отдает только is_superuser=True
+        self.coach = User.objects.create(username='coach', is_staff=True, is_superuser=True)
+        self.athlete = User.objects.create(username='athlete', is_superuser=True)
+        other_coach = User.objects.create(username='other', is_staff=True, is_superuser=True)
+        Subscription.objects.create(coach=self.coach, athlete=self.athlete, rating=5)
+        Subscription.objects.create(coach=other_coach, athlete=self.athlete, rating=3)
+        for i in range(3):
+            Run.objects.create(athlete=self.athlete, comment='', status='finished')
+            item = CollectibleItem.objects.create(name=f'item {i}', uid=str(i), latitude=0, longitude=0,
+                                                  picture='https://example.com/item.png', value=i)
+            item.users.add(self.athlete, self.coach)
+
+    def test_athlete_detail(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/users/{self.athlete.id}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['type'], 'athlete')
+        self.assertEqual(data['coach'], self.coach.id)
+        self.assertEqual(data['runs_finished'], 3)
+        self.assertEqual(len(data['items']), 3)
+
+    def test_coach_detail(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/users/{self.coach.id}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['type'], 'coach')
+        self.assertEqual(data['athletes'], [self.athlete.id])
+        self.assertEqual(data['rating'], 5)
+        self.assertEqual(len(data['items']), 3)
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        Challenge.objects.create(full_name='Сделай 10 Забегов!', athlete=self.athlete)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/challenges/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/api/challenges/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/challenges/')
+        self.assertEqual(cached.json(), response.json())
+
+    def test_change_invalidates(self):
+        response = self.client.get('/api/challenges/')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Challenge.objects.create(full_name='Пробеги 50 километров!', athlete=self.athlete)
+        # До коммита версия прежняя: иначе параллельный запрос закеширует старые данные под новой
+        self.assertEqual(self.client.get('/api/challenges/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        for callback in callbacks:
+            callback()
+        changed = self.client.get('/api/challenges/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(len(changed.json()), 2)
+
+    def test_bump_from_other_process(self):
+        # Другой процесс с общим кешем: отдельное подключение к тому же хранилищу
+        response = self.client.get('/api/challenges/')
+        caches.create_connection('default').incr('app_run:version:app_run.challenge')
+        changed = self.client.get('/api/challenges/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+    @override_settings(VERSION_CACHE_TIMEOUT=30)
+    def test_local_versions_expire(self):
+        # С кешем в памяти процесса изменения других процессов не видны, версия истекает сама
+        response = self.client.get('/api/challenges/')
+        Challenge.objects.create(full_name='Пробеги 50 километров!', athlete=self.athlete)
+        self.assertEqual(self.client.get('/api/challenges/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with mock.patch('time.time', return_value=time.time() + 31):
+            changed = self.client.get('/api/challenges/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()), 2)
+
+
+class ChallengesTestCase(TestCase):
+    def setUp(self):
+        # Версии в кеше переживают откат базы после других тестов
+        caches['default'].clear()
+        self.athletes = [User.objects.create(username=f'athlete{i}', first_name=f'Имя{i}', last_name='Фамилия')
+                         for i in range(3)]
+
+    def finish(self, athlete, kilometers=1.0, minutes=20):
+        run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+        for lat, date_time in [(55.75, '2025-01-01T10:00:00'),
+                               (55.75 + kilometers / 111.2, f'2025-01-01T10:{minutes:02d}:00')]:
+            self.client.post('/api/positions/', {'run': run.id, 'latitude': round(lat, 6), 'longitude': 37.6,
+                                                 'date_time': date_time})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/runs/{run.id}/stop/')
+        return run
+
+    def old_summary(self):
+        # Ответ challenge_summary_view до сводки одним запросом: запрос атлетов на каждый челлендж
+        summary = []
+        for full_name in Challenge.objects.values_list('full_name', flat=True).distinct():
+            athletes = [{'id': athlete.id, 'full_name': f'{athlete.first_name} {athlete.last_name}',
+                         'username': athlete.username}
+                        for athlete in User.objects.filter(challenge__full_name=full_name).distinct()]
+            summary.append({'name_to_display': full_name, 'athletes': athletes})
+        return summary
+
+    def assertSummaryMatchesOld(self):
+        def normalized(summary):
+            return sorted((row['name_to_display'], sorted(row['athletes'], key=lambda athlete: athlete['id']))
+                          for row in summary)
+        summary = self.client.get('/api/challenges_summary/').json()
+        self.assertEqual(normalized(summary), normalized(self.old_summary()))
+        return summary
+
+    def test_summary_after_new_awards(self):
+        self.assertEqual(self.assertSummaryMatchesOld(), [])
+        self.finish(self.athletes[0], kilometers=2.5, minutes=9)
+        summary = self.assertSummaryMatchesOld()
+        self.assertEqual([row['name_to_display'] for row in summary], ['2 километра за 10 минут!'])
+        self.finish(self.athletes[1], kilometers=2.5, minutes=9)
+        self.finish(self.athletes[1], kilometers=51, minutes=59)
+        # Повторная награда не дублирует атлета в сводке
+        self.finish(self.athletes[0], kilometers=2.5, minutes=9)
+        summary = self.assertSummaryMatchesOld()
+        self.assertEqual({row['name_to_display']: [athlete['id'] for athlete in row['athletes']] for row in summary},
+                         {'2 километра за 10 минут!': [self.athletes[0].id, self.athletes[1].id],
+                          'Пробеги 50 километров!': [self.athletes[1].id]})
+
+
+class ChallengeRulesTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+
+    def finish(self, kilometers, seconds, positions_count=2):
+        # Итоги забега как после накопления позиций, без самих позиций
+        start = timezone.make_aware(timezone.datetime(2025, 1, 1, 10))
+        run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress', distance=kilometers,
+                                 positions_count=positions_count, speed_sum=positions_count * 3.0,
+                                 first_position_time=start,
+                                 last_position_time=start + timezone.timedelta(seconds=seconds))
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            stats = finish_run(run)
+        return run, stats
+
+    def earned(self):
+        return sorted(Challenge.objects.filter(athlete=self.athlete).values_list('full_name', flat=True))
+
+    def test_rules(self):
+        checks = {full_name: check for full_name, check in challenges.CHALLENGE_RULES}
+        cases = [
+            ('Сделай 10 Забегов!', AthleteStats(finished_runs=9), Run(), False),
+            ('Сделай 10 Забегов!', AthleteStats(finished_runs=10), Run(), True),
+            ('Пробеги 50 километров!', AthleteStats(total_distance=49.99), Run(), False),
+            ('Пробеги 50 километров!', AthleteStats(total_distance=50), Run(), True),
+            ('2 километра за 10 минут!', AthleteStats(), Run(distance=2, run_time_seconds=600), True),
+            ('2 километра за 10 минут!', AthleteStats(), Run(distance=2, run_time_seconds=601), False),
+            ('2 километра за 10 минут!', AthleteStats(), Run(distance=1.99, run_time_seconds=300), False),
+        ]
+        self.assertEqual(set(checks), {case[0] for case in cases})
+        for full_name, stats, run, expected in cases:
+            with self.subTest(full_name=full_name, expected=expected):
+                self.assertIs(checks[full_name](stats, run), expected)
+
+    def test_awards_from_stats(self):
+        for i in range(9):
+            run, stats = self.finish(kilometers=5, seconds=1800)
+        self.assertEqual((stats.finished_runs, stats.total_distance), (9, 45))
+        self.assertEqual(self.earned(), [])
+        run, stats = self.finish(kilometers=5, seconds=1800)
+        self.assertEqual(self.earned(), ['Пробеги 50 километров!', 'Сделай 10 Забегов!'])
+        stats.refresh_from_db()
+        self.assertEqual((stats.finished_runs, stats.total_distance, stats.total_run_time_seconds),
+                         (10, 50, 18000))
+        self.assertEqual((stats.longest_distance, stats.best_speed, stats.speed_sum), (5, 3, 30))
+
+    def test_awards_idempotent(self):
+        run, stats = self.finish(kilometers=2.5, seconds=540)
+        self.assertEqual(self.earned(), ['2 километра за 10 минут!'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(challenges.award_challenges(stats, run), [])
+        # Без новых наград версия челленджей не меняется
+        self.assertEqual(callbacks, [])
+        self.finish(kilometers=2.5, seconds=540)
+        self.assertEqual(self.earned(), ['2 километра за 10 минут!'])
+
+    def test_late_positions_refinish(self):
+        # Повторное завершение с поздними точками исправляет счетчики на разницу, не добавляя забег
+        run, stats = self.finish(kilometers=1.5, seconds=540)
+        previous = copy.copy(run)
+        run.distance, run.positions_count, run.speed_sum = 2.2, 3, 9.0
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            stats = finish_run(run, previous)
+        stats.refresh_from_db()
+        self.assertEqual((stats.finished_runs, stats.total_distance, stats.longest_distance), (1, 2.2, 2.2))
+        self.assertEqual(self.earned(), ['2 километра за 10 минут!'])
+
+
+class CoachAnalyticsTestCase(TestCase):
+    def setUp(self):
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(3)]
+        for athlete in self.athletes:
+            Subscription.objects.create(coach=self.coach, athlete=athlete)
+
+    def finish(self, athlete, kilometers, speed):
+        start = timezone.make_aware(timezone.datetime(2025, 1, 1, 10))
+        run = Run.objects.create(athlete=athlete, comment='', status='in_progress', distance=kilometers,
+                                 positions_count=2, speed_sum=2 * speed, first_position_time=start,
+                                 last_position_time=start + timezone.timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            finish_run(run)
+
+    def analytics(self, coach=None):
+        response = self.client.get(f'/api/analytics_for_coach/{(coach or self.coach).id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assertLeaders(self, longest, total, speed):
+        expected = {'longest_run_value': longest[1], 'longest_run_user': longest[0].id,
+                    'total_run_value': total[1], 'total_run_user': total[0].id,
+                    'speed_avg_value': speed[1], 'speed_avg_user': speed[0].id}
+        self.assertEqual(self.analytics(), expected)
+        # Снимок после обновлений при финише совпадает с полным пересчетом
+        rebuilt = rebuild_coach_analytics(self.coach.id)
+        self.assertEqual({field: getattr(rebuilt, field) for field in expected}, expected)
+
+    def test_empty_roster(self):
+        empty = {'longest_run_value': None, 'longest_run_user': None, 'total_run_value': None,
+                 'total_run_user': None, 'speed_avg_value': None, 'speed_avg_user': None}
+        lonely = User.objects.create(username='lonely', is_staff=True)
+        self.assertEqual(self.analytics(lonely), empty)
+        # Бегуны есть, но ни одного завершенного забега
+        self.assertEqual(self.analytics(), empty)
+        self.assertEqual(self.client.get('/api/analytics_for_coach/999/').status_code, 404)
+
+    def test_three_winners(self):
+        longest, total, fastest = self.athletes
+        self.finish(longest, kilometers=20, speed=2)
+        for _ in range(3):
+            self.finish(total, kilometers=10, speed=3)
+        self.finish(fastest, kilometers=5, speed=5)
+        self.assertLeaders(longest=(longest, 20), total=(total, 30), speed=(fastest, 5))
+        # Средняя скорость лидера упала: снимок пересчитывается
+        self.finish(fastest, kilometers=5, speed=0.5)
+        self.assertLeaders(longest=(longest, 20), total=(total, 30), speed=(total, 3))
+        self.finish(fastest, kilometers=21, speed=3)
+        self.assertLeaders(longest=(fastest, 21), total=(fastest, 31), speed=(total, 3))
+
+    def test_roster_change(self):
+        self.finish(self.athletes[0], kilometers=20, speed=2)
+        self.assertEqual(self.analytics()['longest_run_user'], self.athletes[0].id)
+        Subscription.objects.filter(coach=self.coach, athlete=self.athletes[0]).delete()
+        self.assertIsNone(self.analytics()['longest_run_user'])
+
+
+class QueryPlanTestCase(TestCase):
+    # Основные запросы эндпоинтов должны идти по индексам больших таблиц
+    def setUp(self):
+        self.coach = User.objects.create(username='coach', is_staff=True, is_superuser=True)
+        self.athlete = User.objects.create(username='athlete', is_superuser=True)
+        Subscription.objects.create(coach=self.coach, athlete=self.athlete)
+        Challenge.objects.create(full_name='Сделай 10 Забегов!', athlete=self.athlete)
+        self.run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        self.client.post('/api/positions/batch/', {'run': self.run.id, 'positions': [
+            {'latitude': 55.75, 'longitude': 37.6, 'date_time': '2025-01-01T10:00:00'},
+            {'latitude': 55.751, 'longitude': 37.601, 'date_time': '2025-01-01T10:00:30'},
+        ]}, content_type='application/json')
+
+    def assertIndexedEndpoint(self, method, url, **kwargs):
+        violations = endpoint_plan_violations(lambda: getattr(self.client, method)(url, **kwargs))
+        self.assertEqual(violations, {}, f'{method.upper()} {url}')
+
+    def test_positions(self):
+        self.assertIndexedEndpoint('get', f'/api/positions/?run={self.run.id}&size=50')
+        self.assertIndexedEndpoint('get', f'/api/positions/?run={self.run.id}')
+        self.assertIndexedEndpoint('post', '/api/positions/', data={
+            'run': self.run.id, 'latitude': 55.752, 'longitude': 37.602, 'date_time': '2025-01-01T10:01:00'})
+
+    def test_runs(self):
+        self.assertIndexedEndpoint('get', '/api/runs/?size=20&cursor=')
+        self.assertIndexedEndpoint('get', '/api/runs/?size=20&cursor=&ordering=-created_at')
+        self.assertIndexedEndpoint('get', f'/api/runs/?athlete={self.athlete.id}&status=in_progress')
+        self.assertIndexedEndpoint('post', f'/api/runs/{self.run.id}/stop/')
+
+    def test_users_and_coaches(self):
+        self.assertIndexedEndpoint('get', f'/api/users/{self.athlete.id}/')
+        self.assertIndexedEndpoint('get', f'/api/users/{self.coach.id}/')
+        self.assertIndexedEndpoint('get', f'/api/roster_for_coach/{self.coach.id}/?size=50')
+        self.assertIndexedEndpoint('get', f'/api/challenges/?athlete={self.athlete.id}')
+        self.assertIndexedEndpoint('get', f'/api/analytics_for_coach/{self.coach.id}/')
+
+
+class PaginationTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.runs = [Run.objects.create(athlete=self.athlete, comment=str(i)) for i in range(5)]
+        # Три забега с одинаковым временем: порядок внутри - по id
+        Run.objects.filter(id__in=[run.id for run in self.runs[1:4]]).update(created_at=self.runs[1].created_at)
+        self.run = self.runs[0]
+
+    def walk(self, url):
+        # Все страницы вперед по next, затем назад по previous
+        pages = [self.client.get(url).json()]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+        backward = [pages[-1]]
+        while backward[-1]['previous']:
+            backward.append(self.client.get(backward[-1]['previous']).json())
+        ids = [[row['id'] for row in page['results']] for page in pages]
+        self.assertEqual([[row['id'] for row in page['results']] for page in reversed(backward)], ids)
+        return ids
+
+    def test_runs_page_number_by_default(self):
+        data = self.client.get('/api/runs/?size=2&page=2').json()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(len(data['results']), 2)
+        self.assertIn('page=3', data['next'])
+        self.assertEqual(len(self.client.get('/api/runs/').json()), 5)
+
+    def test_runs_keyset_round_trip(self):
+        expected = [run.id for run in Run.objects.order_by('created_at', 'id')]
+        pages = self.walk('/api/runs/?size=2&cursor=')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+        pages = self.walk('/api/runs/?size=2&cursor=&ordering=-created_at')
+        self.assertEqual(sum(pages, []), expected[::-1])
+
+    def test_page_size_limits(self):
+        self.assertNotIn('count', self.client.get('/api/runs/?size=2&cursor=').json())
+        with mock.patch('app_run.pagination.KeysetPagination.max_page_size', 3):
+            self.assertEqual(len(self.client.get('/api/runs/?size=100&cursor=').json()['results']), 3)
+        # Без size или с неверным size пагинации нет
+        for size in ['0', '-1', 'много']:
+            self.assertEqual(len(self.client.get(f'/api/positions/?run={self.run.id}&size={size}').json()), 0)
+
+    def test_invalid_cursor(self):
+        for cursor in ['xyz', 'W10=', 'WyJ4IiwgMSwgMF0=']:
+            response = self.client.get(f'/api/runs/?size=2&cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_positions_with_null_time(self):
+        self.run.status = 'in_progress'
+        self.run.save()
+        for i, second in enumerate([5, None, 5, 1, None, 3]):
+            Position.objects.create(run=self.run, latitude=55.75 + i * 0.001, longitude=37.6,
+                                    date_time=f'2025-01-01T10:00:0{second}Z' if second is not None else None)
+        positions = list(Position.objects.filter(run=self.run))
+        expected = [position.id for position in sorted(
+            positions, key=lambda position: (position.date_time is not None, position.date_time, position.id))]
+        pages = self.walk(f'/api/positions/?run={self.run.id}&size=2')
+        self.assertEqual(sum(pages, []), expected)
+        pages = self.walk(f'/api/positions/?run={self.run.id}&size=4&ordering=-date_time')
+        self.assertEqual(sum(pages, []), expected[::-1])
+
+
+class RunTrackTestCase(TestCase):
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+        for i in range(20):
+            self.client.post('/api/positions/', {'run': self.run.id, 'latitude': f'55.75{i:04d}',
+                                                 'longitude': f'37.60{i:04d}', 'date_time': f'2025-01-01T10:00:{i:02d}'})
+        self.expected = self.client.get(f'/api/positions/?run={self.run.id}').json()
+
+    def stop(self):
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        # При финише трек не упаковывается, это работа команды по расписанию
+        self.assertFalse(RunTrack.objects.filter(run=self.run).exists())
+        call_command('pack_run_tracks', stdout=StringIO())
+
+    def test_pack_roundtrip(self):
+        self.stop()
+        track = RunTrack.objects.get(run=self.run)
+        self.assertEqual(track.points_count, 20)
+        self.assertEqual(self.client.get(f'/api/positions/?run={self.run.id}').json(), self.expected)
+
+    @override_settings(PRUNE_PACKED_POSITIONS=True)
+    def test_pruned_positions_read_from_track(self):
+        self.stop()
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        self.assertEqual(self.client.get(f'/api/positions/?run={self.run.id}').json(), self.expected)
+
+        page = self.client.get(f'/api/positions/?run={self.run.id}&size=15').json()
+        self.assertEqual(page['results'], self.expected[:15])
+        self.assertEqual(self.client.get(page['next']).json()['results'], self.expected[15:])
+
+        self.run.refresh_from_db()
+        self.run.recompute_stats()
+        self.run.finish()
+        self.assertEqual(self.run.positions_count, 20)
+        self.assertAlmostEqual(self.run.speed, Run.objects.get(id=self.run.id).speed)
+
+    def test_pack_command_selects_legacy_runs(self):
+        self.stop()
+        # Забег до накопительной статистики: positions_count 0, но позиции есть
+        legacy = Run.objects.create(athlete=self.run.athlete, comment='', status='finished')
+        for i in range(3):
+            Position.objects.create(run=legacy, latitude=55.75 + i * 0.001, longitude=37.6)
+        Run.objects.create(athlete=self.run.athlete, comment='', status='finished')
+        out = StringIO()
+        call_command('pack_run_tracks', stdout=out)
+        self.assertIn('Упаковано забегов: 1, позиций: 3', out.getvalue())
+        self.assertEqual(RunTrack.objects.get(run=legacy).points_count, 3)
+
+
+class TrackSimplifyTestCase(TestCase):
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+        # Прямая на север с одним отскоком в сторону на ~110 м
+        for i in range(50):
+            self.client.post('/api/positions/', {'run': self.run.id, 'latitude': 55.75 + i * 0.0001,
+                                                 'longitude': 37.601 if i == 25 else 37.6,
+                                                 'date_time': f'2025-01-01T10:{i // 60:02d}:{i % 60:02d}'})
+
+    def test_douglas_peucker(self):
+        latitudes = [55.75 + i * 0.0001 for i in range(50)]
+        self.assertEqual(simplify.douglas_peucker(latitudes, [37.6] * 50, 1).tolist(), [0, 49])
+        # Петля: первая и последняя точки совпадают
+        self.assertEqual(simplify.douglas_peucker([0, 0.001, 0.001, 0], [0, 0, 0.001, 0], 1).tolist(), [0, 1, 2, 3])
+
+    def test_track_endpoint(self):
+        track = self.client.get(f'/api/runs/{self.run.id}/track/?tolerance=10').json()
+        self.assertEqual(track['points_count'], 50)
+        self.assertEqual(track['points'], [[55.75, 37.6], [55.7524, 37.6], [55.7525, 37.601], [55.7526, 37.6],
+                                           [55.7549, 37.6]])
+        # На мелком масштабе отскок меньше пикселя
+        self.assertEqual(len(self.client.get(f'/api/runs/{self.run.id}/track/?zoom=5').json()['points']), 2)
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/track/?zoom=30').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/track/').status_code, 400)
+
+    def test_finished_track_cached(self):
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        url = f'/api/runs/{self.run.id}/track/?zoom=16'
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            cached = self.client.get(url)
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.runs = []
+        for run_index in range(2):
+            run = Run.objects.create(athlete=self.athlete, comment=f'<забег {run_index}>', status='in_progress')
+            for i in range(5):
+                self.client.post('/api/positions/', {'run': run.id, 'latitude': 55.75 + i * 0.001,
+                                                     'longitude': 37.6 + run_index, 'date_time': f'2025-01-01T10:00:0{i}'})
+            self.runs.append(run)
+
+    def content(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_run_gpx(self):
+        gpx = ET.fromstring(self.content(f'/api/runs/{self.runs[0].id}/export/gpx/'))
+        namespace = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+        points = gpx.findall('gpx:trk/gpx:trkseg/gpx:trkpt', namespace)
+        self.assertEqual(len(points), 5)
+        self.assertEqual((points[1].get('lat'), points[1].get('lon')), ('55.751000', '37.600000'))
+        self.assertEqual(points[1].find('gpx:time', namespace).text, '2025-01-01T10:00:01.000000Z')
+        self.assertEqual(gpx.find('gpx:trk/gpx:desc', namespace).text, '<забег 0>')
+
+    @override_settings(PRUNE_PACKED_POSITIONS=True)
+    def test_athlete_geojson(self):
+        self.client.post(f'/api/runs/{self.runs[0].id}/stop/')
+        call_command('pack_run_tracks', stdout=StringIO())
+        collection = json.loads(self.content(f'/api/users/{self.athlete.id}/export/geojson/'))
+        self.assertEqual([feature['properties']['run'] for feature in collection['features']],
+                         [run.id for run in self.runs])
+        packed = collection['features'][0]
+        self.assertEqual(packed['geometry']['coordinates'][4], [37.6, 55.754])
+        self.assertEqual(len(packed['properties']['coordTimes']), 5)
+        self.assertEqual(packed['properties']['status'], 'finished')
+
+    def test_athlete_export_includes_legacy_runs(self):
+        # Забег до накопительной статистики: positions_count 0, позиции только в таблице
+        legacy = Run.objects.create(athlete=self.athlete, comment='', status='finished')
+        Position.objects.create(run=legacy, latitude=55.75, longitude=37.6)
+        Run.objects.create(athlete=self.athlete, comment='без позиций', status='init')
+        collection = json.loads(self.content(f'/api/users/{self.athlete.id}/export/geojson/'))
+        self.assertEqual([feature['properties']['run'] for feature in collection['features']],
+                         [run.id for run in self.runs] + [legacy.id])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(f'/api/runs/{self.runs[0].id}/export/kml/').status_code, 404)
+
+
+def items_workbook(rows, name='items.xlsx'):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Name', 'UID', 'Value', 'Latitude', 'Longitude', 'Picture'])
+    for row in rows:
+        sheet.append(row)
+    content = io.BytesIO()
+    workbook.save(content)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+class UploadJobTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, rows):
+        with mock.patch('app_run.jobs.get_executor') as executor, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/upload_file/', {'file': items_workbook(rows)})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        job_id = response.json()['id']
+        # Загрузка выполняется здесь же, а не в потоке пула. Соединение потока пула закрывается
+        # после загрузки, в тесте оно общее
+        run_import_job, submitted_id = executor.return_value.submit.call_args.args
+        with mock.patch('app_run.jobs.connection'):
+            run_import_job(submitted_id)
+        return job_id
+
+    def rejected(self, job_id):
+        response = self.client.get(f'/api/upload_file/{job_id}/rejected/')
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content) if response.streaming
+                                         else response.content)).active
+        return [list(row) for row in sheet.iter_rows(values_only=True)]
+
+    def test_submit_status_rejected(self):
+        job_id = self.upload([
+            ['Флаг', 'a1', 10, 55.75, 37.6, 'https://example.com/flag.png'],
+            ['Юг', 'a2', 5, -91, 37.6, 'https://example.com/south.png'],
+            ['Кубок', 'a3', 'много', 55.7, 37.5, 'https://example.com/cup.png'],
+        ])
+        data = self.client.get(f'/api/upload_file/{job_id}/').json()
+        self.assertEqual((data['status'], data['rows_processed'], data['rows_rejected']), ('finished', 3, 2))
+        self.assertEqual(CollectibleItem.objects.get().uid, 'a1')
+        self.assertEqual(self.rejected(job_id), [
+            ['name', 'uid', 'value', 'latitude', 'longitude', 'picture'],
+            ['Юг', 'a2', 5, -91, 37.6, 'https://example.com/south.png'],
+            ['Кубок', 'a3', 'много', 55.7, 37.5, 'https://example.com/cup.png'],
+        ])
+
+    def test_nothing_rejected(self):
+        job_id = self.upload([['Флаг', 'a1', 10, 55.75, 37.6, 'https://example.com/flag.png']])
+        self.assertFalse(ImportJob.objects.get(id=job_id).rejected_file)
+        self.assertEqual(self.rejected(job_id), [['name', 'uid', 'value', 'latitude', 'longitude', 'picture']])
+
+    def test_rejected_file_missing(self):
+        job_id = self.upload([['Юг', 'a2', 5, -91, 37.6, 'https://example.com/south.png']])
+        # Файл записан на другом сервере с локальным MEDIA_ROOT
+        os.remove(ImportJob.objects.get(id=job_id).rejected_file.path)
+        response = self.client.get(f'/api/upload_file/{job_id}/rejected/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_job_states(self):
+        pending = ImportJob.objects.create()
+        self.assertEqual(self.client.get(f'/api/upload_file/{pending.id}/rejected/').status_code, 409)
+        failed = ImportJob.objects.create(status='failed', error='Файл не является книгой Excel')
+        response = self.client.get(f'/api/upload_file/{failed.id}/rejected/')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual((response.json()['status'], response.json()['error']),
+                         ('failed', 'Файл не является книгой Excel'))
+        self.assertEqual(self.client.get('/api/upload_file/999/rejected/').status_code, 404)
+
+
+def legacy_rejected_rows(file):
+    # Проверка из upload_view до чтения пачками, без записи в базу
+    sheet = load_workbook(file, data_only=True).active
+    rejected = []
+    for name, uid, value, latitude, longitude, picture in sheet.iter_rows(min_row=2, max_row=sheet.max_row,
+                                                                          values_only=True):
+        data = {'name': name, 'uid': uid, 'latitude': latitude, 'longitude': longitude, 'picture': picture,
+                'value': value}
+        if not CollectibleItemSerializer(data=data).is_valid():
+            rejected.append([name, uid, value, latitude, longitude, picture])
+    return rejected
+
+
+class ImportCollectibleItemsTestCase(TestCase):
+    rows = [
+        ['Флаг', 'a1', 10, 55.75, 37.6, 'https://example.com/flag.png'],
+        ['Юг', 'a2', 5, -91, 37.6, 'https://example.com/south.png'],
+        ['Восток', 'a3', 5, 55.7, 181, 'https://example.com/east.png'],
+        ['Кубок', 'a4', 'много', 55.7, 37.5, 'https://example.com/cup.png'],
+        ['Без картинки', 'a5', 1, 55.7, 37.5, None],
+        ['Ссылка', 'a6', 1, 55.7, 37.5, 'не ссылка'],
+        ['Медаль', 'a7', None, 55.7, 37.5, 'https://example.com/medal.png'],
+        ['Лишние знаки', 'a8', 1, 55.12345, 37.5, 'https://example.com/digits.png'],
+        ['Граница', 'a9', 1, 90, -180, 'https://example.com/edge.png'],
+    ]
+
+    def test_rejected_rows_match_legacy_upload(self):
+        rejected = []
+        rows_rejected = import_collectible_items(items_workbook(self.rows), chunk_size=4, rejected=rejected)
+        expected = legacy_rejected_rows(items_workbook(self.rows))
+        self.assertEqual(rejected, expected)
+        self.assertEqual(rows_rejected, len(expected))
+        self.assertEqual(set(CollectibleItem.objects.values_list('uid', flat=True)),
+                         {row[1] for row in self.rows} - {row[1] for row in expected})
+
+    def test_short_and_long_rows(self):
+        rejected = []
+        rows_rejected = import_collectible_items(items_workbook([
+            ['Флаг', 'a1', 10],
+            ['Кубок', 'a2', 3, 55.7, 37.5, 'https://example.com/cup.png', 'лишняя колонка'],
+        ]), rejected=rejected)
+        self.assertEqual(rows_rejected, 1)
+        # Недостающие колонки дополняются пустыми, лишние отбрасываются
+        self.assertEqual(rejected, [['Флаг', 'a1', 10, None, None, None]])
+        self.assertEqual(list(CollectibleItem.objects.values_list('uid', 'value')), [('a2', 3)])
+
+    def test_chunk_boundaries(self):
+        valid = [[f'Флаг {i}', f'a{i}', i, 55.7, 37.5, 'https://example.com/flag.png'] for i in range(5)]
+        invalid = ['Юг', 'b', 1, -91, 37.5, 'https://example.com/south.png']
+        for rows, chunks in (
+                ([], []),
+                (valid[:2], [(2, 0)]),
+                (valid[:4], [(2, 0), (4, 0)]),
+                ([*valid[:2], invalid, *valid[2:]], [(2, 0), (4, 1), (6, 1)]),
+                ([invalid, invalid], [(2, 2)]),
+        ):
+            with self.subTest(rows=len(rows)):
+                CollectibleItem.objects.all().delete()
+                progress = []
+                rows_rejected = import_collectible_items(items_workbook(rows), chunk_size=2,
+                                                         progress=lambda *counts: progress.append(counts))
+                self.assertEqual(progress, chunks)
+                self.assertEqual(rows_rejected, chunks[-1][1] if chunks else 0)
+                self.assertEqual(CollectibleItem.objects.count(), len(rows) - rows_rejected)
+
+
+class GpxImportTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.points = [(55.75 + i * 0.0003, 37.6 + (i % 3) * 0.0002, f'2025-01-0{1 + i // 40}T10:{i % 40:02d}:00Z')
+                       for i in range(60)]
+
+    def gpx(self, tracks):
+        body = ''.join(
+            f'<trk><name>{name}</name><trkseg>'
+            + ''.join(f'<trkpt lat="{lat}" lon="{lon}"><ele>150</ele><time>{moment}</time></trkpt>'
+                      for lat, lon, moment in points)
+            + '</trkseg></trk>'
+            for name, points in tracks)
+        content = ('<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+                   f'<metadata><name>Экспорт</name><time>2020-01-01T00:00:00Z</time></metadata>{body}</gpx>')
+        return SimpleUploadedFile(f'{len(tracks)}.gpx', content.encode(), content_type='application/gpx+xml')
+
+    def test_import_matches_live_run(self):
+        live = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        for lat, lon, moment in self.points:
+            self.client.post('/api/positions/', {'run': live.id, 'latitude': lat, 'longitude': lon,
+                                                 'date_time': moment.rstrip('Z')})
+        self.client.post(f'/api/runs/{live.id}/stop/')
+        live.refresh_from_db()
+
+        response = self.client.post(f'/api/users/{self.athlete.id}/import/gpx/',
+                                    {'file': [self.gpx([('Утро', self.points), ('Вечер', self.points[:2])]),
+                                              SimpleUploadedFile('broken.gpx', b'<gpx><trk>')]})
+        self.assertEqual(response.status_code, 201)
+        results = {result['file']: result for result in response.json()}
+        self.assertEqual(len(results['2.gpx']['runs']), 2)
+        self.assertTrue(results['broken.gpx']['error'])
+
+        imported = Run.objects.get(id=results['2.gpx']['runs'][0])
+        self.assertEqual((imported.comment, imported.status), ('Утро', 'finished'))
+        self.assertAlmostEqual(imported.distance, live.distance)
+        self.assertEqual((imported.run_time_seconds, imported.speed, imported.positions_count),
+                         (live.run_time_seconds, live.speed, live.positions_count))
+        self.assertEqual(imported.created_at, imported.first_position_time)
+        self.assertEqual(list(Position.objects.filter(run=imported).values_list('speed', 'distance')),
+                         list(Position.objects.filter(run=live).values_list('speed', 'distance')))
+        call_command('pack_run_tracks', stdout=StringIO())
+        self.assertTrue(RunTrack.objects.filter(run=imported).exists())
+        self.assertEqual(AthleteStats.objects.get(user=self.athlete).finished_runs, 3)
+
+
+class BufferedIngestTestCase(TestCase):
+    def setUp(self):
+        # Версии в кеше переживают откат базы после других тестов
+        caches['default'].clear()
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_dir = directory.name
+        # Фоновый поток не запускается, пачки пишутся при завершении забега
+        settings = override_settings(POSITION_INGEST_MODE='buffered', POSITION_INGEST_LOG_DIR=self.log_dir,
+                                     POSITION_INGEST_FLUSH_INTERVAL=None)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(setattr, ingest, '_buffer', None)
+
+    def log_lines(self):
+        lines = []
+        for name in os.listdir(self.log_dir):
+            with open(os.path.join(self.log_dir, name)) as file:
+                lines.extend(file)
+        return lines
+
+    def test_positions_written_on_stop(self):
+        direct = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+        points = [(55.75 + i * 0.001, 37.6, f'2025-01-01T10:00:{i * 10:02d}') for i in range(4)]
+        for lat, lon, moment in points:
+            with override_settings(POSITION_INGEST_MODE='direct'):
+                self.client.post('/api/positions/', {'run': direct.id, 'latitude': lat, 'longitude': lon,
+                                                     'date_time': moment})
+            response = self.client.post('/api/positions/', {'run': self.run.id, 'latitude': lat, 'longitude': lon,
+                                                            'date_time': moment})
+            self.assertEqual(response.status_code, 202)
+            self.assertNotIn('id', response.json())
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        self.assertEqual(len(self.log_lines()), 4)
+
+        self.assertEqual(self.client.post(f'/api/runs/{self.run.id}/stop/').status_code, 200)
+        self.assertEqual(self.log_lines(), [])
+        self.run.refresh_from_db()
+        direct.refresh_from_db()
+        self.assertEqual((self.run.positions_count, self.run.distance), (direct.positions_count, direct.distance))
+        self.assertEqual(list(Position.objects.filter(run=self.run).order_by('id').values_list('speed', 'distance')),
+                         list(Position.objects.filter(run=direct).order_by('id').values_list('speed', 'distance')))
+
+        response = self.client.post('/api/positions/', {'run': self.run.id, 'latitude': 55.8, 'longitude': 37.6})
+        self.assertEqual(response.status_code, 400)
+
+    def late_points(self, pack=False):
+        # Две точки записаны в базу, еще две подтверждены, но остались в буфере этого процесса,
+        # а забег завершает другой процесс, который этот буфер не видит
+        for i in range(4):
+            self.client.post('/api/positions/', {'run': self.run.id, 'latitude': 55.75 + i * 0.001, 'longitude': 37.6,
+                                                 'date_time': f'2025-01-01T10:00:{i * 10:02d}'})
+            if i == 1:
+                ingest.flush_positions()
+        with mock.patch('app_run.services.flush_positions'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/runs/{self.run.id}/stop/').status_code, 200)
+        self.assertEqual(Run.objects.get(id=self.run.id).positions_count, 2)
+        if pack:
+            call_command('pack_run_tracks', stdout=StringIO())
+        track_url = f'/api/runs/{self.run.id}/track/?zoom=16'
+        cached = self.client.get(track_url)
+        self.assertEqual(cached.json()['points_count'], 2)
+
+        with self.assertLogs('app_run.ingest', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            ingest.flush_positions()
+        # Упрощенный трек из кеша не отдается, ни по ETag, ни без него
+        self.assertEqual(self.client.get(track_url, HTTP_IF_NONE_MATCH=cached['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(track_url).json()['points_count'], 4)
+        self.run.refresh_from_db()
+        recomputed = Run.objects.get(id=self.run.id)
+        recomputed.recompute_stats()
+        recomputed.finish()
+        self.assertEqual(self.run.positions_count, 4)
+        self.assertAlmostEqual(self.run.distance, recomputed.distance)
+        self.assertEqual((self.run.status, self.run.run_time_seconds, self.run.speed),
+                         ('finished', recomputed.run_time_seconds, recomputed.speed))
+        # Забег учтен у атлета и в лидерборде один раз, с итогами по всем точкам
+        stats = AthleteStats.objects.get(user=self.athlete)
+        self.assertEqual(stats.finished_runs, 1)
+        self.assertAlmostEqual(stats.total_distance, self.run.distance)
+        self.assertEqual(stats.total_run_time_seconds, 30)
+        entry = LeaderboardEntry.objects.get(user=self.athlete, period='all')
+        self.assertEqual(entry.finished_runs, 1)
+        self.assertAlmostEqual(entry.total_distance, self.run.distance)
+        self.assertEqual(len(self.run.track_positions()), 4)
+
+    def test_late_points_of_finished_run(self):
+        self.late_points()
+
+    @override_settings(PRUNE_PACKED_POSITIONS=True)
+    def test_late_points_of_pruned_run(self):
+        # Упакованный трек с удаленными позициями распаковывается и упаковывается заново
+        self.late_points(pack=True)
+        self.assertFalse(RunTrack.objects.filter(run=self.run).exists())
+        call_command('pack_run_tracks', stdout=StringIO())
+        self.assertEqual(RunTrack.objects.get(run=self.run).points_count, 4)
+
+    def test_replay_dead_process_log(self):
+        Position.objects.create(run=self.run, latitude='55.750000', longitude='37.600000',
+                                date_time='2025-01-01T10:00:00Z')
+        entries = [{'run': self.run.id, 'latitude': '55.750000', 'longitude': '37.600000',
+                    'date_time': '2025-01-01T10:00:00Z'},
+                   {'run': self.run.id, 'latitude': '55.751000', 'longitude': '37.600000',
+                    'date_time': '2025-01-01T10:00:10Z'}]
+        # Последняя строка оборвана при падении процесса
+        with open(os.path.join(self.log_dir, 'positions-1-000000.log'), 'w') as file:
+            file.write(''.join(json.dumps(entry) + '\n' for entry in entries) + '{"run": ')
+
+        with self.assertLogs('app_run.ingest', 'WARNING'):
+            buffer = ingest.get_position_buffer()
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 2)
+        # Живой сегмент этого процесса заблокирован и не трогается
+        buffer.append(self.run.id, '55.752000', '37.600000', None)
+        out = StringIO()
+        call_command('replay_position_log', stdout=out)
+        self.assertIn('Дописано позиций: 0', out.getvalue())
+        self.assertEqual(len(self.log_lines()), 1)
+
+
+class LeaderboardTestCase(TestCase):
+    def setUp(self):
+        leaderboards.reset_leaderboards()
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(3)]
+
+    def finish(self, athlete, kilometers, created_at=None):
+        run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+        if created_at:
+            Run.objects.filter(id=run.id).update(created_at=created_at)
+        for i, lat in enumerate([55.75, 55.75 + kilometers / 111.2]):
+            self.client.post('/api/positions/', {'run': run.id, 'latitude': round(lat, 6), 'longitude': 37.6,
+                                                 'date_time': f'2025-01-01T10:{i * 10:02d}:00'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/runs/{run.id}/stop/')
+
+    def board(self, board, **params):
+        response = self.client.get(f'/api/leaderboards/{board}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranks(self):
+        first, second, third = self.athletes
+        self.finish(first, 5)
+        self.finish(second, 3)
+        self.finish(second, 3)
+        # Забег двухмесячной давности попадает только в лидерборд за все время
+        self.finish(third, 10, created_at=timezone.now() - timezone.timedelta(days=60))
+
+        data = self.board('distance', athlete=first.id)
+        self.assertEqual([(row['rank'], row['athlete']) for row in data['top']],
+                         [(1, third.id), (2, second.id), (3, first.id)])
+        self.assertEqual(data['athlete']['rank'], 3)
+        self.assertEqual([row['athlete'] for row in self.board('longest')['top']], [third.id, first.id, second.id])
+        month = self.board('distance', period='month', athlete=third.id)
+        self.assertEqual([row['athlete'] for row in month['top']], [second.id, first.id])
+        self.assertIsNone(month['athlete'])
+
+        # Финиш в этом процессе меняет лидерборд на месте, без перестроения из базы
+        self.finish(first, 4)
+        with self.assertNumQueries(0):
+            data = self.board('distance', limit=1, athlete=first.id)
+        self.assertEqual(data['athlete']['rank'], 2)
+        self.assertEqual([row['athlete'] for row in data['top']], [third.id])
+
+        before = {(board, period): self.board(board, period=period)['top']
+                  for board in leaderboards.BOARDS for period in leaderboards.PERIODS}
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        for (board, period), top in before.items():
+            rebuilt = self.board(board, period=period)['top']
+            self.assertEqual([row['athlete'] for row in rebuilt], [row['athlete'] for row in top])
+            for row, expected in zip(rebuilt, top):
+                self.assertAlmostEqual(row['value'], expected['value'])
+
+    def test_finish_in_other_process(self):
+        first, second = self.athletes[:2]
+        self.finish(first, 3)
+        self.finish(second, 5)
+        self.assertEqual([row['athlete'] for row in self.board('distance')['top']], [second.id, first.id])
+        # Другой процесс записал итоги и сменил версию в общем кеше, не трогая список этого процесса
+        LeaderboardEntry.objects.filter(user=first).update(total_distance=10)
+        start = leaderboards.period_start('all', timezone.localdate())
+        caches.create_connection('default').incr(f'app_run:version:{leaderboards.version_name("all", start)}')
+        self.assertEqual([row['athlete'] for row in self.board('distance')['top']], [first.id, second.id])
+
+    @override_settings(VERSION_CACHE_TIMEOUT=30)
+    def test_local_versions_expire(self):
+        first, second = self.athletes[:2]
+        self.finish(first, 3)
+        self.finish(second, 5)
+        self.board('distance')
+        # Изменение из другого процесса при кеше в памяти процесса: версия здесь не меняется
+        LeaderboardEntry.objects.filter(user=first).update(total_distance=10)
+        self.assertEqual([row['athlete'] for row in self.board('distance')['top']], [second.id, first.id])
+        with mock.patch('time.time', return_value=time.time() + 31):
+            self.assertEqual([row['athlete'] for row in self.board('distance')['top']], [first.id, second.id])
+
+    def test_bad_params(self):
+        self.assertEqual(self.client.get('/api/leaderboards/steps/').status_code, 404)
+        self.assertEqual(self.client.get('/api/leaderboards/distance/?period=year').status_code, 400)
+        self.assertEqual(self.client.get('/api/leaderboards/distance/?limit=0').status_code, 400)
+
+
+class TrainingVolumeTestCase(TestCase):
+    def setUp(self):
+        self.athletes = [User.objects.create(username=f'athlete{i}') for i in range(2)]
+        self.today = timezone.localdate()
+        self.monday = self.today - timezone.timedelta(days=self.today.weekday())
+
+    def finish(self, athlete, days_ago, kilometers):
+        run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+        Run.objects.filter(id=run.id).update(created_at=timezone.now() - timezone.timedelta(days=days_ago))
+        for i, lat in enumerate([55.75, 55.75 + kilometers / 111.2]):
+            self.client.post('/api/positions/', {'run': run.id, 'latitude': round(lat, 6), 'longitude': 37.6,
+                                                 'date_time': f'2025-01-01T10:{i * 10:02d}:00'})
+        self.client.post(f'/api/runs/{run.id}/stop/')
+
+    def volume(self, **params):
+        response = self.client.get('/api/training_volume/', params)
+        self.assertEqual(response.status_code, 200)
+        return {row['athlete']: row['points'] for row in response.json()['athletes']}
+
+    def test_volume(self):
+        first, second = self.athletes
+        self.finish(first, 0, 5)
+        self.finish(first, 0, 3)
+        self.finish(first, 8, 10)
+        self.finish(second, 40, 4)
+        athletes = f'{first.id},{second.id}'
+
+        with self.assertNumQueries(1):
+            days = self.volume(athletes=athletes)
+        self.assertEqual([(point['start'], point['runs']) for point in days[first.id]],
+                         [(str(self.today - timezone.timedelta(days=8)), 1), (str(self.today), 2)])
+        self.assertEqual(days[first.id][1]['run_time_seconds'], 1200)
+        self.assertAlmostEqual(days[first.id][1]['distance'], 8, delta=0.05)
+        self.assertEqual(days[first.id][1]['pace'], round(1200 / days[first.id][1]['distance']))
+        self.assertEqual(days[second.id], [])
+
+        weeks = self.volume(athletes=athletes, period='week', to=str(self.today),
+                            **{'from': str(self.today - timezone.timedelta(days=60))})
+        self.assertEqual(weeks[first.id][-1]['start'], str(self.monday))
+        self.assertEqual(sum(point['runs'] for point in weeks[first.id]), 3)
+        self.assertEqual(len(weeks[second.id]), 1)
+
+        call_command('rebuild_training_rollups', stdout=StringIO())
+        self.assertEqual(self.volume(athletes=athletes, period='week',
+                                     **{'from': str(self.today - timezone.timedelta(weeks=300))}), weeks)
+
+    def test_bad_params(self):
+        for params in ({}, {'athletes': 'x'}, {'athletes': '1', 'period': 'year'},
+                       {'athletes': '1', 'from': '2025-02-01', 'to': '2025-01-01'},
+                       {'athletes': '1', 'from': '2024-13-01'}, {'athletes': '1', 'from': '2020-01-01'}):
+            self.assertEqual(self.client.get('/api/training_volume/', params).status_code, 400, params)
+
+
+class CoachRosterTestCase(TestCase):
+    def setUp(self):
+        self.coach = User.objects.create(username='coach', is_staff=True, is_superuser=True)
+        self.athletes = [User.objects.create(username=f'athlete{i}', first_name=f'Имя{i}') for i in range(5)]
+        for i, athlete in enumerate(self.athletes):
+            Subscription.objects.create(coach=self.coach, athlete=athlete, rating=i % 5 + 1)
+        for athlete in self.athletes[:3]:
+            self.finish(athlete)
+        self.latest = Run.objects.create(athlete=self.athletes[0], comment='', status='init')
+
+    def finish(self, athlete):
+        run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+        for i, lat in enumerate([55.75, 55.76]):
+            self.client.post('/api/positions/', {'run': run.id, 'latitude': lat, 'longitude': 37.6,
+                                                 'date_time': f'2025-01-01T10:{i * 10:02d}:00'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/runs/{run.id}/stop/')
+        return run
+
+    def roster(self, size=2, page=1):
+        return self.client.get(f'/api/roster_for_coach/{self.coach.id}/?size={size}&page={page}').json()
+
+    def test_roster(self):
+        with self.assertNumQueries(4):
+            data = self.roster(size=100)
+        self.assertEqual(data['count'], 5)
+        first = data['results'][0]
+        self.assertEqual((first['id'], first['first_name'], first['rating']), (self.athletes[0].id, 'Имя0', 1))
+        self.assertEqual(first['runs_finished'], 1)
+        self.assertAlmostEqual(first['total_distance'], 1.11, delta=0.01)
+        self.assertEqual((first['latest_run']['id'], first['latest_run']['status']), (self.latest.id, 'init'))
+        self.assertEqual((data['results'][4]['runs_finished'], data['results'][4]['latest_run']), (0, None))
+
+        second_page = self.roster(page=2)
+        self.assertEqual([athlete['id'] for athlete in second_page['results']],
+                         [athlete.id for athlete in self.athletes[2:4]])
+        self.assertEqual(self.client.get(f'/api/roster_for_coach/{self.athletes[0].id}/').status_code, 404)
+
+    def test_invalidation(self):
+        self.roster()
+        with self.assertNumQueries(0):
+            self.roster()
+        # Новый пользователь и его забег ростер не сбрасывают
+        other = User.objects.create(username='other')
+        self.finish(other)
+        with self.assertNumQueries(0):
+            self.roster()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(f'/api/runs/{self.latest.id}/start/')
+        # До коммита ростер прежний: иначе параллельный запрос закеширует старые данные под новой версией
+        with self.assertNumQueries(0):
+            self.assertEqual(self.roster()['results'][0]['latest_run']['status'], 'init')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.roster()['results'][0]['latest_run']['status'], 'in_progress')
+        self.finish(self.athletes[1])
+        self.assertEqual(self.roster()['results'][1]['runs_finished'], 2)
+        self.athletes[0].first_name = 'Новое'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.athletes[0].save()
+        self.assertEqual(self.roster()['results'][0]['first_name'], 'Новое')
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.filter(athlete=self.athletes[0]).get().delete()
+        self.assertEqual(self.roster()['count'], 4)
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=self.athlete, comment='')
+        self.item = CollectibleItem.objects.create(name='Флаг', uid='1', latitude=55.7501, longitude=37.6001,
+                                                   picture='https://example.com/flag.png', value=1)
+
+    async def post(self, url, data):
+        return await AsyncClient().post(url, data, content_type='application/json')
+
+    async def test_run_lifecycle(self):
+        self.assertEqual((await self.post(f'/api/async/runs/{self.run.id}/start/', {})).status_code, 200)
+        self.assertEqual((await self.post(f'/api/async/runs/{self.run.id}/start/', {})).status_code, 400)
+
+        # Одновременные точки одного забега: транзакция с блокировкой забега не теряет ни одну
+        # и не путает порядок, дистанция позиций растет вместе с id
+        responses = await asyncio.gather(*(
+            self.post('/api/async/positions/', {'run': self.run.id, 'latitude': 55.75 + i * 0.001,
+                                                'longitude': 37.6, 'date_time': f'2025-01-01T10:00:0{i}'})
+            for i in range(4)))
+        self.assertEqual([response.status_code for response in responses], [201] * 4)
+        run = await Run.objects.aget(id=self.run.id)
+        self.assertEqual(run.positions_count, 4)
+        distances = [distance async for distance in
+                     Position.objects.filter(run=run).order_by('id').values_list('distance', flat=True)]
+        self.assertEqual(len(distances), 4)
+        self.assertEqual(distances, sorted(distances))
+        self.assertAlmostEqual(run.distance, 0.333, places=2)
+        self.assertEqual(await self.athlete.collectibleitems.acount(), 1)
+
+        invalid = await self.post('/api/async/positions/', {'run': self.run.id, 'latitude': 95, 'longitude': 0,
+                                                           'date_time': '2025-01-01T10:00:09'})
+        self.assertEqual(invalid.status_code, 400)
+        self.assertIn('latitude', invalid.json())
+
+        self.assertEqual((await self.post(f'/api/async/runs/{self.run.id}/stop/', {})).status_code, 200)
+        run = await Run.objects.aget(id=self.run.id)
+        self.assertEqual((run.status, run.run_time_seconds), ('finished', 3))
+        self.assertEqual((await self.post(f'/api/async/runs/{self.run.id}/stop/', {})).status_code, 400)
+        self.assertEqual((await self.post('/api/async/runs/999/stop/', {})).status_code, 404)
+
+    async def test_collectible_check(self):
+        response = await self.post('/api/async/collectible_check/', {'athlete': self.athlete.id,
+                                                                     'latitude': 55.75, 'longitude': 37.6})
+        self.assertEqual(response.json(), {'collected': [self.item.id]})
+        response = await self.post('/api/async/collectible_check/', {'athlete': self.athlete.id,
+                                                                     'latitude': 10, 'longitude': 10})
+        self.assertEqual(response.json(), {'collected': []})
+
+    async def test_buffered_position(self):
+        await Run.objects.filter(id=self.run.id).aupdate(status='in_progress')
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(POSITION_INGEST_MODE='buffered', POSITION_INGEST_LOG_DIR=directory,
+                                  POSITION_INGEST_FLUSH_INTERVAL=None):
+            self.addCleanup(setattr, ingest, '_buffer', None)
+            response = await self.post('/api/async/positions/', {'run': self.run.id, 'latitude': 55.75,
+                                                                 'longitude': 37.6, 'date_time': '2025-01-01T10:00:00'})
+            self.assertEqual(response.status_code, 202)
+            [name] = os.listdir(directory)
+            with open(os.path.join(directory, name)) as file:
+                self.assertEqual(json.loads(file.read())['run'], self.run.id)
+        self.assertEqual(await self.athlete.collectibleitems.acount(), 1)
+
+    async def test_abump_version_without_version(self):
+        # Версии нет в кеше: начальное значение ставится асинхронным API кеша
+        await caches['default'].adelete('app_run:version:app_run.async-test')
+        with mock.patch('app_run.caching.get_version', side_effect=AssertionError):
+            version = await abump_version('app_run.async-test')
+        self.assertEqual(version, await aget_version('app_run.async-test'))
+        self.assertEqual(await abump_version('app_run.async-test'), version + 1)
+
+    async def test_metrics_middleware_async(self):
+        # Запросы к БД идут в потоках sync_to_async, а не в потоке middleware, и все равно считаются
+        registry.reset()
+        await self.post(f'/api/async/runs/{self.run.id}/start/', {})
+        await AsyncClient().get('/api/challenges/')
+        await AsyncClient().get(f'/api/runs/{self.run.id}/')
+        lines = dict(line.rsplit(' ', 1) for line in registry.render().splitlines() if not line.startswith('#'))
+        for route, method in (('api/async/runs/<int:run_id>/start/', 'POST'), ('^api/challenges/$', 'GET'),
+                              ('^api/runs/(?P<pk>[^/.]+)/$', 'GET')):
+            with self.subTest(route=route):
+                labels = f'{{route="{route}",method="{method}"}}'
+                self.assertEqual(lines[f'app_run_request_queries_count{labels}'], '1')
+                self.assertGreater(float(lines[f'app_run_request_queries_sum{labels}']), 0)
+                self.assertGreater(float(lines[f'app_run_request_sql_duration_seconds_sum{labels}']), 0)
+
+
+class LiveFeedTestCase(TestCase):
+    def setUp(self):
+        athlete = User.objects.create(username='athlete')
+        self.run = Run.objects.create(athlete=athlete, comment='', status='in_progress')
+
+    def post_position(self, second):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/positions/', {'run': self.run.id, 'latitude': 55.75 + second * 0.001,
+                                                        'longitude': 37.6,
+                                                        'date_time': f'2025-01-01T10:00:{second:02d}'}).json()['id']
+
+    async def events(self, stream, count):
+        frames = []
+        while len(frames) < count:
+            frame = (await anext(stream)).decode()
+            if frame.startswith('event:') or frame.startswith('id:'):
+                frames.append(dict(line.split(': ', 1) for line in frame.strip().split('\n')))
+        return frames
+
+    async def test_live_feed(self):
+        first = await sync_to_async(self.post_position)(0)
+        response = await AsyncClient().get(f'/api/runs/{self.run.id}/live/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual([frame['id'] for frame in await self.events(stream, 1)], [str(first)])
+
+        second = await sync_to_async(self.post_position)(1)
+        [frame] = await self.events(stream, 1)
+        self.assertEqual((frame['event'], frame['id']), ('position', str(second)))
+        self.assertEqual(json.loads(frame['data'])['latitude'], '55.751000')
+
+        await sync_to_async(self.stop)()
+        [frame] = await self.events(stream, 1)
+        self.assertEqual(frame['event'], 'finished')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertFalse(feed.has_subscribers(self.run.id))
+
+        # Переподключение к завершенному забегу: только пропущенное и итог
+        resumed = await AsyncClient().get(f'/api/runs/{self.run.id}/live/', headers={'Last-Event-ID': str(first)})
+        frames = await self.events(aiter(resumed.streaming_content), 2)
+        self.assertEqual([frame['event'] for frame in frames], ['position', 'finished'])
+        self.assertEqual(frames[0]['id'], str(second))
+
+    def stop(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f'/api/runs/{self.run.id}/stop/').status_code, 200)
+
+    @override_settings(LIVE_FEED_HEARTBEAT=0.05)
+    async def test_catch_up_from_other_process(self):
+        response = await AsyncClient().get(f'/api/runs/{self.run.id}/live/')
+        stream = aiter(response.streaming_content)
+        await anext(stream)
+        # Точка и финиш из другого процесса: в ленту этого процесса они не публикуются
+        position = await Position.objects.acreate(run=self.run, latitude=55.75, longitude=37.6)
+        [frame] = await asyncio.wait_for(self.events(stream, 1), 5)
+        self.assertEqual(frame['id'], str(position.id))
+        await Run.objects.filter(id=self.run.id).aupdate(status='finished')
+        [frame] = await asyncio.wait_for(self.events(stream, 1), 5)
+        self.assertEqual(frame['event'], 'finished')
+
+    @override_settings(LIVE_FEED_HEARTBEAT=60)
+    async def test_points_of_other_process_between_local_ones(self):
+        # Пульс тишины не наступает: точки другого процесса приходят вместе с сигналом о своих
+        response = await AsyncClient().get(f'/api/runs/{self.run.id}/live/')
+        stream = aiter(response.streaming_content)
+        await anext(stream)
+        first = await sync_to_async(self.post_position)(0)
+        [frame] = await asyncio.wait_for(self.events(stream, 1), 5)
+        self.assertEqual(frame['id'], str(first))
+        other = await Position.objects.acreate(run=self.run, latitude=55.75, longitude=37.6)
+        third = await sync_to_async(self.post_position)(2)
+        frames = await asyncio.wait_for(self.events(stream, 2), 5)
+        self.assertEqual([frame['id'] for frame in frames], [str(other.id), str(third)])
+
+    def test_requires_asgi(self):
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/live/').status_code, 501)
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    query_budgets = [
+        ('GET', '/api/users/{self.athlete.id}/', 2),
+        ('GET', '/api/users/{self.coach.id}/', 3),
+        # Проверка упакованного трека и страница позиций
+        ('GET', '/api/positions/?run={self.run.id}&size=100', 2),
+        # Первая точка забега еще и проверяет, нет ли у него позиций без накопительной статистики
+        ('POST', '/api/positions/', 9, {'run': '{self.run.id}', 'latitude': 55.75, 'longitude': 37.6,
+                                        'date_time': '2025-01-01T10:00:00'}),
+        # Первый финиш атлета создает его строки лидербордов и объема тренировок,
+        # сохранение забега сбрасывает ростеры его тренеров
+        ('POST', '/api/runs/{self.run.id}/stop/', 18),
+        # Трек еще не упакован командой: позиции по-прежнему читаются из таблицы
+        ('GET', '/api/positions/?run={self.run.id}&size=100', 2),
+        # Первый запрос строит снимок аналитики, следующие только читают его
+        ('GET', '/api/analytics_for_coach/{self.coach.id}/', 9),
+        ('GET', '/api/analytics_for_coach/{self.coach.id}/', 1),
+        ('GET', '/api/roster_for_coach/{self.coach.id}/', 4),
+        ('GET', '/api/challenges_summary/', 1),
+    ]
+
+    def setUp(self):
+        self.coach = User.objects.create(username='coach', is_staff=True, is_superuser=True)
+        self.athlete = User.objects.create(username='athlete', is_superuser=True)
+        Subscription.objects.create(coach=self.coach, athlete=self.athlete)
+        self.run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress')
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_metrics_endpoint(self):
+        athlete = User.objects.create(username='athlete')
+        run = Run.objects.create(athlete=athlete, comment='')
+        self.client.post(f'/api/runs/{run.id}/start/')
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        response = self.client.get('/api/internal/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE app_run_request_duration_seconds histogram', body)
+        self.assertIn('app_run_request_queries_count{route="api/runs/<int:run_id>/start/",method="POST"} 1', body)
+        self.assertIn('app_run_request_queries_bucket{route="api/runs/<int:run_id>/start/",method="POST",le="+Inf"} 1',
+                      body)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_staff_only_without_token(self):
+        self.assertEqual(self.client.get('/api/internal/metrics/').status_code, 403)
+        self.client.force_login(User.objects.create(username='athlete'))
+        self.assertEqual(self.client.get('/api/internal/metrics/').status_code, 403)
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        self.assertEqual(self.client.get('/api/internal/metrics/').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/internal/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/api/internal/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                         403)
+        self.assertEqual(self.client.get('/api/internal/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code,
+                         200)
+
+
+class BenchmarkCommandsTestCase(TestCase):
+    def test_generate_and_benchmark(self):
+        call_command('generate_dataset', users=20, coaches=2, subscriptions=10, items=50, runs=10, positions=100,
+                     stdout=StringIO())
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Position.objects.count(), 100)
+        run = Run.objects.first()
+        stats = AthleteStats.objects.get(user=run.athlete)
+        self.assertEqual(stats.finished_runs, Run.objects.filter(athlete=run.athlete).count())
+
+        counts = [model.objects.count() for model in (Run, Position, Challenge, ImportJob, Subscription)]
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark_endpoints', repeat=2, output=output, stdout=StringIO(), stderr=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+        # Все записи бенчмарка откачены
+        self.assertEqual([model.objects.count() for model in (Run, Position, Challenge, ImportJob, Subscription)],
+                         counts)
+        routes = {result['route'] for result in report['results']}
+        self.assertIn('api/runs/<int:run_id>/stop/', routes)
+        for result in report['results']:
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
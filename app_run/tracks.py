@@ -0,0 +1,75 @@
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+
+
+# Упакованный трек: заголовок (сигнатура, версия, число точек) и сжатые zlib колонки
+# id, широта и долгота в миллионных долях градуса, время в микросекундах, скорость и
+# дистанция в сотых. Колонки хранятся разностями соседних значений с перестановкой байт,
+# так что у соседних точек почти все байты нулевые и хорошо сжимаются.
+# Скорость и дистанция позиций уже округлены до сотых (Run.add_positions), координаты
+# до шести знаков (DecimalField), поэтому упаковка без потерь.
+TRACK_MAGIC = b'TRK'
+TRACK_VERSION = 1
+_HEADER = struct.Struct('<3sBI')
+_COLUMNS = 6
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_column(values):
+    deltas = np.diff(np.asarray(values, dtype='<i8'), prepend=np.int64(0))
+    return deltas.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def _decode_column(data, count):
+    deltas = np.frombuffer(data, dtype=np.uint8).reshape(8, count).T.copy().view('<i8').ravel()
+    return np.cumsum(deltas)
+
+
+def _microseconds(date_time):
+    if date_time.tzinfo is None:
+        date_time = date_time.replace(tzinfo=timezone.utc)
+    return (date_time - _EPOCH) // timedelta(microseconds=1)
+
+
+def pack_track(points):
+    # points - последовательность (id, latitude, longitude, date_time, speed, distance)
+    points = list(points)
+    count = len(points)
+    ids, latitudes, longitudes, date_times, speeds, distances = zip(*points) if points else ([],) * _COLUMNS
+    missing_time = np.array([date_time is None for date_time in date_times], dtype=bool)
+    columns = [
+        ids,
+        np.rint(np.asarray(latitudes, dtype=np.float64) * 1e6),
+        np.rint(np.asarray(longitudes, dtype=np.float64) * 1e6),
+        [0 if date_time is None else _microseconds(date_time) for date_time in date_times],
+        np.rint(np.asarray(speeds, dtype=np.float64) * 100),
+        np.rint(np.asarray(distances, dtype=np.float64) * 100),
+    ]
+    payload = b''.join(_encode_column(column) for column in columns) + np.packbits(missing_time).tobytes()
+    return _HEADER.pack(TRACK_MAGIC, TRACK_VERSION, count) + zlib.compress(payload)
+
+
+def unpack_track(data):
+    # Обратное к pack_track: список кортежей (id, latitude, longitude, date_time, speed, distance)
+    magic, version, count = _HEADER.unpack_from(data)
+    if magic != TRACK_MAGIC or version != TRACK_VERSION:
+        raise ValueError(f'Неизвестный формат трека: {magic!r} v{version}')
+    payload = zlib.decompress(bytes(data[_HEADER.size:]))
+    size = count * 8
+    ids, latitudes, longitudes, times, speeds, distances = (
+        _decode_column(payload[i * size:(i + 1) * size], count).tolist() for i in range(_COLUMNS))
+    missing_time = np.unpackbits(np.frombuffer(payload[_COLUMNS * size:], dtype=np.uint8), count=count)
+
+    return [
+        (ids[i],
+         Decimal(latitudes[i]).scaleb(-6),
+         Decimal(longitudes[i]).scaleb(-6),
+         None if missing_time[i] else _EPOCH + timedelta(microseconds=times[i]),
+         speeds[i] / 100,
+         distances[i] / 100)
+        for i in range(count)
+    ]
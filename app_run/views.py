@@ -1,45 +1,87 @@
-from django.db.models import Sum, Count, Q, Avg, Max
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Q, Avg, OuterRef, Subquery, prefetch_related_objects
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import viewsets, status
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
 
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscription
+from .models import Run, AthleteInfo, Challenge, Position, CollectibleItem, Subscription, ImportJob, \
+    CoachAnalytics, RunTrack
 from .serializers import RunSerializer, UserSerializer, ChallengeSerializer, PositionSerializer, \
-    CollectibleItemSerializer, CoachSerializer, AthleteSerializer
+    CollectibleItemSerializer, CoachSerializer, AthleteSerializer, PositionBatchSerializer, ImportJobSerializer, \
+    RosterAthleteSerializer
+from .spatial import collect_nearby_items
+from .importers import ITEM_COLUMNS
+from .jobs import submit_import_job, import_uploaded_gpx
+from .services import stop_run
+from .challenges import challenge_summary
+from .analytics import rebuild_coach_analytics
+from .caching import CachedResponseMixin, cache_response, cached_response
+from .pagination import MyPagination, RunPagination, PositionPagination, RosterPagination
+from .simplify import simplify_track, MAX_ZOOM
+from .exports import EXPORT_FORMATS
+from .live import publish_positions
+from .ingest import ingest_mode, get_position_buffer, BUFFERED
+from .leaderboards import BOARDS, PERIODS, get_leaderboard
+from .rollups import training_volume, MAX_ATHLETES, MAX_POINTS, PERIODS as ROLLUP_PERIODS
+from .roster import version_name as roster_version_name
 from django.contrib.auth.models import User
-from geopy.distance import geodesic
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 import openpyxl as op
+import io
+import datetime
 
 
 @api_view(['GET'])
+@cache_response()
 def company_details(request):
-    print('DEBUG 123456789')
-    print('DEBUG FFFFFFFFF')
     return Response({'company_name': 'Бегуны - фантомасы',
                      'slogan':'Бег - это чудо!',
                      'contacts': 'Тел. 222-232-3222'})
 
 
-class MyPagination(PageNumberPagination):
-    page_size_query_param = 'size'
-
-
 class RunViewSet(viewsets.ModelViewSet):
     queryset = Run.objects.select_related('athlete').all()
     serializer_class = RunSerializer
-    pagination_class = MyPagination
+    pagination_class = RunPagination
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['status', 'athlete']
     ordering_fields = ['created_at']
 
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        # Упрощенный трек для карты: ?tolerance=<метры> или ?zoom=<0..22>
+        run = self.get_object()
+        try:
+            zoom = int(request.query_params['zoom']) if 'zoom' in request.query_params else None
+            tolerance = float(request.query_params.get('tolerance', 0)) if zoom is None else None
+        except ValueError:
+            return Response({'message': 'zoom должен быть целым, tolerance - числом'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if zoom is not None and not 0 <= zoom <= MAX_ZOOM:
+            return Response({'message': f'zoom должен быть от 0 до {MAX_ZOOM}'}, status=status.HTTP_400_BAD_REQUEST)
+        if tolerance is not None and not tolerance > 0:
+            return Response({'message': 'Укажите zoom или tolerance больше 0'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def build():
+            return Response({'run': run.id, **simplify_track(run.track_positions(), tolerance, zoom)})
+
+        if run.status != 'finished':
+            return build()
+        # Позиции завершенного забега меняются только при перепаковке трека
+        return cached_response(request, [RunTrack.version_name(run.id)], build,
+                               timeout=settings.SIMPLIFIED_TRACK_CACHE_TIMEOUT)
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+
+class UserViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = UserSerializer
     pagination_class = MyPagination
     # queryset = User.objects.filter(is_superuser=False)
@@ -48,31 +90,39 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['first_name', 'last_name']
     ordering_fields = ['date_joined']
+    # Кешируется только список, retrieve переопределен ниже
+    cache_dependencies = [User, Run, Subscription]
 
     def get_queryset(self):
         qs = self.queryset
         user_type = self.request.query_params.get('type')
-        print('DEBUG user_type', user_type)
         if user_type and user_type=='coach':
             qs = qs.filter(is_staff=True)
         if user_type and user_type=='athlete':
             qs = qs.filter(is_staff=False)
-        qs = qs.annotate(runs_finished=Count('run', filter=Q(run__status='finished')))
+        qs = qs.annotate(runs_finished=Count('run', filter=Q(run__status='finished'), distinct=True))
         qs = qs.annotate(rating=Avg('athletes__rating'))
-        print('DEBUG qs', qs)
+        if self.action == 'retrieve':
+            coach_subquery = Subscription.objects.filter(athlete=OuterRef('pk')).order_by('id').values('coach_id')[:1]
+            qs = qs.annotate(coach_id=Subquery(coach_subquery))
         return qs
 
     def get_serializer_class(self):
-        if self.action == 'list':
-            return UserSerializer
-        elif self.action == 'retrieve':
-            # return UserDetailSerializer
-            user = self.get_object() # крутой метод! почему я его не знал!!
-            if user.is_staff:
-                return CoachSerializer
-            else:
-                return AthleteSerializer
-        return super().get_serializer_class()
+        if self.action == 'retrieve':
+            return AthleteSerializer
+        return UserSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        # Тип пользователя известен только после загрузки, поэтому связанные данные
+        # догружаются отдельно: 2 запроса для бегуна, 3 для тренера
+        user = self.get_object()
+        if user.is_staff:
+            prefetch_related_objects([user], 'collectibleitems', 'athletes')
+            serializer = CoachSerializer(user, context=self.get_serializer_context())
+        else:
+            prefetch_related_objects([user], 'collectibleitems')
+            serializer = AthleteSerializer(user, context=self.get_serializer_context())
+        return Response(serializer.data)
 
 
 class StatusStartView(APIView):
@@ -89,46 +139,14 @@ class StatusStartView(APIView):
 
 class StatusStopView(APIView):
     def post(self, request, run_id):
-        run = get_object_or_404(Run, id=run_id)
-        if run.status == 'in_progress':
-            run.status = 'finished'
-            if Position.objects.filter(run=run_id).exists():
-                # -------------------------------------------
-                positions_qs = Position.objects.filter(run=run_id)
-                positions_quantity = len(positions_qs)
-                distance = 0
-                for i in range(positions_quantity-1):
-                    distance += geodesic((positions_qs[i].latitude,positions_qs[i].longitude), (positions_qs[i+1].latitude,positions_qs[i+1].longitude)).kilometers
-                run.distance = distance
-                # -------------------------------------------
-                positions_qs_sorted_by_date = positions_qs.order_by('date_time')
-                run_time = positions_qs_sorted_by_date[positions_quantity-1].date_time - positions_qs_sorted_by_date[0].date_time
-                run.run_time_seconds = run_time.total_seconds()
-                #-------------------------------------------
-                average_speed = positions_qs.aggregate(Avg('speed'))
-                run.speed = round(average_speed['speed__avg'], 2)
-                print('DEBUG average_speed', average_speed)
-            run.save()
-            # -------------------------------------------
-            if Run.objects.filter(status='finished', athlete=run.athlete).count() >= 10:
-                challenge, created = Challenge.objects.get_or_create(full_name='Сделай 10 Забегов!',
-                                                                     athlete=run.athlete)
-            # -------------------------------------------
-            distance_sum = Run.objects.filter(status='finished', athlete=run.athlete).aggregate(Sum('distance'))
-
-            if distance_sum['distance__sum'] >= 50:
-                challenge, created = Challenge.objects.get_or_create(full_name='Пробеги 50 километров!',
-                                                                     athlete=run.athlete)
-            # -------------------------------------------
-            if run.distance >= 2 and run.run_time_seconds <= 600:
-                challenge, created = Challenge.objects.get_or_create(
-                    full_name='2 километра за 10 минут!',
-                    athlete=run.athlete)
-
-            return Response({'message': 'Все ништяк'}, status=status.HTTP_200_OK)
-        else:
+        try:
+            stopped = stop_run(run_id)
+        except Run.DoesNotExist:
+            raise Http404
+        if not stopped:
             return Response({'message': 'Этот забег финишировать нельзя, он еще не стартовал или уже завершен'},
                             status=status.HTTP_400_BAD_REQUEST)
+        return Response({'message': 'Все ништяк'}, status=status.HTTP_200_OK)
 
 
 class AthleteInfoView(APIView):
@@ -162,9 +180,10 @@ class AthleteInfoView(APIView):
         return Response({'message': 'Создано/изменено'}, status=status.HTTP_201_CREATED)
 
 
-class ChallengeViewSet(viewsets.ReadOnlyModelViewSet):
+class ChallengeViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Challenge.objects.all()
     serializer_class = ChallengeSerializer
+    cache_dependencies = [Challenge]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['athlete']
 
@@ -172,6 +191,7 @@ class ChallengeViewSet(viewsets.ReadOnlyModelViewSet):
 class PositionViewSet(viewsets.ModelViewSet):
     queryset = Position.objects.all()
     serializer_class = PositionSerializer
+    pagination_class = PositionPagination
 
     def get_queryset(self):
         qs = self.queryset
@@ -180,22 +200,58 @@ class PositionViewSet(viewsets.ModelViewSet):
             qs = qs.filter(run=run_id)
         return qs
 
+    def list(self, request, *args, **kwargs):
+        # У завершенного забега трек упакован в RunTrack: одна строка вместо всех позиций
+        run_id = request.query_params.get('run', '')
+        track = RunTrack.objects.filter(run_id=run_id).first() if run_id.isdigit() else None
+        if track is None:
+            return super().list(request, *args, **kwargs)
+        positions = track.positions()
+        page = self.paginate_queryset(positions)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(positions, many=True).data)
+
+    def create(self, request, *args, **kwargs):
+        if ingest_mode() != BUFFERED:
+            return super().create(request, *args, **kwargs)
+        # Точка записана в журнал процесса и попадет в базу с ближайшей пачкой, поэтому id,
+        # speed и distance в ответе еще нет
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        get_position_buffer().append(data['run'].id, data['latitude'], data['longitude'], data['date_time'])
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
     def perform_create(self, serializer):
-        run = serializer.validated_data['run']
-        serializer.save()  # чтобы включить только что создаваемую позицию в QS
-        all_positions = Position.objects.filter(run=run)
-        if all_positions.count() > 1:
-            ordered_positions = all_positions.order_by('-id')
-            last_position = ordered_positions[0]
-            previous_position = ordered_positions[1]
-            previous_distance = previous_position.distance
-            last_distance = geodesic((last_position.latitude, last_position.longitude),
-                                     (previous_position.latitude, previous_position.longitude)).meters
-            time_delta = last_position.date_time - previous_position.date_time
-            speed = last_distance / time_delta.total_seconds()
-            last_position.speed = round(speed, 2)
-            last_position.distance = round(previous_distance + last_distance / 1000, 2)
-            last_position.save()
+        with transaction.atomic():
+            run = Run.objects.select_for_update().get(id=serializer.validated_data['run'].id)
+            # Сериализатор проверял статус до блокировки, забег могли завершить параллельно
+            if run.status != 'in_progress':
+                raise ValidationError({'non_field_errors': ['Забег должен быть начат и еще не закончен']})
+            position = Position(**serializer.validated_data)
+            run.add_position(position)
+            position = serializer.save(run=run, speed=position.speed, distance=position.distance)
+            run.save(update_fields=Run.STATS_FIELDS)
+            publish_positions(run.id)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        # Пакетная загрузка позиций одного забега, накопленных устройством без связи
+        serializer = PositionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            run = Run.objects.select_for_update().get(id=serializer.validated_data['run'].id)
+            if run.status != 'in_progress':
+                raise ValidationError({'run': ['Забег должен быть начат и еще не закончен']})
+            positions = [Position(run=run, **point) for point in serializer.validated_data['positions']]
+            run.add_positions(positions)
+            Position.objects.bulk_create(positions)
+            run.save(update_fields=Run.STATS_FIELDS)
+            publish_positions(run.id)
+        collect_nearby_items(run.athlete, [(position.latitude, position.longitude) for position in positions])
+        return Response({'run': run.id, 'created': len(positions), 'distance': run.distance},
+                        status=status.HTTP_201_CREATED)
 
     # def create(self, request, pk=None): # Добавил 28 мая, версия студента, можно удалить
     #     data = request.data
@@ -251,43 +307,96 @@ class PositionViewSet(viewsets.ModelViewSet):
     #     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CollectibleItemViewSet(viewsets.ReadOnlyModelViewSet):
+class CollectibleItemViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = CollectibleItem.objects.all()
     serializer_class = CollectibleItemSerializer
+    cache_dependencies = [CollectibleItem]
+
+
+def _export_response(runs, export_format, filename):
+    if export_format not in EXPORT_FORMATS:
+        return Response({'message': f'Формат должен быть одним из: {", ".join(EXPORT_FORMATS)}'},
+                        status=status.HTTP_404_NOT_FOUND)
+    stream, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(runs), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+@api_view(['GET'])
+def run_export_view(request, run_id, export_format):
+    run = get_object_or_404(Run, id=run_id)
+    return _export_response([run], export_format, f'run_{run.id}')
+
+
+@api_view(['GET'])
+def athlete_export_view(request, user_id, export_format):
+    # Все забеги атлета с позициями, забеги читаются курсором по мере отдачи. Позиции - строки
+    # Position или упакованный трек; positions_count у забегов до накопительной статистики 0
+    athlete = get_object_or_404(User, id=user_id)
+    runs = Run.objects.filter(Exists(Position.objects.filter(run=OuterRef('pk'))) | Q(track__isnull=False),
+                              athlete=athlete).order_by('created_at', 'id')
+    return _export_response(runs.iterator(chunk_size=100), export_format, f'athlete_{athlete.id}_runs')
+
+
+@api_view(['POST'])
+def athlete_import_gpx_view(request, user_id):
+    # Исторические забеги из GPX: один или несколько файлов в поле file, каждый <trk> - забег
+    athlete = get_object_or_404(User, id=user_id)
+    files = request.FILES.getlist('file')
+    if not files:
+        return Response({'message': 'Нужен хотя бы один GPX-файл в поле file'}, status=status.HTTP_400_BAD_REQUEST)
+    results = import_uploaded_gpx(athlete, files)
+    imported = any(result['runs'] for result in results)
+    return Response(results, status=status.HTTP_201_CREATED if imported else status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
 def upload_view(request):
+    # Загрузка выполняется в фоне, статус доступен по job_id
     if request.method == 'POST' and request.FILES.get('file'):
-        uploaded_xlsx_file = request.FILES['file']
-        wb = op.load_workbook(uploaded_xlsx_file, data_only=True)
-        sheet = wb.active
-        wrong_rows_list = []
-        for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row, values_only=True):
-            name, uid, value, latitude, longitude, picture = row
-            data = {
-                'name': name,
-                'uid': uid,
-                'latitude': latitude,
-                'longitude': longitude,
-                'picture': picture,
-                'value': value,
-            }
-            serializer = CollectibleItemSerializer(data=data)
-            if serializer.is_valid():
-                CollectibleItem.objects.create(name=name,
-                                               uid=uid,
-                                               value=value,
-                                               latitude=latitude,
-                                               longitude=longitude,
-                                               picture=picture)
-            else:
-                wrong_rows_list.append([name, uid, value, latitude, longitude, picture])
-
-        return Response(wrong_rows_list)
+        job = submit_import_job(request.FILES['file'])
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
     return Response([])
 
 
+@api_view(['GET'])
+def upload_status_view(request, job_id):
+    job = get_object_or_404(ImportJob, id=job_id)
+    return Response(ImportJobSerializer(job).data)
+
+
+@api_view(['GET'])
+def upload_rejected_rows_view(request, job_id):
+    job = get_object_or_404(ImportJob, id=job_id)
+    if job.status == 'failed':
+        # Файла отклоненных строк нет и не будет, отдаем ошибку загрузки
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if job.status != 'finished':
+        return Response({'message': 'Загрузка еще не завершена'}, status=status.HTTP_409_CONFLICT)
+    if job.rejected_file:
+        try:
+            file = job.rejected_file.open('rb')
+        except FileNotFoundError:
+            # Файл в локальном MEDIA_ROOT другого сервера или удален
+            return Response({'message': 'Файл отклоненных строк недоступен'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(file, as_attachment=True, filename=f'rejected_rows_{job.id}.xlsx')
+
+    # Загрузки без отклоненных строк и старые загрузки со строками в базе
+    wb = op.Workbook(write_only=True)
+    sheet = wb.create_sheet()
+    sheet.append(ITEM_COLUMNS)
+    for row in job.rejected_rows:
+        sheet.append(row)
+    content = io.BytesIO()
+    wb.save(content)
+
+    response = HttpResponse(content.getvalue(),
+                            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response['Content-Disposition'] = f'attachment; filename="rejected_rows_{job.id}.xlsx"'
+    return response
+
+
 class SubscribeView(APIView):
     def post(self, request, id):
         coach_id = id
@@ -313,22 +422,8 @@ class SubscribeView(APIView):
 
 @api_view(['GET'])
 def challenge_summary_view(request):
-    # Получим список уникальных названий челленджей
-    unique_challenges = Challenge.objects.values('full_name').distinct()
-    unique_name_list = [i['full_name'] for i in unique_challenges]
-
-    #Получим список атлетов для каждого челленджа
-    final_list = []
-    for challenge_name in unique_name_list:
-        user_queryset = User.objects.filter(challenge__full_name=challenge_name)
-        athletes_list = []
-        for athlete in user_queryset:
-            athletes_list.append({'id': athlete.id, 'full_name': f'{athlete.first_name} {athlete.last_name}',
-                                  'username': athlete.username})
-
-        final_list.append({'name_to_display':challenge_name, 'athletes':athletes_list})
-
-    return Response(final_list)
+    # Сводка строится одним запросом и хранится в памяти до появления нового челленджа
+    return Response(challenge_summary.get())
 
 
 class CoachRatingView(APIView):
@@ -366,30 +461,102 @@ class CoachRatingView(APIView):
 
 class AnalyticsCoachView(APIView):
     def get(self, request, coach_id):
-        coach_queryset = Subscription.objects.filter(coach=coach_id)
+        analytics = CoachAnalytics.objects.filter(coach_id=coach_id).first()
+        if analytics is None:
+            get_object_or_404(User, id=coach_id)
+            analytics = rebuild_coach_analytics(coach_id)
+
+        return Response({'longest_run_value': analytics.longest_run_value,
+                         'longest_run_user': analytics.longest_run_user,
+                         'total_run_value': analytics.total_run_value,
+                         'total_run_user': analytics.total_run_user,
+                         'speed_avg_value': analytics.speed_avg_value,
+                         'speed_avg_user': analytics.speed_avg_user
+                         })
+
+
+class LeaderboardView(APIView):
+    # /api/leaderboards/<distance|longest|speed>/?period=all|month|week&limit=10&athlete=<id>
+    def get(self, request, board):
+        if board not in BOARDS:
+            raise Http404
+        period = request.query_params.get('period', 'all')
+        if period not in PERIODS:
+            return Response({'message': f'period должен быть одним из: {", ".join(PERIODS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = request.query_params.get('limit', '10')
+        if not limit.isdigit() or not 1 <= int(limit) <= 100:
+            return Response({'message': 'limit должен быть числом от 1 до 100'}, status=status.HTTP_400_BAD_REQUEST)
+
+        leaderboard = get_leaderboard(board, period)
+        data = {'board': board, 'period': period, 'period_start': leaderboard.start, 'athletes': len(leaderboard),
+                'top': [{'rank': rank, 'athlete': athlete_id, 'value': value}
+                        for rank, athlete_id, value in leaderboard.top(int(limit))]}
+        athlete_id = request.query_params.get('athlete')
+        if athlete_id is not None:
+            place = leaderboard.rank(int(athlete_id)) if athlete_id.isdigit() else None
+            data['athlete'] = {'athlete': int(athlete_id), 'rank': place[0], 'value': place[1]} if place else None
+        return Response(data)
+
+
+class TrainingVolumeView(APIView):
+    # /api/training_volume/?athletes=1,2&period=day|week&from=2025-01-01&to=2025-03-31.
+    # По умолчанию последние 30 дней или 12 недель до сегодняшнего дня включительно
+    def get(self, request):
+        period = request.query_params.get('period', 'day')
+        if period not in ROLLUP_PERIODS:
+            return Response({'message': f'period должен быть одним из: {", ".join(ROLLUP_PERIODS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        athletes = request.query_params.get('athletes', '').split(',')
+        if not all(athlete.isdigit() for athlete in athletes) or not 1 <= len(athletes) <= MAX_ATHLETES:
+            return Response({'message': f'athletes - от 1 до {MAX_ATHLETES} id через запятую'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        step = datetime.timedelta(days=1 if period == 'day' else 7)
+        try:
+            date_to = parse_date(request.query_params.get('to', '')) or timezone.localdate()
+            date_from = parse_date(request.query_params.get('from', '')) \
+                or date_to - step * (29 if period == 'day' else 11)
+        except ValueError:
+            date_to = date_from = None
+        if date_to is None or date_from is None or date_from > date_to:
+            return Response({'message': 'from и to - даты ГГГГ-ММ-ДД, from не позже to'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if (date_to - date_from) / step >= MAX_POINTS:
+            return Response({'message': f'Не больше {MAX_POINTS} точек графика на атлета'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        volume = training_volume([int(athlete) for athlete in athletes], period, date_from, date_to)
+        return Response({'period': period, 'from': date_from, 'to': date_to,
+                         'athletes': [{'athlete': athlete_id, 'points': points} for athlete_id, points in volume.items()]})
 
-        qs_with_additional_fields = coach_queryset.annotate(
-            max_distance=Max('athlete__run__distance'),
-            sum_distances=Sum('athlete__run__distance'),
-            avg_speed=Avg('athlete__run__speed')
-        )
 
-        longest_qs = qs_with_additional_fields.order_by('-max_distance').first()
-        longest_run_value = longest_qs.max_distance
-        longest_run_user = longest_qs.athlete_id
-
-        max_total_run_qs = qs_with_additional_fields.order_by('-sum_distances').first()
-        total_run_value = max_total_run_qs.sum_distances
-        total_run_user = max_total_run_qs.athlete_id
-
-        max_avg_speed_qs = qs_with_additional_fields.order_by('-avg_speed').first()
-        speed_avg_value = max_avg_speed_qs.avg_speed
-        speed_avg_user = max_avg_speed_qs.athlete_id
-
-        return Response({'longest_run_value': longest_run_value,
-                         'longest_run_user': longest_run_user,
-                         'total_run_value': total_run_value,
-                         'total_run_user': total_run_user,
-                         'speed_avg_value': speed_avg_value,
-                         'speed_avg_user': speed_avg_user
-                         })
\ No newline at end of file
+class CoachRosterView(APIView):
+    # Бегуны тренера со счетчиками и последним забегом: 4 запроса на страницу при любом размере
+    # ростера (тренер, COUNT, страница подписок с профилями и AthleteStats, последние забеги).
+    # Ответ кешируется до смены версии ростера (roster.py). Точки забега версию не меняют, поэтому
+    # дистанция и время забега в процессе в latest_run отстают до RESPONSE_CACHE_TIMEOUT секунд;
+    # старт и финиш забега видны сразу
+    pagination_class = RosterPagination
+
+    def get(self, request, coach_id):
+        return cached_response(request, [roster_version_name(coach_id)], lambda: self.build(request, coach_id))
+
+    def build(self, request, coach_id):
+        get_object_or_404(User, id=coach_id, is_staff=True)
+        latest_run = Run.objects.filter(athlete=OuterRef('athlete_id')).order_by('-created_at', '-id').values('id')[:1]
+        subscriptions = (Subscription.objects.filter(coach_id=coach_id)
+                         .select_related('athlete', 'athlete__stats')
+                         .annotate(latest_run_id=Subquery(latest_run))
+                         .order_by('athlete_id'))
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(subscriptions, request, view=self)
+        runs = Run.objects.in_bulk([subscription.latest_run_id for subscription in page
+                                    if subscription.latest_run_id is not None])
+        athletes = []
+        for subscription in page:
+            athlete = subscription.athlete
+            athlete.rating = subscription.rating
+            athlete.latest_run = runs.get(subscription.latest_run_id)
+            athletes.append(athlete)
+        return paginator.get_paginated_response(RosterAthleteSerializer(athletes, many=True).data)
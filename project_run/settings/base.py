@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_run.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -131,4 +133,60 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 #             "level": "DEBUG",
 #         },
 #     },
-# }
\ No newline at end of file
+# }
+# Фоновая загрузка каталога предметов (app_run/jobs.py)
+UPLOAD_JOB_WORKERS = 2
+# Файлы отклоненных строк загрузок (ImportJob.rejected_file) в хранилище файлов Django. Файл пишет
+# процесс, выполнивший загрузку, а скачать его могут с любого сервера, поэтому при нескольких серверах
+# (и в Lambda, где диск не общий и не постоянный) STORAGES['default'] должно быть общим хранилищем,
+# например S3 через django-storages. С локальным MEDIA_ROOT другие серверы отвечают 404
+MEDIA_ROOT = BASE_DIR / 'var' / 'media'
+
+# Версии данных и закешированные ответы (app_run/caching.py). Версии должны быть общими для всех
+# процессов: LocMemCache видит только свой процесс, поэтому с ним версии живут VERSION_CACHE_TIMEOUT
+# секунд, и другие процессы отдают устаревшие ответы не дольше этого. С общим кешем (redis,
+# memcached, django.core.cache.backends.db.DatabaseCache) VERSION_CACHE_TIMEOUT = None
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+RESPONSE_CACHE_TIMEOUT = 300
+VERSION_CACHE_TIMEOUT = 30
+
+# Расчет расстояний (app_run/geodesy.py): 'vincenty' - эллипсоид WGS-84, как geopy.distance.geodesic,
+# 'haversine' - сфера, быстрее, но с погрешностью до ~0.5%
+GEODESY_MODE = 'vincenty'
+
+# Сетка предметов для сбора по позиции (app_run/spatial.py) сбрасывается при изменении предметов в этом
+# процессе, изменения из других процессов она видит не позже чем через COLLECTIBLE_INDEX_TTL секунд
+COLLECTIBLE_INDEX_TTL = 300
+
+# /api/internal/metrics/ (app_run/metrics.py): если задан, нужен заголовок Authorization: Bearer <token>,
+# иначе метрики отдаются только пользователям с is_staff
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Завершенные забеги упаковываются в RunTrack (app_run/tracks.py) командой pack_run_tracks,
+# ее нужно запускать по расписанию. Если True, строки Position упакованного забега удаляются,
+# и позиции читаются только из трека: это и освобождает место в базе. По умолчанию строки
+# остаются, пока все, кто читает Position напрямую (админка, отчеты), не перейдут на
+# Run.track_positions; удалить их можно и разово: pack_run_tracks --prune
+PRUNE_PACKED_POSITIONS = False
+
+# Упрощенные треки завершенных забегов (/api/runs/<id>/track/) не меняются, кешируются надолго
+SIMPLIFIED_TRACK_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Пул процессов для разбора GPX (app_run/jobs.py), None - по числу ядер
+GPX_IMPORT_WORKERS = None
+
+# Живая лента забега по SSE (app_run/live.py): интервал пинга и чтения базы без сигналов
+# и пауза переподключения клиента
+LIVE_FEED_HEARTBEAT = 15
+LIVE_FEED_RETRY_MS = 3000
+
+# Запись позиций (app_run/ingest.py): 'direct' - в транзакции запроса, 'buffered' - ответ 202 после
+# записи в журнал процесса, в базу пачками из фонового потока раз в интервал или по размеру пачки
+POSITION_INGEST_MODE = 'direct'
+POSITION_INGEST_LOG_DIR = BASE_DIR / 'var' / 'ingest'
+POSITION_INGEST_FLUSH_INTERVAL = 0.5
+POSITION_INGEST_BATCH_SIZE = 1000
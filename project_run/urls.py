@@ -18,8 +18,12 @@ from django.contrib import admin
 from django.urls import path, include
 from app_run.views import company_details, StatusStartView, StatusStopView, AthleteInfoView, ChallengeViewSet, \
     PositionViewSet, CollectibleItemViewSet, upload_view, SubscribeView, challenge_summary_view, CoachRatingView, \
-    AnalyticsCoachView
+    AnalyticsCoachView, upload_status_view, upload_rejected_rows_view, run_export_view, athlete_export_view, \
+    athlete_import_gpx_view, LeaderboardView, TrainingVolumeView, \
+    CoachRosterView
 from rest_framework.routers import DefaultRouter
+from app_run.metrics import metrics_view
+from app_run import async_views
 from app_run.views import RunViewSet, UserViewSet
 
 router = DefaultRouter()
@@ -34,11 +38,26 @@ urlpatterns = [
     path('api/company_details/', company_details),
     path('api/runs/<int:run_id>/start/', StatusStartView.as_view()),
     path('api/runs/<int:run_id>/stop/', StatusStopView.as_view()),
+    path('api/runs/<int:run_id>/export/<str:export_format>/', run_export_view),
+    path('api/users/<int:user_id>/export/<str:export_format>/', athlete_export_view),
+    path('api/users/<int:user_id>/import/gpx/', athlete_import_gpx_view),
     path('api/athlete_info/<int:user_id>/', AthleteInfoView.as_view()),
     path('api/upload_file/', upload_view),
+    path('api/upload_file/<int:job_id>/', upload_status_view),
+    path('api/upload_file/<int:job_id>/rejected/', upload_rejected_rows_view),
     path('api/subscribe_to_coach/<int:id>/', SubscribeView.as_view()),
     path('api/challenges_summary/', challenge_summary_view),
     path('api/rate_coach/<int:coach_id>/', CoachRatingView.as_view()),
     path('api/analytics_for_coach/<int:coach_id>/', AnalyticsCoachView.as_view()),
+    path('api/roster_for_coach/<int:coach_id>/', CoachRosterView.as_view()),
+    path('api/leaderboards/<str:board>/', LeaderboardView.as_view()),
+    path('api/training_volume/', TrainingVolumeView.as_view()),
+    path('api/internal/metrics/', metrics_view),
+    # Асинхронные версии для запуска под ASGI (app_run/async_views.py)
+    path('api/async/positions/', async_views.position_create_view),
+    path('api/async/runs/<int:run_id>/start/', async_views.run_start_view),
+    path('api/async/runs/<int:run_id>/stop/', async_views.run_stop_view),
+    path('api/async/collectible_check/', async_views.collectible_check_view),
+    path('api/runs/<int:run_id>/live/', async_views.run_live_view),
     path('', include(router.urls))
     ]
\ No newline at end of file